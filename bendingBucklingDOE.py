@@ -7,7 +7,10 @@ sys.path.insert(1, '/me329/rchensix/.local/lib/python3.6/site-packages/')
 import networkx as nx
 import xlattice as xlt
 import dynautil as util
+import dynacards
 import slurmscheduler as sch
+import latticecache
+import resultstore
 import matplotlib.pyplot as plt
 import time
 import math
@@ -18,7 +21,7 @@ KILL_FILE = "terminate.txt"
 LOG_FILE = "log.txt"
 
 HOMEDIRECTORY = "/me329/rchensix/bending_buckling/V3/"
-LSCARDS = util.importDynaCardsList("defaultcards.k")
+LSCARDS = dynacards.loadDeck("defaultcards.k") # parsed once; use LSCARDS.copy() to override fields per DOE point
 DELAY = 5 # seconds; time between scans for completed jobs
 PRINT_EVERY = 600 # every 10 minutes; for verbose mode 1
 THETA_SWEEP = [30, 45, 60, 75, 90, 105, 120, 135, 150]
@@ -34,11 +37,21 @@ THETA_23_SWEEP = [30, 35, 40, 45, 50, 55, 60]
 
 POSTPROCESS_DELAY = 10 # to try to limit cases where postProcess is called before LS-Dyna can write the output files
 
-def postProcess(directory):
-	bndout = util.parseDynaBndout(directory + "bndout")
-	nodout = util.parseDynaNodout(directory + "nodout")
-	Fz = bndout[1][:,3]
-	uz = nodout[1][:,3]
+LATTICE_CACHE = latticecache.LatticeCache(HOMEDIRECTORY + "lattice_cache/") # reruns of a sweep skip geometry generation
+SHARED_DECK_DIRECTORY = HOMEDIRECTORY + "shared_decks/" # cards and nodes shared by all AR combinations of a theta12/theta23 pair
+RESULT_STORE = resultstore.ResultStore(HOMEDIRECTORY + "results/") # output of every finished job by parameters, e.g. RESULT_STORE.curves(1, AR2=16)
+
+def postProcess(directory, parameters=None):
+	# parameters (theta12, theta23, AR1, AR2, AR3) adds the job to RESULT_STORE so later analysis does not parse its output again
+	if parameters is None:
+		bndout = util.parseDynaBndout(directory + "bndout")
+		nodout = util.parseDynaNodout(directory + "nodout")
+		Fz = bndout[1][:,3]
+		uz = nodout[1][:,3]
+	else:
+		result = RESULT_STORE.ingest(parameters, directory)
+		Fz = result["bndout"][1][:,2]
+		uz = result["nodout"][1][:,2]
 	plt.figure()
 	plt.plot(-uz, -Fz)
 	plt.xlabel("Displacement (m)")
@@ -46,6 +59,7 @@ def postProcess(directory):
 	plt.savefig(directory + "load-displacement.png")
 	plt.close()
 
+@LATTICE_CACHE.cached
 def bendingBucklingLattice(theta12, theta23, AR1, AR2, AR3, length=10):
 	# Angles are defined in degrees!
 	# AR is defined as length/diameter
@@ -74,7 +88,7 @@ def serializedWorkflow(theta12Sweep, theta23Sweep, ARSweep, length=10, verbose=1
 						lattice = bendingBucklingLattice(theta12, theta23, AR1, AR2, AR3, length)
 						keyFile = directory + "bendingBucklingLattice_" + "T12_" + str(theta12) + "_T23_" + str(theta23) + "_AR1_" + str(AR1) + "_AR2_" + str(AR2) + "_AR3_" + str(AR3) + ".k"
 						SPCNodesAndDOF = [[set(list(range(5, 32))), (0, 1, 0, 1, 0, 1)]]
-						util.generateKeyFile(lattice, keyFile, movingNodes=[1], fixedNodes=[2, 3, 4], SPCNodesAndDOF=SPCNodesAndDOF, cards=LSCARDS)
+						util.generateKeyFile(lattice, keyFile, movingNodes=[1], fixedNodes=[2, 3, 4], SPCNodesAndDOF=SPCNodesAndDOF, cards=LSCARDS, sharedDirectory=SHARED_DECK_DIRECTORY)
 						fullPath = sch.createLSDynaBashScript(keyFile, outputDirectory=directory, numCPU=NCPU)[0]
 						jobID = mc2.submit(fullPath)[0]
 						if verbose == 1: 
@@ -94,7 +108,7 @@ def serializedWorkflow(theta12Sweep, theta23Sweep, ARSweep, length=10, verbose=1
 						# post process completed job
 						time.sleep(POSTPROCESS_DELAY)
 						try:
-							postProcess(directory)
+							postProcess(directory, {"theta12": theta12, "theta23": theta23, "AR1": AR1, "AR2": AR2, "AR3": AR3})
 						except:
 							with open(HOMEDIRECTORY + LOG_FILE, "a") as myfile:
 									myfile.write("Could not extract data from " + keyFile + "\n")
@@ -0,0 +1,201 @@
+"""
+binout
+This module reads LS-Dyna binout files (the LSDA container written for *DATABASE_... cards with binary=2 or 3) with numpy only
+
+An LSDA file is a small header followed by records. Data records hold one named array each; symbol tables list every
+array by directory path with its type, file offset, and length, so the whole table of contents is read once and arrays
+are only decoded when asked for. Each database is a directory (e.g. /nodout) with a metadata directory (ids of the
+nodes, titles) and one directory per output time (d000001, d000002, ...) holding the time and one array per field.
+
+Example:
+    with Binout("binout") as f:
+        print(f.branches())
+        history = f.readNodeHistory("nodout", [37]) # same NodeHistory as dynautil.readDynaNodout
+        times, data = f.readHistory("glstat", ["kinetic_energy", "internal_energy"])
+"""
+import mmap
+import struct
+import numpy as np
+import dynautil as util
+
+# record commands
+LSDA_CD = 2
+LSDA_DATA = 3
+LSDA_VARIABLE = 4
+LSDA_BEGINSYMBOLTABLE = 5
+LSDA_ENDSYMBOLTABLE = 6
+LSDA_SYMBOLTABLEOFFSET = 7
+
+# type id: numpy type (byte order is added from the file header), 11 is a link (file offset)
+LSDA_TYPES = {1: "i1", 2: "i2", 3: "i4", 4: "i8", 5: "u1", 6: "u2", 7: "u4", 8: "u8", 9: "f4", 10: "f8"}
+LSDA_LINK = 11
+
+_UNSIGNED = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+# binout directory and field names of the ASCII outputs dynautil parses, so both give the same NodeHistory
+NODE_BRANCHES = {
+    "nodout": ("/nodout", ("x_displacement", "y_displacement", "z_displacement"), util.NODOUT_FIELDS),
+    "bndout": ("/bndout/discrete/nodes", ("x_force", "y_force", "z_force", "energy"), util.BNDOUT_FIELDS)}
+
+class Binout:
+    # table of contents of one binout file, arrays are read from a memory map on request
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._readHeader()
+            self.variables = dict() # full path: (numpy dtype, offset of the data, number of items)
+            self._readSymbolTables()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if getattr(self, "_buffer", None) is not None:
+            self._buffer.close()
+            self._buffer = None
+        self._file.close()
+
+    def _readHeader(self):
+        # header bytes: header size, sizes of lengths, offsets, commands and type ids, then byte order (0 big endian)
+        if len(self._buffer) < 8:
+            raise ValueError(self.path + " is not an LSDA file!")
+        headerSize, lengthSize, offsetSize, commandSize, typeSize, order = struct.unpack("6B", self._buffer[0:6])
+        if any(size not in _UNSIGNED for size in (lengthSize, offsetSize, commandSize, typeSize)):
+            raise ValueError(self.path + " is not an LSDA file!")
+        self.order = ">" if order == 0 else "<"
+        self.headerSize = headerSize
+        self.lengthSize = lengthSize
+        self.offsetSize = offsetSize
+        self.commandSize = commandSize
+        self.typeSize = typeSize
+        self._command = struct.Struct(self.order + _UNSIGNED[lengthSize] + _UNSIGNED[commandSize])
+        self._offset = struct.Struct(self.order + _UNSIGNED[offsetSize])
+        self._entry = struct.Struct(self.order + _UNSIGNED[typeSize] + _UNSIGNED[offsetSize] + _UNSIGNED[lengthSize])
+        self._dataHeader = lengthSize + commandSize + typeSize + 1 # data records: length, command, type id, name length, name, data
+
+    def _readCommand(self, offset):
+        # (record length, command) of the record at offset
+        if offset + self._command.size > len(self._buffer):
+            raise EOFError
+        return self._command.unpack_from(self._buffer, offset)
+
+    def _readSymbolTables(self):
+        # the record after the header points to the first symbol table, every table ends with the offset of the next (0 after the last)
+        length, command = self._readCommand(self.headerSize)
+        if command != LSDA_SYMBOLTABLEOFFSET:
+            raise ValueError(self.path + " has no symbol table offset!")
+        table = self._offset.unpack_from(self._buffer, self.headerSize + self._command.size)[0]
+        directory = "/"
+        while table != 0:
+            try:
+                length, command = self._readCommand(table)
+            except EOFError:
+                break # table offset written before the table itself (file still being written)
+            if command != LSDA_BEGINSYMBOLTABLE:
+                raise ValueError(self.path + " has no symbol table at offset " + str(table) + "!")
+            offset = table + length
+            table = 0
+            while True:
+                try:
+                    length, command = self._readCommand(offset)
+                except EOFError:
+                    break # incomplete table at the end of a file that is still being written
+                if length == 0 or offset + length > len(self._buffer):
+                    break
+                body = offset + self._command.size
+                if command == LSDA_CD:
+                    directory = joinPath(directory, self._buffer[body:offset + length].decode("ascii"))
+                elif command == LSDA_VARIABLE:
+                    nameLength = length - self._command.size - self._entry.size
+                    name = self._buffer[body:body + nameLength].decode("ascii")
+                    typeID, dataOffset, items = self._entry.unpack_from(self._buffer, body + nameLength)
+                    if typeID in LSDA_TYPES:
+                        self.variables[joinPath(directory, name)] = (np.dtype(self.order + LSDA_TYPES[typeID]), dataOffset, items)
+                    elif typeID == LSDA_LINK:
+                        self.variables[joinPath(directory, name)] = (np.dtype(self.order + "u" + str(self.offsetSize)), dataOffset, items)
+                elif command == LSDA_ENDSYMBOLTABLE:
+                    table = self._offset.unpack_from(self._buffer, body)[0]
+                    break
+                offset += length
+
+    def branches(self):
+        # top level directories (databases) in the file, e.g. ["bndout", "glstat", "nodout"]
+        return sorted(set(path.split("/")[1] for path in self.variables))
+
+    def list(self, directory="/"):
+        # names of the directories and arrays directly inside directory
+        prefix = directory.rstrip("/") + "/"
+        return sorted(set(path[len(prefix):].split("/")[0] for path in self.variables if path.startswith(prefix)))
+
+    def __contains__(self, path):
+        return path in self.variables
+
+    def read(self, path, items=None):
+        # array at path, or only the elements at positions items
+        dtype, offset, count = self.variables[path]
+        nameLength = self._buffer[offset + self._dataHeader - 1]
+        data = np.frombuffer(self._buffer, dtype=dtype, count=count, offset=offset + self._dataHeader + nameLength)
+        return data.copy() if items is None else data[items]
+
+    def steps(self, directory):
+        # output time directories of a database (d000001, d000002, ...) in order
+        return [name for name in self.list(directory) if name.startswith("d") and name[1:].isdigit()]
+
+    def readHistory(self, directory, names):
+        # time history of global (not per node) fields such as glstat: times (T,) and a T x len(names) array, NaN for missing fields
+        directory = "/" + directory.strip("/")
+        steps = self.steps(directory)
+        times = np.array([self.read(directory + "/" + step + "/time")[0] for step in steps], dtype=float)
+        data = np.full((len(steps), len(names)), np.nan)
+        for i, step in enumerate(steps):
+            for j, name in enumerate(names):
+                path = directory + "/" + step + "/" + name
+                if path in self.variables:
+                    data[i, j] = self.read(path)[0]
+        return times, data
+
+    def readNodeHistory(self, branch, nodeIDs=None, fieldNames=None, fields=None):
+        # time histories of nodeIDs (all nodes if None) from a per node database: nodout or bndout, or any directory when
+        # fieldNames (binout names) and fields (NodeHistory names) are given; only the requested elements of each array are read
+        if fieldNames is None:
+            directory, fieldNames, fields = NODE_BRANCHES[branch]
+        else:
+            directory = "/" + branch.strip("/")
+            fields = tuple(fieldNames) if fields is None else tuple(fields)
+        ids = self.read(directory + "/metadata/ids").astype(np.int64)
+        if nodeIDs is None:
+            columns = np.arange(len(ids))
+        else:
+            requested = np.unique(np.asarray(list(nodeIDs), dtype=np.int64))
+            position = dict(zip(ids.tolist(), range(len(ids))))
+            columns = np.array([position[nid] for nid in requested.tolist() if nid in position], dtype=np.int64)
+        order = np.argsort(ids[columns], kind="stable")
+        columns = columns[order]
+        steps = self.steps(directory)
+        times = np.array([self.read(directory + "/" + step + "/time")[0] for step in steps], dtype=float)
+        data = np.full((len(columns), len(steps), len(fields)), np.nan)
+        for i, step in enumerate(steps):
+            for j, name in enumerate(fieldNames):
+                path = directory + "/" + step + "/" + name
+                if path in self.variables:
+                    data[:, i, j] = self.read(path, columns)
+        return util.NodeHistory(times, ids[columns], data, fields)
+
+def joinPath(directory, path):
+    # resolves path (absolute, or relative to directory with . and ..) to an absolute path
+    parts = list() if path.startswith("/") else directory.strip("/").split("/")
+    for part in path.split("/"):
+        if part == "..":
+            if len(parts) != 0:
+                parts.pop()
+        elif part not in ("", "."):
+            parts.append(part)
+    return "/" + "/".join(part for part in parts if part != "")
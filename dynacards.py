@@ -0,0 +1,308 @@
+"""
+dynacards
+This module parses LS-Dyna keyword decks into cards with typed fixed width fields and writes them back to text
+
+Every card keeps its keyword line, comments, and title; data lines are split into fields (10 characters wide unless
+ROW_WIDTHS says otherwise) and decoded into int, float, str, or None (blank). Field names are taken from the "$#"
+comment line above a data line, so fields can be changed by name. Unchanged lines are written back exactly as they
+were read, changed fields are formatted with dynautil.formatField (never truncated).
+
+Parsed files are cached by the sha256 of their contents; loadDeck returns a copy, so overriding fields for one
+DOE point does not affect the next one and nothing is parsed twice.
+
+Example:
+    deck = loadDeck("defaultcards.k")
+    deck.set("*CONTROL_TERMINATION", "endtim", 60.0)
+    deck.find("*DEFINE_CURVE").setPoints([(0.0, -0.1), (500.0, -0.1)])
+    util.generateKeyFile(lattice, "lattice.k", cards=deck)
+"""
+import hashlib
+import re
+import dynautil as util
+
+# field widths of data lines by keyword (matched without _TITLE)
+# each entry is a list with one item per data line, the last item repeats; an item is a width or a tuple of widths
+ROW_WIDTHS = {"*DEFINE_CURVE": [10, 20], "*NODE": [(8, 16, 16, 16, 8, 8)], "*NODES": [(8, 16, 16, 16, 8, 8)],
+    "*ELEMENT_BEAM": [8], "*ELEMENT_BEAM_THICKNESS": [8, 16]}
+
+_INTEGER = re.compile(r"^[+-]?\d+$")
+
+cacheStats = {"hits": 0, "misses": 0}
+_deckCache = dict() # sha256 of file contents: parsed Deck
+
+def loadDeck(path):
+    # returns a parsed copy of the keyword file at path, parsing it only if its contents have not been seen before
+    with open(path, "rb") as f:
+        data = f.read()
+    key = hashlib.sha256(data).hexdigest()
+    if key in _deckCache:
+        cacheStats["hits"] += 1
+    else:
+        cacheStats["misses"] += 1
+        _deckCache[key] = parseDeck(data.decode("utf8").replace("\r\n", "\n").replace("\r", "\n")) # universal newlines like open()
+    return _deckCache[key].copy()
+
+def parseDeck(text):
+    # parses keyword file text into a Deck
+    # cards are separated by lines starting with * (same split as dynautil.importDynaCardsList)
+    cards = list()
+    lines = list()
+    for line in text.splitlines(True):
+        if line.startswith("*") and len(lines) != 0:
+            cards.append(Card.fromLines(lines))
+            lines = list()
+        lines.append(line)
+    if len(lines) != 0:
+        cards.append(Card.fromLines(lines))
+    return Deck(cards)
+
+def parseField(text):
+    # decodes one fixed width field: None if blank, else int, float, or str
+    text = text.strip()
+    if len(text) == 0:
+        return None
+    if _INTEGER.match(text):
+        return int(text)
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def rowWidths(keyword, index, length):
+    # returns the field widths of data line number index of a card, enough fields to cover length characters
+    widths = ROW_WIDTHS.get(baseKeyword(keyword), [10])
+    widths = widths[min(index, len(widths) - 1)]
+    if isinstance(widths, int):
+        widths = (widths,)*max(1, -(-length // widths))
+    return list(widths)
+
+def baseKeyword(keyword):
+    # keyword without the _TITLE option, upper case
+    keyword = keyword.upper()
+    return keyword[:-len("_TITLE")] if keyword.endswith("_TITLE") else keyword
+
+class Deck:
+    # list of Cards with lookup by keyword and conversion back to text
+    def __init__(self, cards=None):
+        self.cards = list() if cards is None else cards
+
+    def __iter__(self):
+        return iter(self.cards)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __getitem__(self, index):
+        return self.cards[index]
+
+    def copy(self):
+        return Deck([card.copy() for card in self.cards])
+
+    def findAll(self, keyword, title=None):
+        # returns every card with this keyword (with or without _TITLE) and, if given, this title
+        keyword = baseKeyword(keyword)
+        return [card for card in self.cards if baseKeyword(card.keyword) == keyword and (title is None or card.title == title)]
+
+    def find(self, keyword, title=None):
+        # returns the first card with this keyword (and title), raises a KeyError if there is none
+        cards = self.findAll(keyword, title)
+        if len(cards) == 0:
+            raise KeyError("No " + keyword + " card in deck!")
+        return cards[0]
+
+    def get(self, keyword, name, title=None):
+        return self.find(keyword, title).get(name)
+
+    def set(self, keyword, name, value, title=None):
+        # sets field name of the first card with this keyword (and title)
+        self.find(keyword, title).set(name, value)
+
+    def toCardsList(self):
+        # list of card strings, the same as dynautil.importDynaCardsList gives for the file
+        return [card.toText() for card in self.cards]
+
+    def toText(self):
+        return "".join(self.toCardsList())
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.write(self.toText())
+
+class Card:
+    # one keyword card: keyword line, then a list of lines that are either text (comments, blank lines, title) or Rows
+    def __init__(self, header, lines, titleIndex=None):
+        self.header = header
+        self.keyword = header.split()[0].upper() if len(header.split()) != 0 else ""
+        self.lines = lines
+        self.titleIndex = titleIndex # index into lines of the title (None if the card has no title)
+        self._text = None
+
+    @classmethod
+    def fromLines(cls, lines):
+        # builds a Card from its text lines (line endings included), the first line being the keyword line
+        card = cls(lines[0], list())
+        hasTitle = card.keyword.endswith("_TITLE") or card.keyword == "*PART"
+        names = None
+        rowIndex = 0
+        for line in lines[1:]:
+            content = line.rstrip("\r\n")
+            if content.startswith("$"):
+                card.lines.append(line)
+                if content.startswith("$#"):
+                    names = [(m.group(), m.end() + 2) for m in re.finditer(r"\S+", content[2:])]
+                continue
+            if len(content.strip()) == 0 or not card.keyword.startswith("*") or card.keyword == "*KEYWORD":
+                card.lines.append(line)
+                continue
+            if hasTitle and card.titleIndex is None:
+                card.titleIndex = len(card.lines)
+                card.lines.append(line)
+                names = None
+                continue
+            card.lines.append(Row.fromLine(line, rowWidths(card.keyword, rowIndex, len(content)), names))
+            if baseKeyword(card.keyword) != "*DEFINE_CURVE" or rowIndex == 0:
+                names = None # names only apply to the line below them, except for curve points
+            rowIndex += 1
+        card._text = "".join(lines)
+        return card
+
+    def copy(self):
+        card = Card(self.header, [line.copy() if isinstance(line, Row) else line for line in self.lines], self.titleIndex)
+        card._text = self._text
+        return card
+
+    def rows(self):
+        return [line for line in self.lines if isinstance(line, Row)]
+
+    @property
+    def title(self):
+        if self.titleIndex is None:
+            return None
+        return self.lines[self.titleIndex].strip()
+
+    @title.setter
+    def title(self, value):
+        if self.titleIndex is None:
+            raise ValueError(self.keyword + " has no title!")
+        ending = self.lines[self.titleIndex][len(self.lines[self.titleIndex].rstrip("\r\n")):]
+        self.lines[self.titleIndex] = value + (ending or "\n")
+        self._text = None
+
+    def _find(self, name):
+        for row in self.rows():
+            if row.names is not None and name in row.names:
+                return row, row.names.index(name)
+        raise KeyError("No field " + name + " in " + self.keyword + "!")
+
+    def get(self, name):
+        # value of the first field called name
+        row, field = self._find(name)
+        return row.values[field]
+
+    def set(self, name, value):
+        # sets the first field called name
+        row, field = self._find(name)
+        row[field] = value
+        self._text = None
+
+    def __getitem__(self, index):
+        # data line index (a Row)
+        return self.rows()[index]
+
+    def points(self):
+        # (a, o) pairs of a *DEFINE_CURVE card (every data line after the first)
+        return [(row.values[0], row.values[1]) for row in self.rows()[1:]]
+
+    def setPoints(self, points):
+        # replaces the (a, o) pairs of a *DEFINE_CURVE card
+        rows = self.rows()
+        if len(rows) == 0:
+            raise ValueError(self.keyword + " has no curve definition line!")
+        names = rows[1].names if len(rows) > 1 else None
+        lines = [line for line in self.lines if not isinstance(line, Row) or line is rows[0]]
+        at = lines.index(rows[0]) + 1
+        while at < len(lines) and lines[at].startswith("$"):
+            at += 1 # keep the "$# a1 o1" heading above the points
+        newRows = list()
+        for a, o in points:
+            row = Row([None, None], [None, None], rowWidths(self.keyword, 1, 40)[0:2], names)
+            row[0] = a
+            row[1] = o
+            newRows.append(row)
+        self.lines = lines[:at] + newRows + lines[at:]
+        self._text = None
+
+    def toText(self):
+        if self._text is None or any(isinstance(line, Row) and line.changed for line in self.lines):
+            self._text = self.header + "".join(line.toText() if isinstance(line, Row) else line for line in self.lines)
+        return self._text
+
+    def __str__(self):
+        return self.toText()
+
+class Row:
+    # one fixed width data line: decoded values, the original field text (None once changed), widths, and field names
+    def __init__(self, values, texts, widths, names=None, tail="", ending="\n"):
+        self.values = values
+        self.texts = texts
+        self.widths = widths
+        self.names = names
+        self.tail = tail # anything after the last field (e.g. trailing spaces)
+        self.ending = ending
+        self.changed = False
+
+    @classmethod
+    def fromLine(cls, line, widths, names=None):
+        # splits a data line into fields of the given widths
+        # names is the list of (name, endColumn) pairs from the "$#" line above, matched to fields by column
+        content = line.rstrip("\r\n")
+        ending = line[len(content):]
+        texts = list()
+        offset = 0
+        for width in widths:
+            if offset >= len(content):
+                break
+            texts.append(content[offset:offset + width])
+            offset += width
+        tail = content[offset:]
+        fieldNames = None
+        if names:
+            fieldNames = [None]*len(widths)
+            ends = [sum(widths[0:i + 1]) for i in range(len(widths))]
+            for name, end in names:
+                field = next((i for i, e in enumerate(ends) if end <= e), None)
+                if field is not None and fieldNames[field] is None:
+                    fieldNames[field] = name
+        return cls([parseField(text) for text in texts], texts, widths[0:len(texts)] if texts else widths[0:1], fieldNames, tail, ending)
+
+    def copy(self):
+        row = Row(list(self.values), list(self.texts), list(self.widths), self.names, self.tail, self.ending)
+        row.changed = self.changed
+        return row
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, field):
+        return self.values[field]
+
+    def __setitem__(self, field, value):
+        while field >= len(self.values):
+            # fields past the end of the original line
+            self.widths.append(self.widths[-1] if self.widths else 10)
+            self.values.append(None)
+            self.texts.append(None)
+        self.values[field] = value
+        self.texts[field] = None
+        self.changed = True
+
+    def toText(self):
+        fields = list()
+        for value, text, width in zip(self.values, self.texts, self.widths):
+            if text is not None:
+                fields.append(text)
+            elif value is None:
+                fields.append(" "*width)
+            else:
+                fields.append(util.formatField(value, width))
+        return "".join(fields) + self.tail + self.ending
@@ -2,64 +2,158 @@
 # February 4, 2019
 # This module contains a collection of functions to automate the PrePost process
 
+import hashlib
+import itertools
+import json
 import math
-import networkx
+import mmap
+import os
+import re
 import xlattice as xlt
 import numpy as np
 import warnings
 
-def generateKeyFile(lattice, outputFile, elementSize=1, defaultDiameter=0.1, movingNodes=None, fixedNodes=None, SPCNodesAndDOF=None, cards=None):
+def generateKeyFile(lattice, outputFile, elementSize=1, defaultDiameter=0.1, movingNodes=None, fixedNodes=None, SPCNodesAndDOF=None, cards=None, chunkSize=None, renumber=None, minElementLength=None, minLengthRatio=None, sharedDirectory=None, timestep=False):
 	# Creates a LS-Dyna outputFile.k file using provided lattice
 	# movingNodes and fixedNodes can be a list or set of nodeIDs
 	# if left None, the zMaxFace and zMinFace will be used as moving and fixed, respectively
 	# SPCNodesAndDOF is a list of lists [[nodeSet1, (DOFTuple)], [nodeSet2, (DOFTuple)], ...]
-
-	file = open(outputFile, "w")
-
-	# write any optional cards at top of file
-	if cards != None and len(cards) != 0:
-		for card in cards:
-			file.write(card)
+	# if chunkSize is set, the mesh is generated and written chunkSize nodes/elements at a time so memory stays bounded
+	# (a TessellatedLattice is always streamed); the file is the same either way
+	# renumber can be "compact", "rcm", or "morton" (see renumberMesh) to renumber nodes and elements for locality;
+	# this needs the whole mesh in memory and node sets are remapped to match
+	# minElementLength and minLengthRatio turn on adaptive meshing (see edgeElementCounts)
+	# if sharedDirectory is set, the deck is split: cards, nodes, and boundary conditions go to an include file in sharedDirectory
+	# named after everything that determines them (see sharedDeckKey), which is only written if it does not exist yet,
+	# and outputFile only gets an *INCLUDE of it plus the elements (so decks that differ only in diameters share one include)
+	# if timestep is True, the critical timestep is estimated from cards (see estimateTimestep; this is another pass over all edges)
+	# returns a report with the renumbering results (if renumber is set), the critical timestep estimate
+	# (if timestep is True), and the shared include file (if sharedDirectory is set)
 
 	# mesh the lattice
-	elements, allNodes = meshBeamEdges(lattice.G, size=elementSize, diameterFlag=True, defaultDiameter=defaultDiameter)
-
-	# write nodes
-	file.write("\n*NODES\n")
-	file.write("$#   nid               x               y               z      tc      rc\n")
-	writeNodes(file, allNodes)
-
-	# write elements
-	file.write("*ELEMENT_BEAM_THICKNESS\n")
-	file.write("$#   eid     pid      n1      n2      n3     rt1     rr1     rt2     rr2   local\n")
-	file.write("$#         parm1           parm2           parm3           parm4           parm5\n")
-	writeThickElements(file, elements)
+	# when streaming, edges are meshed twice (once for the nodes, once for the elements)
+	# so the full mesh is never held in memory
+	streaming = renumber == None and (chunkSize != None or isinstance(lattice, xlt.TessellatedLattice))
+	nodeMap = None
+	report = dict()
+	if cards == None:
+		cards = list()
+	cards = [str(card) for card in cards] # strings or dynacards cards
+	if timestep:
+		report.update(estimateTimestep(lattice, elementSize, defaultDiameter, cards, minElementLength, minLengthRatio, chunkSize))
+	if streaming:
+		allNodes = itertools.chain(iterNodeChunks(lattice, chunkSize), (nodes for nodes, elements in iterMeshedChunks(lattice, elementSize, 1, None, defaultDiameter, chunkSize, minElementLength, minLengthRatio)))
+		elements = (elements for nodes, elements in iterMeshedChunks(lattice, elementSize, 1, None, defaultDiameter, chunkSize, minElementLength, minLengthRatio))
+	else:
+		allNodes, elements = meshBeamArrays(lattice, size=elementSize, defaultDiameter=defaultDiameter, minElementLength=minElementLength, minLengthRatio=minLengthRatio)
+		if renumber != None:
+			allNodes, elements, nodeMap, renumberReport = renumberMesh(allNodes, elements, renumber)
+			report.update(renumberReport)
+		allNodes, elements = iterRecordChunks(allNodes, NODE_DTYPE, chunkSize), iterRecordChunks(elements, ELEMENT_DTYPE, chunkSize)
 
-	# write prescribed velocity (moving nodes)
+	# boundary node sets (moving nodes get a prescribed velocity, fixed nodes and SPCNodesAndDOF get spc boundary conditions)
 	if movingNodes == None:
 		movingNodes = lattice.zMaxFace
-
-	file.write("*BOUNDARY_PRESCRIBED_MOTION_NODE\n")
-	file.write("$#     nid       dof       vad      lcid        sf       vid     death     birth\n")
-	writePrescribedVelocity(file, movingNodes, dof=3)
-
-	# write spc boundary conditions (fixed nodes and SPCNodesAndDOF)
 	if fixedNodes == None:
 		fixedNodes = lattice.zMinFace
-	file.write("*BOUNDARY_SPC_NODE\n")
-	file.write("$#     nid       cid      dofx      dofy      dofz     dofrx     dofry     dofrz\n")
-	writeSPC(file, fixedNodes)
-	if SPCNodesAndDOF != None:
-		for nodesDOFPair in SPCNodesAndDOF:
-			nodeSet = nodesDOFPair[0]
-			DOF = nodesDOFPair[1]
-			dofx, dofy, dofz, dofrx, dofry, dofrz = DOF
-			writeSPC(file, nodeSet, dofx=dofx, dofy=dofy, dofz=dofz, dofrx=dofrx, dofry=dofry, dofrz=dofrz)
+	if SPCNodesAndDOF == None:
+		SPCNodesAndDOF = list()
+	if nodeMap != None:
+		movingNodes = nodeMap.remap(movingNodes)
+		fixedNodes = nodeMap.remap(fixedNodes)
+		SPCNodesAndDOF = [[nodeMap.remap(nodeSet), DOF] for nodeSet, DOF in SPCNodesAndDOF]
+
+	if sharedDirectory == None:
+		file = open(outputFile, "w")
+		# write any optional cards at top of file
+		for card in cards:
+			file.write(card)
+		writeNodeBlock(file, allNodes)
+		writeElementBlock(file, elements)
+		writeBoundaryBlocks(file, movingNodes, fixedNodes, SPCNodesAndDOF)
+	else:
+		# *KEYWORD has to stay at the top of the main deck, everything else that does not depend on diameters is shared
+		keywordCards = [card for card in cards if card.lstrip().upper().startswith("*KEYWORD")]
+		sharedCards = [card for card in cards if not card.lstrip().upper().startswith("*KEYWORD")]
+		key = sharedDeckKey(lattice, elementSize, defaultDiameter, movingNodes, fixedNodes, SPCNodesAndDOF, sharedCards, renumber, minElementLength, minLengthRatio)
+		sharedFile = os.path.abspath(os.path.join(sharedDirectory, "shared_" + key[0:16] + ".k"))
+		report["sharedFile"] = sharedFile
+		report["sharedFileWritten"] = not os.path.exists(sharedFile)
+		if report["sharedFileWritten"]:
+			# write to a temporary file first so other processes never include a partially written file
+			os.makedirs(sharedDirectory, exist_ok=True)
+			tempFile = sharedFile + ".%d.tmp" % os.getpid()
+			file = open(tempFile, "w")
+			for card in sharedCards:
+				file.write(card)
+			writeNodeBlock(file, allNodes)
+			writeBoundaryBlocks(file, movingNodes, fixedNodes, SPCNodesAndDOF)
+			file.close()
+			os.replace(tempFile, sharedFile)
+		file = open(outputFile, "w")
+		for card in keywordCards:
+			file.write(card)
+		writeInclude(file, sharedFile)
+		writeElementBlock(file, elements)
 
 	# Write *END keyword
 	file.write("*END")
 
 	file.close()
+	return report
+
+def writeNodeBlock(openedFile, allNodes):
+	# writes the *NODES keyword for an iterable of NODE_DTYPE chunks
+	openedFile.write("\n*NODES\n")
+	openedFile.write("$#   nid               x               y               z      tc      rc\n")
+	for nodes in allNodes:
+		writeNodes(openedFile, nodes)
+
+def writeElementBlock(openedFile, elements):
+	# writes the *ELEMENT_BEAM_THICKNESS keyword for an iterable of ELEMENT_DTYPE chunks
+	openedFile.write("*ELEMENT_BEAM_THICKNESS\n")
+	openedFile.write("$#   eid     pid      n1      n2      n3     rt1     rr1     rt2     rr2   local\n")
+	openedFile.write("$#         parm1           parm2           parm3           parm4           parm5\n")
+	for chunk in elements:
+		writeThickElements(openedFile, chunk)
+
+def writeBoundaryBlocks(openedFile, movingNodes, fixedNodes, SPCNodesAndDOF):
+	# writes the prescribed velocity (moving nodes) and spc boundary conditions (fixed nodes and SPCNodesAndDOF)
+	openedFile.write("*BOUNDARY_PRESCRIBED_MOTION_NODE\n")
+	openedFile.write("$#     nid       dof       vad      lcid        sf       vid     death     birth\n")
+	writePrescribedVelocity(openedFile, movingNodes, dof=3)
+	openedFile.write("*BOUNDARY_SPC_NODE\n")
+	openedFile.write("$#     nid       cid      dofx      dofy      dofz     dofrx     dofry     dofrz\n")
+	writeSPC(openedFile, fixedNodes)
+	for nodeSet, DOF in SPCNodesAndDOF:
+		dofx, dofy, dofz, dofrx, dofry, dofrz = DOF
+		writeSPC(openedFile, nodeSet, dofx=dofx, dofy=dofy, dofz=dofz, dofrx=dofrx, dofry=dofry, dofrz=dofrz)
+
+def writeInclude(openedFile, fileName):
+	# writes an *INCLUDE card; file names longer than 78 characters are continued on the next line with " +" like LS-Dyna expects
+	openedFile.write("*INCLUDE\n")
+	openedFile.write(" +\n".join(fileName[i:i + 78] for i in range(0, len(fileName), 78)) + "\n")
+
+def sharedDeckKey(lattice, elementSize, defaultDiameter, movingNodes, fixedNodes, SPCNodesAndDOF, cards, renumber=None, minElementLength=None, minLengthRatio=None):
+	# sha256 of everything that determines the shared part of a split deck (see generateKeyFile):
+	# the geometry, meshing options, node sets, and cards (diameters only matter when minLengthRatio is set)
+	h = hashlib.sha256()
+	h.update(json.dumps(["dynautil shared deck 1", repr(elementSize), repr(minElementLength), repr(minLengthRatio), renumber,
+		repr(defaultDiameter) if minLengthRatio != None else None, [list(DOF) for nodeSet, DOF in SPCNodesAndDOF]]).encode("utf8"))
+	if isinstance(lattice, xlt.TessellatedLattice):
+		h.update(np.asarray(lattice.map.counts, dtype=np.int64).tobytes())
+		lattice = lattice.unitCell
+	arrays = [lattice.nodeIDs, lattice.pos, lattice.edges]
+	if minLengthRatio != None:
+		arrays.append(edgeDiameters(lattice.diameters, defaultDiameter))
+	for nodeSet in [movingNodes, fixedNodes] + [nodeSet for nodeSet, DOF in SPCNodesAndDOF]:
+		arrays.append(np.fromiter(nodeSet, dtype=np.int64))
+	for array in arrays:
+		h.update(str(array.shape).encode("utf8"))
+		h.update(np.ascontiguousarray(array).tobytes())
+	for card in cards:
+		h.update(card.encode("utf8"))
+	return h.hexdigest()
 
 def writeKeyFile(G, outputFile, size=1, movingNodes=None, fixedNodes=None, cards=None):
 
@@ -109,34 +203,20 @@ def writeKeyFile(G, outputFile, size=1, movingNodes=None, fixedNodes=None, cards
 
 	file.close()
 
+WRITE_CHUNK_ROWS = 65536 # rows formatted into one buffer by the block writers
+
 def writePrescribedVelocity(openedFile, movingNodes, dof=1, vad=0, lcid=1, sf=1, vid=0, death="1.0E28", birth=0.0):
-	for node in movingNodes:
-		openedFile.write(setLengthStr(node))
-		openedFile.write(setLengthStr(dof))
-		openedFile.write(setLengthStr(vad))
-		openedFile.write(setLengthStr(lcid))
-		openedFile.write(setLengthStr(sf))
-		openedFile.write(setLengthStr(vid))
-		openedFile.write(setLengthStr(death))
-		openedFile.write(setLengthStr(birth))
-		openedFile.write("\n")
+	nodes = np.fromiter(movingNodes, dtype=np.int64)
+	writeFixedWidth(openedFile, [(nodes, 10), (dof, 10), (vad, 10), (lcid, 10), (sf, 10), (vid, 10), (death, 10), (birth, 10), ("\n", 1)])
 
 def writeSPC(openedFile, fixedNodes, cid=0, dofx=1, dofy=1, dofz=1, dofrx=0, dofry=0, dofrz=0):
-	for node in fixedNodes:
-		openedFile.write(setLengthStr(node))
-		openedFile.write(setLengthStr(cid))
-		openedFile.write(setLengthStr(dofx))
-		openedFile.write(setLengthStr(dofy))
-		openedFile.write(setLengthStr(dofz))
-		openedFile.write(setLengthStr(dofrx))
-		openedFile.write(setLengthStr(dofry))
-		openedFile.write(setLengthStr(dofrz))
-		openedFile.write("\n")
+	nodes = np.fromiter(fixedNodes, dtype=np.int64)
+	writeFixedWidth(openedFile, [(nodes, 10), (cid, 10), (dofx, 10), (dofy, 10), (dofz, 10), (dofrx, 10), (dofry, 10), (dofrz, 10), ("\n", 1)])
 
 def setLengthStr(input, length=10):
 	# takes an input and converts to right-aligned LS-Dyna input format
 	# appends spaces or truncates as necessary
-	# WARNING: does NOT work with scientific notation currently
+	# WARNING: does NOT work with scientific notation currently, use formatField instead
 	# default length of 10 characters used
 	input = str(input)
 	if len(input) <= length:
@@ -144,25 +224,149 @@ def setLengthStr(input, length=10):
 	else:
 		return input[0:length]
 
+def formatField(value, width=10):
+	# takes a number or string and converts to right-aligned LS-Dyna fixed width input format
+	# floats are written with the shortest representation that reads back exactly
+	# if that does not fit, they are rounded to as many significant digits as fit (fixed or scientific notation)
+	# raises a ValueError instead of truncating anything, and for NaN and infinite values (LS-Dyna cannot read them)
+	if isinstance(value, (str, bytes)):
+		text = value if isinstance(value, str) else value.decode("ascii")
+	elif isinstance(value, (int, np.integer)):
+		text = str(int(value))
+	else:
+		value = float(value) + 0.0 # writes -0.0 as 0.0
+		if not math.isfinite(value):
+			raise ValueError("%r cannot be written to a LS-Dyna field" % value)
+		text = repr(value)
+		if len(text) > width:
+			text = None
+			fixedDigits, scientificDigits = fieldDigits(value, width)
+			for digits in range(max(1, min(17, max(fixedDigits, scientificDigits))), 0, -1):
+				# start from the estimate and back off if rounding made it longer
+				fixed = "%.*g" % (digits, value)
+				mantissa, power = ("%.*e" % (digits - 1, value)).split("e")
+				scientific = mantissa + "e" + str(int(power)) # drop the exponent's + sign and leading zeros
+				fits = [s for s in (fixed, scientific) if len(s) <= width and math.isfinite(float(s))]
+				if fits:
+					text = min(fits, key=len)
+					break
+	if text == None or len(text) > width:
+		raise ValueError("%r does not fit in a %d character field" % (value, width))
+	return " "*(width-len(text)) + text
+
+def fieldDigits(value, width):
+	# returns the most significant digits of value that fit in width characters in (fixed, scientific) notation
+	sign = 1 if value < 0 else 0
+	exponent = int(math.floor(math.log10(abs(value)))) if value != 0 else 0
+	return width - sign - 1 + min(0, exponent), width - sign - 2 - len(str(exponent))
+
+def formatIntegerColumn(values, width):
+	# formats an integer array as an N x width array of right-aligned ASCII codes
+	values = np.asarray(values, dtype=np.int64)
+	magnitude = np.abs(values)
+	out = np.full((len(values), width), ord(" "), dtype=np.uint8)
+	nDigits = np.ones(len(values), dtype=np.int64)
+	remaining = magnitude // 10
+	column = width - 1
+	out[:, column] = ord("0") + magnitude % 10
+	while remaining.any():
+		column -= 1
+		if column < 0:
+			break
+		nonzero = remaining > 0
+		out[nonzero, column] = ord("0") + remaining[nonzero] % 10
+		nDigits += nonzero
+		remaining //= 10
+	negative = values < 0
+	if remaining.any() or (nDigits[negative] >= width).any():
+		tooLong = values[(remaining > 0) | (negative & (nDigits >= width))]
+		raise ValueError("%d does not fit in a %d character field" % (tooLong[0], width))
+	out[negative, width - 1 - nDigits[negative]] = ord("-")
+	return out
+
+def formatFloatColumn(values, width):
+	# formats a float array as an N x width array of right-aligned ASCII codes, same as formatField on every entry
+	# each distinct value is formatted once (lattice coordinates repeat a lot)
+	uniqueValues, inverse = np.unique(np.asarray(values, dtype=float) + 0.0, return_inverse=True)
+	if not np.isfinite(uniqueValues).all():
+		raise ValueError("%r cannot be written to a LS-Dyna field" % uniqueValues[~np.isfinite(uniqueValues)][0].item())
+	uniqueValues = uniqueValues.tolist()
+	text = list(map(repr, uniqueValues))
+	tooLong = [i for i, t in enumerate(text) if len(t) > width]
+	if len(tooLong) != 0:
+		# round everything that does not fit in one formatting call when fixed notation wins (the usual case),
+		# leaving the rest to formatField
+		digits = [fieldDigits(uniqueValues[i], width) for i in tooLong]
+		rounded = (("%.*g\n"*len(tooLong)) % tuple(itertools.chain.from_iterable((max(1, min(17, fixed)), uniqueValues[i]) for i, (fixed, scientific) in zip(tooLong, digits)))).split("\n")
+		for i, (fixed, scientific), r in zip(tooLong, digits, rounded):
+			if fixed >= scientific and len(r) <= width and "e" not in r:
+				text[i] = r
+			else:
+				text[i] = formatField(uniqueValues[i], width)
+	table = np.frombuffer((("%*s"*len(text)) % tuple(itertools.chain.from_iterable((width, t) for t in text))).encode("ascii"), dtype="S%d" % width)
+	return table[inverse.reshape(-1)].view(np.uint8).reshape(-1, width)
+
+def formatColumn(values, width):
+	# formats one column of a fixed width block as an N x width array of ASCII codes
+	# values can be an array with one entry per row, or a single number or string repeated on every row (returned as 1 x width)
+	if np.ndim(values) == 0:
+		if isinstance(values, np.generic):
+			values = values.item()
+		return np.frombuffer(formatField(values, width).encode("ascii"), dtype=np.uint8).reshape(1, width)
+	values = np.asarray(values)
+	if values.dtype.kind in "iub":
+		return formatIntegerColumn(values, width)
+	return formatFloatColumn(values, width)
+
+def writeFixedWidth(openedFile, columns, chunkSize=None):
+	# writes a block of fixed width rows in buffers of chunkSize rows
+	# columns is a list of (values, width) pairs, see formatColumn; include ("\n", 1) to end a line
+	# every array in columns must have the same length (the number of rows)
+	if chunkSize == None:
+		chunkSize = WRITE_CHUNK_ROWS
+	lengths = [len(values) for values, width in columns if np.ndim(values) != 0]
+	nRows = lengths[0] if lengths else 0
+	constants = [formatColumn(values, width) if np.ndim(values) == 0 else None for values, width in columns]
+	rowWidth = sum(width for values, width in columns)
+	for start in range(0, nRows, chunkSize):
+		stop = min(start + chunkSize, nRows)
+		block = np.empty((stop - start, rowWidth), dtype=np.uint8)
+		offset = 0
+		for (values, width), constant in zip(columns, constants):
+			block[:, offset:offset + width] = constant if constant is not None else formatColumn(values[start:stop], width)
+			offset += width
+		openedFile.write(block.tobytes().decode("ascii"))
+
+def iterRecordChunks(rows, dtype, chunkSize=None):
+	# yields structured arrays of at most chunkSize rows
+	# rows can be a structured array or any iterable of tuples matching dtype (None becomes NaN in float fields)
+	if chunkSize == None:
+		chunkSize = WRITE_CHUNK_ROWS
+	if isinstance(rows, np.ndarray) and rows.dtype.names != None:
+		for start in range(0, len(rows), chunkSize):
+			yield rows[start:start + chunkSize]
+		return
+	rows = iter(rows)
+	while True:
+		chunk = [tuple(r) for r in itertools.islice(rows, chunkSize)]
+		if len(chunk) == 0:
+			return
+		yield np.array(chunk, dtype=dtype)
+
 def detailedNodeList(G, simpleNodeList):
 	detailedList = list()
 	for n in simpleNodeList:
-		detailedList.append((n, G.node[n]["pos"][0], G.node[n]["pos"][1], G.node[n]["pos"][2]))
+		detailedList.append((n, G.nodes[n]["pos"][0], G.nodes[n]["pos"][1], G.nodes[n]["pos"][2]))
 	return detailedList
 
 def writeNodes(openedFile, nodes, header=None):
 	# openedFile must be opened already (as the name suggests!)
+	# nodes is a NODE_DTYPE array or an iterable of (nid, x, y, z) tuples
 	# assumes 0 tc and rc (maybe will be changed in future?)
 	if header != None:
 		openedFile.write(header + "\n")
-	for n in nodes:
-		openedFile.write(setLengthStr(n[0], 8))
-		openedFile.write(setLengthStr(n[1], 16))
-		openedFile.write(setLengthStr(n[2], 16))
-		openedFile.write(setLengthStr(n[3], 16))
-		openedFile.write(setLengthStr(0, 8)) # tc
-		openedFile.write(setLengthStr(0, 8)) # rc
-		openedFile.write("\n")
+	for chunk in iterRecordChunks(nodes, NODE_DTYPE):
+		writeFixedWidth(openedFile, [(chunk["nid"], 8), (chunk["x"], 16), (chunk["y"], 16), (chunk["z"], 16), (0, 8), (0, 8), ("\n", 1)]) # tc, rc
 
 def writeElements(openedFile, elements, header=None):
 	# elements is a list of (eid, pid, n1, n2) tuples
@@ -170,95 +374,353 @@ def writeElements(openedFile, elements, header=None):
 	# assumes a lot of constants currently (will be fixed if necessary)
 	if header != None:
 		openedFile.write(header + "\n")
-	for e in elements:
-		eid, pid, n1, n2 = e
-		openedFile.write(setLengthStr(eid, 8))
-		openedFile.write(setLengthStr(pid, 8))
-		openedFile.write(setLengthStr(n1, 8))
-		openedFile.write(setLengthStr(n2, 8))
-		openedFile.write(setLengthStr(0, 8)) # n3
-		openedFile.write(setLengthStr(0, 8)) # rt1
-		openedFile.write(setLengthStr(0, 8)) # rr1
-		openedFile.write(setLengthStr(0, 8)) # rt2
-		openedFile.write(setLengthStr(0, 8)) # rr2
-		openedFile.write(setLengthStr(2, 8)) # local
-		openedFile.write("\n")
+	dtype = np.dtype(ELEMENT_DTYPE.descr[0:4])
+	for chunk in iterRecordChunks(elements, dtype):
+		# n3, rt1, rr1, rt2, rr2, local
+		writeFixedWidth(openedFile, [(chunk["eid"], 8), (chunk["pid"], 8), (chunk["n1"], 8), (chunk["n2"], 8), (0, 8), (0, 8), (0, 8), (0, 8), (0, 8), (2, 8), ("\n", 1)])
 
 def writeThickElements(openedFile, elements, header=None):
+	# elements is a ELEMENT_DTYPE array or an iterable of (eid, pid, n1, n2, diameter) tuples
+	# second line holds the outer diameter (OD) at n1 and n2, inner diameters are left blank
 	if header != None:
 		openedFile.write(header + "\n")
-	for e in elements:
-		eid, pid, n1, n2, diameter = e
-		openedFile.write(setLengthStr(eid, 8))
-		openedFile.write(setLengthStr(pid, 8))
-		openedFile.write(setLengthStr(n1, 8))
-		openedFile.write(setLengthStr(n2, 8))
-		openedFile.write(setLengthStr(0, 8)) # n3
-		openedFile.write(setLengthStr(0, 8)) # rt1
-		openedFile.write(setLengthStr(0, 8)) # rr1
-		openedFile.write(setLengthStr(0, 8)) # rt2
-		openedFile.write(setLengthStr(0, 8)) # rr2
-		openedFile.write(setLengthStr(2, 8)) # local
-		openedFile.write("\n")
-		openedFile.write(setLengthStr(diameter, 16)) # outer diameter (OD) at n1
-		openedFile.write(setLengthStr(diameter, 16)) # OD at n2
-		openedFile.write(setLengthStr(diameter, 0)) # inner diameter (ID) at n1
-		openedFile.write(setLengthStr(diameter, 0)) # ID at n2
-		openedFile.write(setLengthStr(diameter, 0)) # not used; put a 0 here
-		openedFile.write("\n")
-
-def meshBeamEdges(G, size=1, eidStart=1, nidStart=None, diameterFlag=False, defaultDiameter=None):
+	for chunk in iterRecordChunks(elements, ELEMENT_DTYPE):
+		# n3, rt1, rr1, rt2, rr2, local
+		writeFixedWidth(openedFile, [(chunk["eid"], 8), (chunk["pid"], 8), (chunk["n1"], 8), (chunk["n2"], 8), (0, 8), (0, 8), (0, 8), (0, 8), (0, 8), (2, 8), ("\n", 1),
+			(chunk["diameter"], 16), (chunk["diameter"], 16), ("\n", 1)])
+
+NODE_DTYPE = np.dtype([("nid", np.int64), ("x", np.float64), ("y", np.float64), ("z", np.float64)])
+ELEMENT_DTYPE = np.dtype([("eid", np.int64), ("pid", np.int64), ("n1", np.int64), ("n2", np.int64), ("diameter", np.float64)])
+
+def meshBeamEdges(G, size=1, eidStart=1, nidStart=None, diameterFlag=False, defaultDiameter=None, minElementLength=None, minLengthRatio=None):
 	# meshes all edges in G with elements of size size
 	# assigns element numbers in order starting from eidStart (default = 1)
 	# creates extra nodes starting from nidStart (if set to None, will start at numberNodesInG + 1)
 	# if size > edge, then the entire edge will be one element
-	if nidStart == None:
-		nidStart = max(list(G)) + 1
-	elements = list()
-	allNodes = list()
-	for n in list(G):
-		allNodes.append((n, G.node[n]["pos"][0], G.node[n]["pos"][1], G.node[n]["pos"][2]))
-	nextNode = nidStart
-	if networkx.__version__ == "1.11":
-		iterObj = G.edges_iter()
-	elif networkx.__version__ == "2.2":
-		iterObj = G.edges
+	# G can also be a xlattice.Lattice or xlattice.TessellatedLattice
+	# minElementLength and minLengthRatio turn on adaptive meshing (see edgeElementCounts)
+	# returns (elements, allNodes) as lists of tuples, see meshBeamArrays for the array version
+	nodes, elements = meshBeamArrays(G, size, eidStart, nidStart, np.nan if defaultDiameter == None else defaultDiameter, minElementLength, minLengthRatio)
+	allNodes = nodes.tolist()
+	if diameterFlag:
+		elements = [e if e[4] == e[4] else e[0:4] + (defaultDiameter,) for e in elements.tolist()]
 	else:
-		raise Exception("Unsupported version of NetworkX! You must have 1.11 or 2.2!")
-	for e in iterObj: # this is a networkx 1.11 statement; will need to change depending on version
-		edgeLength = float(getEdgeLength(G, e))
-		nElements = int(math.ceil(edgeLength/size)) # round up
-		elementLength = edgeLength/nElements
-		prevNode = e[0]
-		x0, y0, z0 = G.node[e[0]]["pos"]
-		x1, y1, z1 = G.node[e[1]]["pos"]
-		for i in range(nElements):
-			if i == nElements - 1:
-				# don't create new node
-				nid = e[1]
-			else:
-				# create new node (nid, x, y, z)
-				unitv = unitVec((x0, y0, z0), (x1, y1, z1))
-				nid = nextNode
-				nextNode += 1 # increment if you create new node
-				x = x0 + unitv[0]*elementLength*(i+1)
-				y = y0 + unitv[1]*elementLength*(i+1)
-				z = z0 + unitv[2]*elementLength*(i+1)
-				allNodes.append((nid, x, y, z))
-			if diameterFlag:
-				if "diameter" in G.edges[e]:
-					diameter = G.edges[e]["diameter"]
-				else:
-					diameter = defaultDiameter
-				elements.append((eidStart, 1, prevNode, nid, diameter))
-			else: elements.append((eidStart, 1, prevNode, nid)) # assumes pid = 1
-			prevNode = nid
-			eidStart += 1
+		elements = [e[0:4] for e in elements.tolist()]
 	return elements, allNodes
 
+def meshBeamArrays(G, size=1, eidStart=1, nidStart=None, defaultDiameter=np.nan, minElementLength=None, minLengthRatio=None):
+	# array version of meshBeamEdges with the same numbering
+	# G can be a NetworkX graph, a xlattice.Lattice or a xlattice.TessellatedLattice
+	# returns (nodes, elements) structured arrays with dtypes NODE_DTYPE and ELEMENT_DTYPE
+	# edges without a diameter get defaultDiameter (NaN by default)
+	if not isinstance(G, (xlt.Lattice, xlt.TessellatedLattice)):
+		G = xlt.Lattice.fromArrays(*xlt.graphToArrays(G))
+	nodeChunks = list(iterNodeChunks(G))
+	elementChunks = [np.empty(0, dtype=ELEMENT_DTYPE)]
+	for newNodes, newElements in iterMeshedChunks(G, size, eidStart, nidStart, defaultDiameter, None, minElementLength, minLengthRatio):
+		nodeChunks.append(newNodes)
+		elementChunks.append(newElements)
+	return np.concatenate(nodeChunks), np.concatenate(elementChunks)
+
+def iterNodeChunks(lattice, chunkSize=None):
+	# yields the nodes of a xlattice.Lattice or xlattice.TessellatedLattice as NODE_DTYPE arrays of at most chunkSize nodes
+	# if chunkSize is None, a Lattice comes in one chunk and a TessellatedLattice in chunks of its own chunkSize
+	if isinstance(lattice, xlt.TessellatedLattice):
+		for nodeIDs, pos in lattice.iterNodes(chunkSize):
+			yield nodeArray(nodeIDs, pos)
+		return
+	if chunkSize == None:
+		chunkSize = max(1, len(lattice.nodeIDs))
+	pos = lattice.pos
+	for start in range(0, len(lattice.nodeIDs), chunkSize):
+		yield nodeArray(lattice.nodeIDs[start:start + chunkSize], pos[start:start + chunkSize])
+
+def iterEdgeChunks(lattice, chunkSize=None):
+	# yields the edges of a xlattice.Lattice or xlattice.TessellatedLattice as (n1, n2, diameters, pos1, pos2) arrays
+	# chunks hold at most chunkSize edges (a TessellatedLattice yields about chunkSize edges, see TessellatedLattice.iterEdges)
+	if isinstance(lattice, xlt.TessellatedLattice):
+		for chunk in lattice.iterEdges(chunkSize):
+			yield chunk
+		return
+	if chunkSize == None:
+		chunkSize = max(1, len(lattice.edges))
+	nodeIDs, pos = lattice.nodeIDs, lattice.pos
+	for start in range(0, len(lattice.edges), chunkSize):
+		edges = lattice.edges[start:start + chunkSize]
+		yield nodeIDs[edges[:, 0]], nodeIDs[edges[:, 1]], lattice.diameters[start:start + chunkSize], pos[edges[:, 0]], pos[edges[:, 1]]
+
+def iterMeshedChunks(lattice, size=1, eidStart=1, nidStart=None, defaultDiameter=np.nan, chunkSize=None, minElementLength=None, minLengthRatio=None):
+	# meshes a xlattice.Lattice or xlattice.TessellatedLattice one edge chunk at a time and yields (newNodes, elements) arrays
+	# chunks are split further so that none has more than chunkSize elements (unless a single edge does)
+	# numbering is the same as meshBeamArrays
+	if nidStart == None:
+		nidStart = maxNodeID(lattice) + 1
+	for n1, n2, diameters, pos1, pos2 in iterEdgeChunks(lattice, chunkSize):
+		pieces = [0, len(n1)]
+		if chunkSize != None:
+			edgeLength, nElements = edgeElementCounts(pos1, pos2, size, edgeDiameters(diameters, defaultDiameter), minElementLength, minLengthRatio)
+			pieceOfEdge = (np.cumsum(nElements) - 1) // chunkSize
+			pieces = [0] + (np.flatnonzero(np.diff(pieceOfEdge)) + 1).tolist() + [len(n1)]
+		for start, stop in zip(pieces[:-1], pieces[1:]):
+			newNodes, elements = meshEdgeArrays(n1[start:stop], n2[start:stop], pos1[start:stop], pos2[start:stop], diameters[start:stop], size, eidStart, nidStart, defaultDiameter, minElementLength, minLengthRatio)
+			eidStart += len(elements)
+			nidStart += len(newNodes)
+			yield newNodes, elements
+
+def maxNodeID(lattice):
+	# largest node ID of a xlattice.Lattice or xlattice.TessellatedLattice (0 if empty)
+	if isinstance(lattice, xlt.TessellatedLattice):
+		return lattice.maxNodeID()
+	return int(lattice.nodeIDs.max()) if len(lattice.nodeIDs) else 0
+
+def nodeArray(nodeIDs, pos):
+	# packs nodeIDs and an N x 3 pos array into a NODE_DTYPE array
+	nodes = np.empty(len(nodeIDs), dtype=NODE_DTYPE)
+	nodes["nid"] = nodeIDs
+	nodes["x"] = pos[:, 0]
+	nodes["y"] = pos[:, 1]
+	nodes["z"] = pos[:, 2]
+	return nodes
+
+def edgeElementCounts(p0, p1, size=1, diameters=None, minElementLength=None, minLengthRatio=None):
+	# returns (edgeLength, nElements) arrays for the edges going from p0[i] to p1[i]
+	# every edge gets ceil(length/size) elements, at least 1
+	# adaptive meshing: if minElementLength and/or minLengthRatio are set, edges get fewer elements where needed
+	# so that no element is shorter than minElementLength or minLengthRatio times its diameter
+	# (an edge that is already shorter than that stays one element)
+	d = np.asarray(p1, dtype=float).reshape(-1, 3) - np.asarray(p0, dtype=float).reshape(-1, 3)
+	edgeLength = np.sqrt(d[:, 0]**2 + d[:, 1]**2 + d[:, 2]**2)
+	nElements = np.maximum(np.ceil(edgeLength/size), 1).astype(np.int64) # round up
+	shortest = np.zeros(len(edgeLength))
+	if minElementLength != None:
+		shortest = np.maximum(shortest, minElementLength)
+	if minLengthRatio != None and diameters is not None:
+		shortest = np.maximum(shortest, minLengthRatio*np.nan_to_num(np.asarray(diameters, dtype=float)))
+	limited = shortest > 0
+	nElements[limited] = np.maximum(np.minimum(nElements[limited], np.floor(edgeLength[limited]/shortest[limited]).astype(np.int64)), 1)
+	return edgeLength, nElements
+
+def edgeDiameters(diameters, defaultDiameter=np.nan):
+	# returns diameters with NaN (not assigned) replaced by defaultDiameter
+	diameters = np.asarray(diameters, dtype=float)
+	return np.where(np.isnan(diameters), defaultDiameter, diameters)
+
+def meshEdgeArrays(n0, n1, p0, p1, diameters=None, size=1, eidStart=1, nidStart=1, defaultDiameter=np.nan, minElementLength=None, minLengthRatio=None):
+	# meshes the edges (n0[i], n1[i]) going from p0[i] to p1[i] (E x 3 arrays) all at once
+	# returns (newNodes, elements) structured arrays, numbered edge by edge in the given order
+	# every edge gets nElements from edgeElementCounts and one fewer new interior nodes
+	n0 = np.asarray(n0, dtype=np.int64)
+	n1 = np.asarray(n1, dtype=np.int64)
+	p0 = np.asarray(p0, dtype=float).reshape(-1, 3)
+	p1 = np.asarray(p1, dtype=float).reshape(-1, 3)
+	diameters = np.full(len(n0), defaultDiameter, dtype=float) if diameters is None else edgeDiameters(diameters, defaultDiameter)
+	d = p1 - p0
+	edgeLength, nElements = edgeElementCounts(p0, p1, size, diameters, minElementLength, minLengthRatio)
+	elementLength = edgeLength/nElements
+	with np.errstate(invalid="ignore", divide="ignore"):
+		step = d/edgeLength[:, None]*elementLength[:, None] # unit vector times element length
+	firstElement = np.cumsum(nElements) - nElements
+	firstNode = firstElement - np.arange(len(nElements)) # each edge creates nElements - 1 nodes
+
+	# interior nodes, k = 1 ... nElements - 1 along each edge
+	nNew = nElements - 1
+	nodeEdge = np.repeat(np.arange(len(nElements)), nNew)
+	k = np.arange(len(nodeEdge)) - np.repeat(firstNode, nNew) + 1
+	newNodes = np.empty(len(nodeEdge), dtype=NODE_DTYPE)
+	newNodes["nid"] = nidStart + np.arange(len(nodeEdge))
+	for axis, name in enumerate("xyz"):
+		newNodes[name] = p0[nodeEdge, axis] + step[nodeEdge, axis]*k
+
+	# elements, i = 0 ... nElements - 1 along each edge
+	elementEdge = np.repeat(np.arange(len(nElements)), nElements)
+	i = np.arange(len(elementEdge)) - firstElement[elementEdge]
+	interior = nidStart + firstNode[elementEdge] + i # node created at the end of element i
+	elements = np.empty(len(elementEdge), dtype=ELEMENT_DTYPE)
+	elements["eid"] = eidStart + np.arange(len(elementEdge))
+	elements["pid"] = 1 # assumes pid = 1
+	elements["n1"] = np.where(i == 0, n0[elementEdge], interior - 1)
+	elements["n2"] = np.where(i == nElements[elementEdge] - 1, n1[elementEdge], interior)
+	elements["diameter"] = diameters[elementEdge]
+	return newNodes, elements
+
+def estimateTimestep(lattice, size=1, defaultDiameter=0.1, cards=None, minElementLength=None, minLengthRatio=None, chunkSize=None):
+	# estimates the LS-Dyna critical timestep of the beam mesh meshBeamArrays would make, without meshing
+	# material and section data come from the *PART (pid 1), *MAT_ELASTIC, *SECTION_BEAM, and *CONTROL_TIMESTEP cards in cards
+	# returns {"timestep": tssfac times the smallest element timestep, "elementTimestep", "tssfac", "waveSpeed",
+	# "minElementLength", "controllingDiameter", "numberOfElements"}
+	density, youngsModulus, elform, tssfac = timestepParameters(cards)
+	report = {"timestep": math.inf, "elementTimestep": math.inf, "tssfac": tssfac, "waveSpeed": math.sqrt(youngsModulus/density),
+		"minElementLength": math.inf, "controllingDiameter": None, "numberOfElements": 0}
+	for n1, n2, diameters, pos1, pos2 in iterEdgeChunks(lattice, chunkSize):
+		diameters = edgeDiameters(diameters, defaultDiameter)
+		edgeLength, nElements = edgeElementCounts(pos1, pos2, size, diameters, minElementLength, minLengthRatio)
+		if len(nElements) == 0:
+			continue
+		elementLength = edgeLength/nElements
+		dt = beamTimestep(elementLength, diameters, youngsModulus, density, elform)
+		i = np.argmin(dt)
+		if dt[i] < report["elementTimestep"]:
+			report["elementTimestep"] = float(dt[i])
+			report["controllingDiameter"] = float(diameters[i])
+		report["minElementLength"] = min(report["minElementLength"], float(elementLength.min()))
+		report["numberOfElements"] += int(nElements.sum())
+	report["timestep"] = tssfac*report["elementTimestep"]
+	return report
+
+def beamTimestep(length, diameter, youngsModulus, density, elform=1):
+	# critical timestep of beam elements with solid circular sections (LS-Dyna theory manual)
+	# Hughes-Liu (elform 1) and trusses use the axial limit L/c,
+	# Belytschko-Schwer (elform 2) also has a bending limit 0.5L/(c*sqrt(3I*(3/(12I + AL^2) + 1/(AL^2))))
+	length = np.asarray(length, dtype=float)
+	c = math.sqrt(youngsModulus/density)
+	dt = length/c
+	if elform == 2:
+		diameter = np.asarray(diameter, dtype=float)
+		A = math.pi*diameter**2/4
+		I = math.pi*diameter**4/64
+		AL2 = A*length**2
+		dt = np.minimum(dt, 0.5*length/(c*np.sqrt(3*I*(3/(12*I + AL2) + 1/AL2))))
+	return dt
+
+def renumberMesh(nodes, elements, method="rcm", nidStart=1, eidStart=1):
+	# renumbers a meshed lattice (NODE_DTYPE and ELEMENT_DTYPE arrays from meshBeamArrays) for locality
+	# method is "compact" (keep the order, remove gaps), "rcm" (reverse Cuthill-McKee) or "morton" (Z-order space filling curve)
+	# nodes get IDs nidStart, nidStart + 1, ... in the new order
+	# elements are sorted by their new end nodes and numbered from eidStart
+	# returns (nodes, elements, nodeMap, report) where nodeMap is a NodeMap from old to new node IDs
+	# and report holds the bandwidth (largest |n1 - n2| over all elements) before and after
+	lookup = xlt.NodeRowLookup(nodes["nid"])
+	rows1 = lookup[elements["n1"]]
+	rows2 = lookup[elements["n2"]]
+	if method == "compact":
+		order = np.arange(len(nodes))
+	elif method == "rcm":
+		order = reverseCuthillMcKee(len(nodes), rows1, rows2)
+	elif method == "morton":
+		order = mortonOrder(np.stack((nodes["x"], nodes["y"], nodes["z"]), axis=1))
+	else:
+		raise ValueError("Unknown renumbering method %r! Use compact, rcm, or morton." % method)
+	newIDs = np.empty(len(nodes), dtype=np.int64)
+	newIDs[order] = nidStart + np.arange(len(nodes))
+	newNodes = nodes[order]
+	newNodes["nid"] = nidStart + np.arange(len(nodes))
+	n1 = newIDs[rows1]
+	n2 = newIDs[rows2]
+	elementOrder = np.lexsort((np.maximum(n1, n2), np.minimum(n1, n2)))
+	newElements = elements[elementOrder]
+	newElements["eid"] = eidStart + np.arange(len(elements))
+	newElements["n1"] = n1[elementOrder]
+	newElements["n2"] = n2[elementOrder]
+	report = {"method": method, "bandwidthBefore": bandwidth(elements), "bandwidthAfter": bandwidth(newElements),
+		"meanBandwidthBefore": meanBandwidth(elements), "meanBandwidthAfter": meanBandwidth(newElements),
+		"maxNodeIDBefore": int(nodes["nid"].max()) if len(nodes) else 0, "maxNodeIDAfter": int(nidStart + len(nodes) - 1)}
+	return newNodes, newElements, NodeMap(nodes["nid"], newIDs), report
+
+def bandwidth(elements):
+	# largest node ID difference |n1 - n2| over all elements
+	return int(np.abs(elements["n1"] - elements["n2"]).max()) if len(elements) else 0
+
+def meanBandwidth(elements):
+	# average node ID difference |n1 - n2| over all elements
+	return float(np.abs(elements["n1"] - elements["n2"]).mean()) if len(elements) else 0.0
+
+class NodeMap:
+	# maps old node IDs to renumbered ones (vectorized equivalent of a dict lookup)
+	def __init__(self, oldIDs, newIDs):
+		self.lookup = xlt.NodeRowLookup(np.asarray(oldIDs, dtype=np.int64))
+		self.newIDs = newIDs
+
+	def __getitem__(self, nodes):
+		return self.newIDs[self.lookup[nodes]]
+
+	def remap(self, nodeSet):
+		# returns nodeSet with every node ID replaced by its new ID (a set stays a set, anything else becomes a list)
+		newNodes = self[np.fromiter(nodeSet, dtype=np.int64)].tolist()
+		return set(newNodes) if isinstance(nodeSet, (set, frozenset)) else newNodes
+
+def reverseCuthillMcKee(nNodes, rows1, rows2):
+	# returns the reverse Cuthill-McKee ordering (array of rows) of a graph with nNodes nodes and edges (rows1[i], rows2[i])
+	# each connected component starts from a pseudo-peripheral node; isolated nodes go last
+	src = np.concatenate((rows1, rows2))
+	dst = np.concatenate((rows2, rows1))
+	keep = src != dst
+	src, dst = src[keep], dst[keep]
+	degree = np.bincount(src, minlength=nNodes)
+	neighbors = dst[np.argsort(src, kind="stable")]
+	indptr = np.concatenate(([0], np.cumsum(degree)))
+	visited = degree == 0
+	mark = np.zeros(nNodes, dtype=np.int64) # BFS stamp, so trial searches need no copy of visited
+	order = [np.flatnonzero(degree == 0)[::-1]]
+	stamp = 0
+	while not visited.all():
+		unvisited = np.flatnonzero(~visited)
+		start = unvisited[np.argmin(degree[unvisited])]
+		# George-Liu: move the start to a min degree node of the last level until the number of levels stops growing
+		stamp += 1
+		levels = cuthillMcKeeLevels(start, visited, mark, stamp, indptr, neighbors, degree)
+		for i in range(10):
+			last = levels[-1]
+			candidate = last[np.argmin(degree[last])]
+			stamp += 1
+			candidateLevels = cuthillMcKeeLevels(candidate, visited, mark, stamp, indptr, neighbors, degree)
+			if len(candidateLevels) <= len(levels):
+				break
+			start, levels = candidate, candidateLevels
+		component = np.concatenate(levels)
+		visited[component] = True
+		order.append(component)
+	return np.concatenate(order)[::-1]
+
+def cuthillMcKeeLevels(start, visited, mark, stamp, indptr, neighbors, degree):
+	# breadth first search from start in Cuthill-McKee order, one level at a time
+	# within a level, neighbors are taken parent by parent in increasing degree (same as the node by node algorithm)
+	# nodes that are visited or have mark == stamp are skipped; returns the list of level arrays
+	level = np.array([start], dtype=np.int64)
+	mark[start] = stamp
+	levels = list()
+	while len(level) != 0:
+		levels.append(level)
+		counts = degree[level]
+		parent = np.repeat(np.arange(len(level)), counts)
+		offsets = np.arange(len(parent)) - np.repeat(np.cumsum(counts) - counts, counts)
+		candidates = neighbors[np.repeat(indptr[level], counts) + offsets]
+		new = ~visited[candidates] & (mark[candidates] != stamp)
+		candidates, parent = candidates[new], parent[new]
+		candidates = candidates[np.lexsort((candidates, degree[candidates], parent))]
+		first = np.unique(candidates, return_index=True)[1]
+		level = candidates[np.sort(first)]
+		mark[level] = stamp
+	return levels
+
+def mortonOrder(pos):
+	# returns the order (array of rows) of the points in pos along a Z-order (Morton) space filling curve
+	# coordinates are quantized to 21 bits per axis over the bounding box
+	pos = np.asarray(pos, dtype=float).reshape(-1, 3)
+	if len(pos) == 0:
+		return np.arange(0)
+	low = pos.min(axis=0)
+	span = (pos.max(axis=0) - low).max()
+	if span == 0:
+		span = 1.0
+	quantized = ((pos - low)/span*(2**21 - 1)).astype(np.uint64)
+	code = np.zeros(len(pos), dtype=np.uint64)
+	for axis in range(3):
+		code |= spreadBits(quantized[:, axis]) << np.uint64(axis)
+	return np.argsort(code, kind="stable")
+
+def spreadBits(x):
+	# spreads the lower 21 bits of x so there are two zero bits between each of them (used for Morton codes)
+	x = x & np.uint64(0x1fffff)
+	x = (x | x << np.uint64(32)) & np.uint64(0x1f00000000ffff)
+	x = (x | x << np.uint64(16)) & np.uint64(0x1f0000ff0000ff)
+	x = (x | x << np.uint64(8)) & np.uint64(0x100f00f00f00f00f)
+	x = (x | x << np.uint64(4)) & np.uint64(0x10c30c30c30c30c3)
+	x = (x | x << np.uint64(2)) & np.uint64(0x1249249249249249)
+	return x
+
 def getEdgeLength(G, e):
 	n0, n1 = e
-	return math.sqrt((G.node[n0]["pos"][0]-G.node[n1]["pos"][0])**2 + (G.node[n0]["pos"][1]-G.node[n1]["pos"][1])**2 + (G.node[n0]["pos"][2]-G.node[n1]["pos"][2])**2)
+	return math.sqrt((G.nodes[n0]["pos"][0]-G.nodes[n1]["pos"][0])**2 + (G.nodes[n0]["pos"][1]-G.nodes[n1]["pos"][1])**2 + (G.nodes[n0]["pos"][2]-G.nodes[n1]["pos"][2])**2)
 
 def unitVec(a, b):
 	# returns normalized vector (u, v, w) representing unit vector from point a to point b
@@ -266,60 +728,390 @@ def unitVec(a, b):
 	vec = ((b[0]-a[0])/l, (b[1]-a[1])/l, (b[2]-a[2])/l)
 	return vec
 
-def parseDynaBndout(file):
+BNDOUT_FIELDS = ("Fx", "Fy", "Fz", "E")
+NODOUT_FIELDS = ("ux", "uy", "uz")
+
+class NodeHistory:
+	# nodal time histories in columnar form (see readDynaBndout and readDynaNodout)
+	# times is (T,), nodeIDs is (N,), data is (N, T, len(fields)) with NaN where a node has no output at a time
+	def __init__(self, times, nodeIDs, data, fields):
+		self.times = times
+		self.nodeIDs = nodeIDs
+		self.data = data
+		self.fields = fields
+		self._rows = dict(zip(nodeIDs.tolist(), range(len(nodeIDs))))
+
+	def __contains__(self, nid):
+		return nid in self._rows
+
+	def __getitem__(self, nid):
+		# T x fields array of node nid
+		return self.data[self._rows[nid]]
+
+	def field(self, name):
+		# N x T array of one field
+		return self.data[:, :, self.fields.index(name)]
+
+	def toDict(self):
+		# {nid: array of (t, field1, field2, ...) rows} like parseDynaBndout and parseDynaNodout always returned
+		results = dict()
+		for nid, row in self._rows.items():
+			present = ~np.isnan(self.data[row]).all(axis=1)
+			results[nid] = np.column_stack((self.times[present], self.data[row][present]))
+		return results
+
+def nodeHistoryFromRecords(times, steps, nids, values, fields):
+	# builds a NodeHistory from per line records: timestep index, node ID, and field values
+	times = np.asarray(times, dtype=float)
+	steps = np.asarray(steps, dtype=np.int64)
+	nids = np.asarray(nids, dtype=np.int64)
+	values = np.asarray(values, dtype=float).reshape(-1, len(fields))
+	keep = steps >= 0 # lines before the first time header are dropped
+	steps, nids, values = steps[keep], nids[keep], values[keep]
+	nodeIDs, rows = np.unique(nids, return_inverse=True)
+	data = np.full((len(nodeIDs), len(times), len(fields)), np.nan)
+	data[rows.reshape(-1), steps] = values
+	return NodeHistory(times, nodeIDs, data, fields)
+
+def parseFixedWidthColumns(lines, widths):
+	# parses equal layout fixed width lines into one float array per column (numbers may touch, so no splitting on spaces)
+	lineWidth = sum(widths)
+	if len(lines) == 0:
+		return [np.zeros(0) for width in widths]
+	table = np.frombuffer("".join(line[0:lineWidth].ljust(lineWidth) for line in lines).encode("ascii"), dtype=np.uint8).reshape(-1, lineWidth)
+	columns = list()
+	offset = 0
+	for width in widths:
+		columns.append(np.ascontiguousarray(table[:, offset:offset + width]).view("S%d" % width).reshape(-1).astype(float))
+		offset += width
+	return columns
+
+def readDynaBndout(file):
 	# file can either be filename or full file path + name
-	results = dict() # nid:numpy array N x 5 with (t, Fx, Fy, Fz, E) as elements
-	bndout = open(file, "r")
-	t = None
-	for line in bndout:
+	# reads every timestep in one pass and returns a NodeHistory with fields BNDOUT_FIELDS (Fx, Fy, Fz, E)
+	with open(file, "r") as bndout:
+		return nodeHistoryFromRecords(*bndoutRecords(bndout), BNDOUT_FIELDS)
+
+def bndoutRecords(lines):
+	# parses bndout lines into (times, step of each node line, node IDs, values N x 4)
+	times = list()
+	steps = list()
+	nids = list()
+	values = list()
+	for line in lines:
 		if " n o d a l   f o r c e/e n e r g y    o u t p u t  t=" in line:
-			t = float(line.split()[-1]) # get current timestep
+			times.append(float(line.split()[-1])) # get current timestep
 		elif " nd#" in line:
 			splitLine = line.split()
-			nid = int(splitLine[1])
-			Fx = float(splitLine[3])
-			Fy = float(splitLine[5])
-			Fz = float(splitLine[7])
-			E = float(splitLine[9])
-			if nid in results:
-				results[nid] = np.append(results[nid], np.array([t, Fx, Fy, Fz, E], ndmin=2), axis=0)
-			else:
-				results[nid] = np.array([t, Fx, Fy, Fz, E], ndmin=2)
-	bndout.close()
-	return results
+			steps.append(len(times) - 1)
+			nids.append(int(splitLine[1]))
+			values.extend((splitLine[3], splitLine[5], splitLine[7], splitLine[9]))
+	return times, steps, nids, np.array(values, dtype=float).reshape(-1, 4)
 
-def parseDynaNodout(file):
+def readDynaNodout(file):
 	# file can either be filename or full file path + name
-	results = dict() # nid:numpy array N x 4 with (t, ux, uy, uz) as elements
-	nodout = open(file, "r")
-	t = None
+	# reads every timestep in one pass and returns a NodeHistory with fields NODOUT_FIELDS (ux, uy, uz)
+	with open(file, "r") as nodout:
+		return nodeHistoryFromRecords(*nodoutRecords(nodout), NODOUT_FIELDS)
+
+def nodoutRecords(lines):
+	# parses nodout lines into (times, step of each node line, node IDs, displacements N x 3)
+	# every line of each displacement block is read (nodes are 10 characters, numbers 12 characters wide)
+	times = list()
+	steps = list()
+	dataLines = list()
 	isData = False # this is here bc of the weird file setup in nodout files
-	for line in nodout:
+	for line in lines:
 		if " n o d a l   p r i n t   o u t   f o r   t i m e  s t e p" in line:
-			t = float(line.split()[-2]) # get current timestep
+			times.append(float(line.split()[-2])) # get current timestep
+			isData = False
 		elif " nodal point  x-disp" in line:
-			isData = True 
-			continue # data is on next line; skip current line
+			isData = True
 		elif isData:
-			# nodout file is delimited in very strange way
-			# numbers seem to be delimited by 12 character increments
-			# nid is 10 delimited?
-			nid = int(line[0:10])
-			ux = float(line[10:22])
-			uy = float(line[22:34])
-			uz = float(line[34:46])
-			if nid in results:
-				results[nid] = np.append(results[nid], np.array([t, ux, uy, uz], ndmin=2), axis=0)
-			else:
-				results[nid] = np.array([t, ux, uy, uz], ndmin=2)
-			isData = False
-	nodout.close()
+			if len(line.strip()) == 0 or not line[0:10].strip().isdigit():
+				isData = False # end of the displacement block
+				continue
+			steps.append(len(times) - 1)
+			dataLines.append(line)
+	nids, ux, uy, uz = parseFixedWidthColumns(dataLines, (10, 12, 12, 12))
+	return times, steps, nids.astype(np.int64), np.column_stack((ux, uy, uz))
+
+def parseDynaBndout(file):
+	# file can either be filename or full file path + name
+	results = readDynaBndout(file).toDict() # nid:numpy array N x 5 with (t, Fx, Fy, Fz, E) as elements
 	return results
 
+def parseDynaNodout(file):
+	# file can either be filename or full file path + name
+	results = readDynaNodout(file).toDict() # nid:numpy array N x 4 with (t, ux, uy, uz) as elements
+	return results
+
+# byte patterns used to index bndout and nodout files without parsing every line (see indexDynaOutput)
+BNDOUT_HEADER = re.compile(rb" n o d a l   f o r c e/e n e r g y    o u t p u t  t=[^\n]*")
+BNDOUT_LINE = re.compile(rb"(?m)^ nd#\s*(\d+)")
+NODOUT_HEADER = re.compile(rb" n o d a l   p r i n t   o u t   f o r   t i m e  s t e p[^\n]*")
+NODOUT_BLOCK = re.compile(rb"(?m)^ nodal point  x-disp[^\n]*\n((?:[ \d]{9}\d[^\n]*\n)*)") # displacement header and its node lines
+NODOUT_LINE = re.compile(rb"(?m)^ *(\d+)")
+OUTPUT_INDEX_VERSION = 1
+
+def scanDynaOutput(buffer, kind, start=0, end=None):
+	# finds the timestep headers and node lines of a bndout or nodout file (kind) in buffer[start:end]
+	# returns (headerOffsets, times, lineOffsets, lineNodeIDs) as arrays, offsets are from the start of buffer
+	end = len(buffer) if end is None else end
+	if kind == "bndout":
+		headers = [(m.start(), float(m.group().split()[-1])) for m in BNDOUT_HEADER.finditer(buffer, start, end)]
+		lines = [(m.start(), int(m.group(1))) for m in BNDOUT_LINE.finditer(buffer, start, end)]
+	elif kind == "nodout":
+		headers = [(m.start(), float(m.group().split()[-2])) for m in NODOUT_HEADER.finditer(buffer, start, end)]
+		lines = list()
+		for block in NODOUT_BLOCK.finditer(buffer, start, end):
+			lines.extend((m.start(), int(m.group(1))) for m in NODOUT_LINE.finditer(buffer, block.start(1), block.end(1)))
+	else:
+		raise ValueError("Unknown output file kind " + str(kind) + ", expected bndout or nodout!")
+	headers = np.array(headers, dtype=float).reshape(-1, 2)
+	lines = np.array(lines, dtype=np.int64).reshape(-1, 2)
+	return headers[:, 0].astype(np.int64), headers[:, 1], lines[:, 0], lines[:, 1]
+
+def outputIndexFile(file):
+	# sidecar file holding the index of file (see indexDynaOutput)
+	return file + ".index.npz"
+
+def indexDynaOutput(file, kind=None):
+	# returns the index of a bndout or nodout file: a dict with the time of each timestep block ("times"), byte offsets of the
+	# blocks ("blockOffsets"), and the line offset of every node at every step grouped by node ("nodeIDs", "nodeStarts", "steps", "offsets")
+	# so the lines of node nodeIDs[i] are at offsets[nodeStarts[i]:nodeStarts[i + 1]] in steps steps[nodeStarts[i]:nodeStarts[i + 1]]
+	# the index is saved next to the file (outputIndexFile) and rebuilt when the size or modification time of the file changes
+	# kind is bndout or nodout, taken from the file name if not given
+	kind = os.path.basename(file).split(".")[0] if kind is None else kind
+	stat = os.stat(file)
+	indexFile = outputIndexFile(file)
+	try:
+		with np.load(indexFile) as saved:
+			if saved["version"] == OUTPUT_INDEX_VERSION and saved["size"] == stat.st_size and saved["mtime"] == stat.st_mtime_ns and str(saved["kind"]) == kind:
+				return {name: saved[name] for name in saved.files}
+	except (OSError, ValueError, KeyError):
+		pass # no index yet or an unreadable one, build it again
+	with open(file, "rb") as f:
+		if stat.st_size == 0:
+			headerOffsets, times, lineOffsets, lineNodeIDs = scanDynaOutput(b"", kind)
+		else:
+			with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+				headerOffsets, times, lineOffsets, lineNodeIDs = scanDynaOutput(buffer, kind)
+	steps = np.searchsorted(headerOffsets, lineOffsets, side="right") - 1
+	keep = steps >= 0 # node lines before the first header do not belong to a timestep
+	steps, lineOffsets, lineNodeIDs = steps[keep], lineOffsets[keep], lineNodeIDs[keep]
+	order = np.lexsort((steps, lineNodeIDs))
+	nodeIDs, counts = np.unique(lineNodeIDs[order], return_counts=True)
+	index = {"version": np.int64(OUTPUT_INDEX_VERSION), "kind": np.array(kind), "size": np.int64(stat.st_size), "mtime": np.int64(stat.st_mtime_ns),
+		"times": times, "blockOffsets": headerOffsets, "nodeIDs": nodeIDs, "nodeStarts": np.concatenate(([0], np.cumsum(counts))).astype(np.int64),
+		"steps": steps[order], "offsets": lineOffsets[order]}
+	tempFile = indexFile + ".%d.tmp" % os.getpid()
+	try:
+		with open(tempFile, "wb") as f:
+			np.savez(f, **index)
+		os.replace(tempFile, indexFile) # atomic, so jobs reading the same file never see half an index
+	except OSError:
+		warnings.warn("Could not save output index " + indexFile + ", it will be rebuilt next time.", RuntimeWarning, stacklevel=2)
+	return index
+
+def readDynaOutputNodes(file, nodeIDs, timeRange=None, kind=None):
+	# reads only the lines of nodeIDs (optionally only for times tStart <= t <= tEnd in timeRange) from a bndout or nodout file
+	# using its index (see indexDynaOutput); returns a NodeHistory like readDynaBndout or readDynaNodout would, restricted to those
+	# nodes and times (nodes without output are left out)
+	kind = os.path.basename(file).split(".")[0] if kind is None else kind
+	index = indexDynaOutput(file, kind)
+	times = index["times"]
+	selected = np.ones(len(times), dtype=bool)
+	if timeRange is not None:
+		tStart, tEnd = timeRange
+		selected = (times >= (-np.inf if tStart is None else tStart)) & (times <= (np.inf if tEnd is None else tEnd))
+	stepColumn = np.cumsum(selected) - 1 # step -> column in the result
+	requested = np.unique(np.asarray(list(nodeIDs), dtype=np.int64))
+	rows = np.searchsorted(index["nodeIDs"], requested)
+	found = rows < len(index["nodeIDs"])
+	found[found] = index["nodeIDs"][rows[found]] == requested[found]
+	requested, rows = requested[found], rows[found]
+	fields = BNDOUT_FIELDS if kind == "bndout" else NODOUT_FIELDS
+	steps = list()
+	nids = list()
+	lines = list()
+	if len(rows) != 0:
+		with open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+			for nid, row in zip(requested.tolist(), rows.tolist()):
+				nodeSteps = index["steps"][index["nodeStarts"][row]:index["nodeStarts"][row + 1]]
+				nodeOffsets = index["offsets"][index["nodeStarts"][row]:index["nodeStarts"][row + 1]]
+				keep = selected[nodeSteps]
+				for step, offset in zip(stepColumn[nodeSteps[keep]].tolist(), nodeOffsets[keep].tolist()):
+					steps.append(step)
+					nids.append(nid)
+					lines.append(buffer[offset:buffer.find(b"\n", offset)].decode("ascii"))
+	if kind == "bndout":
+		values = [[splitLine[3], splitLine[5], splitLine[7], splitLine[9]] for splitLine in (line.split() for line in lines)]
+		values = np.array(values, dtype=float).reshape(-1, len(fields))
+	else:
+		values = np.column_stack(parseFixedWidthColumns(lines, (10, 12, 12, 12))[1:])
+	return nodeHistoryFromRecords(times[selected], steps, nids, values, fields)
+
+class DynaOutputFollower:
+	# follows a bndout, nodout or glstat file while the simulation is still writing it
+	# every poll reads only the bytes appended since the last one and returns the timestep blocks completed since then
+	# (a NodeHistory, or a GlobalHistory for glstat)
+	# a block counts as complete once the header of the next block has been written, or when poll is called with final=True after the job ended,
+	# so a block (or line) that is only partly flushed is never parsed; if the file is replaced or shrinks (restarted job) it is read from the start again
+	def __init__(self, file, kind=None):
+		self.file = file
+		self.kind = os.path.basename(file).split(".")[0] if kind is None else kind
+		if self.kind not in FOLLOWED_OUTPUTS:
+			raise ValueError("Unknown output file kind " + str(self.kind) + ", expected one of " + ", ".join(FOLLOWED_OUTPUTS) + "!")
+		self.header, self.parse = FOLLOWED_OUTPUTS[self.kind]
+		self.reset()
+
+	def reset(self):
+		self.offset = 0 # start of the first block not returned yet
+		self.steps = 0 # number of blocks returned so far
+		self.identity = None # (device, inode) of the file, to notice it being replaced
+
+	def poll(self, final=False):
+		try:
+			stat = os.stat(self.file)
+		except FileNotFoundError:
+			return self.parse([]) # job has not written anything yet
+		if (stat.st_dev, stat.st_ino) != self.identity or stat.st_size < self.offset:
+			self.reset()
+			self.identity = (stat.st_dev, stat.st_ino)
+		with open(self.file, "rb") as f:
+			f.seek(self.offset)
+			data = f.read()
+		if final:
+			end = len(data)
+		else:
+			data = data[:data.rfind(b"\n") + 1] # a partly written last line is left for the next poll
+			starts = [m.start() for m in self.header.finditer(data)]
+			end = starts[-1] if len(starts) > 1 or (len(starts) == 1 and starts[0] != 0) else 0 # the last block may still be growing
+		self.offset += end
+		history = self.parse(data[:end].decode("ascii", "replace").splitlines(True))
+		self.steps += len(history.times)
+		return history
+
+GLSTAT_HEADER = re.compile(rb"(?m)^ time\.{2,}") # every glstat block starts with the time
+GLSTAT_LINE = re.compile(r"^ (\S.*?)\s*\.+\s*([-+]?[0-9.]+(?:[Ee][-+]?[0-9]+)?)\s*$")
+GLSTAT_NAMES = {"total_energy_initial_energy": "energy_ratio", "energy_ratio_w_o_eroded_energy": "energy_ratio_wo_eroded"} # same names as binout
+
+class GlobalHistory:
+	# time history of global (not per node) output in columnar form (see readDynaGlstat)
+	# times is (T,), data is (T, len(fields)) with NaN where a field was not written at a time
+	def __init__(self, times, data, fields):
+		self.times = times
+		self.data = data
+		self.fields = fields
+
+	def __contains__(self, name):
+		return name in self.fields
+
+	def __getitem__(self, name):
+		# T array of one field
+		return self.data[:, self.fields.index(name)]
+
+def glstatName(label):
+	# "kinetic energy" -> "kinetic_energy", matching the glstat names in binout files
+	name = re.sub(r"[^a-z0-9]+", "_", label.lower()).strip("_")
+	return GLSTAT_NAMES.get(name, name)
+
+def glstatRecords(lines):
+	# parses glstat lines into a GlobalHistory, a new timestep starts at every "time....." line
+	fields = dict() # name: column, in order of appearance
+	rows = list()
+	for line in lines:
+		match = GLSTAT_LINE.match(line)
+		if match is None:
+			continue
+		name = glstatName(match.group(1))
+		if name == "time":
+			rows.append(dict())
+		elif len(rows) == 0:
+			continue # lines before the first timestep
+		if name not in fields:
+			fields[name] = len(fields)
+		rows[-1][fields[name]] = float(match.group(2))
+	data = np.full((len(rows), len(fields)), np.nan)
+	for i, row in enumerate(rows):
+		data[i, list(row.keys())] = list(row.values())
+	times = data[:, fields["time"]] if "time" in fields else np.zeros(0)
+	return GlobalHistory(times, data, tuple(fields))
+
+def readDynaGlstat(file):
+	# file can either be filename or full file path + name
+	# reads every timestep in one pass and returns a GlobalHistory with one field per glstat line (time, time_step, kinetic_energy, ...)
+	with open(file, "r") as glstat:
+		return glstatRecords(glstat)
+
+# output files DynaOutputFollower can follow: (block header pattern, parser of a list of lines)
+FOLLOWED_OUTPUTS = {
+	"bndout": (BNDOUT_HEADER, lambda lines: nodeHistoryFromRecords(*bndoutRecords(lines), BNDOUT_FIELDS)),
+	"nodout": (NODOUT_HEADER, lambda lines: nodeHistoryFromRecords(*nodoutRecords(lines), NODOUT_FIELDS)),
+	"glstat": (GLSTAT_HEADER, glstatRecords)}
+
+class GlstatMonitor:
+	# checks the glstat file of a running job for signs of a bad run, so the job can be cancelled before it uses its whole maxTime
+	# each poll reads the newly completed timesteps (see DynaOutputFollower) and returns the new issues as (time, message) pairs;
+	# each kind of issue is reported once, at the first time it happens, and all of them are kept in issues
+	# checks (None turns a check off):
+	#   energy ratio (total / initial energy) further than maxEnergyRatioDrift from 1
+	#   time step below minTimestepFraction times the first time step
+	#   hourglass energy above maxHourglassFraction times the internal energy
+	#   sliding interface (contact) energy magnitude above maxContactFraction times the total energy
+	def __init__(self, file, maxEnergyRatioDrift=0.1, minTimestepFraction=0.1, maxHourglassFraction=0.1, maxContactFraction=0.1):
+		self.follower = DynaOutputFollower(file, "glstat")
+		self.maxEnergyRatioDrift = maxEnergyRatioDrift
+		self.minTimestepFraction = minTimestepFraction
+		self.maxHourglassFraction = maxHourglassFraction
+		self.maxContactFraction = maxContactFraction
+		self.initialTimestep = None
+		self.issues = list()
+		self.reported = set()
+
+	@property
+	def healthy(self):
+		return len(self.issues) == 0
+
+	def poll(self, final=False):
+		history = self.follower.poll(final)
+		newIssues = list()
+		if len(history.times) == 0:
+			return newIssues
+		with np.errstate(invalid="ignore"):
+			if self.maxEnergyRatioDrift != None and "energy_ratio" in history:
+				ratio = history["energy_ratio"]
+				# the ratio is written as 0 while there is no initial energy yet
+				self._check(history, "energy ratio", (ratio != 0) & (np.abs(ratio - 1) > self.maxEnergyRatioDrift), ratio, newIssues)
+			if self.minTimestepFraction != None and "time_step" in history:
+				dt = history["time_step"]
+				if self.initialTimestep is None and (dt > 0).any():
+					self.initialTimestep = dt[dt > 0][0]
+				if self.initialTimestep is not None:
+					self._check(history, "time step", dt < self.minTimestepFraction*self.initialTimestep, dt, newIssues)
+			if self.maxHourglassFraction != None and "hourglass_energy" in history and "internal_energy" in history:
+				hourglass, internal = history["hourglass_energy"], history["internal_energy"]
+				self._check(history, "hourglass energy", (internal > 0) & (hourglass > self.maxHourglassFraction*internal), hourglass, newIssues)
+			if self.maxContactFraction != None and "sliding_interface_energy" in history and "total_energy" in history:
+				contact, total = history["sliding_interface_energy"], history["total_energy"]
+				self._check(history, "sliding interface energy", (total > 0) & (np.abs(contact) > self.maxContactFraction*total), contact, newIssues)
+		self.issues.extend(newIssues)
+		return newIssues
+
+	def _check(self, history, name, flagged, values, newIssues):
+		# reports the first flagged timestep of check name, unless it was reported before
+		if name in self.reported or not flagged.any():
+			return
+		first = np.argmax(flagged)
+		self.reported.add(name)
+		newIssues.append((float(history.times[first]), name + " is " + str(values[first]) + " at t = " + str(history.times[first])))
+
 def importDynaCardsList(file):
 	# file can either be filename or full file path + name
 	# reads a file full of LS-Dyna keyword cards and returns a list
 	# cards are separated by *
+	# see dynacards.loadDeck for parsed cards that can be changed field by field
 	f = open(file)
 	cards = list()
 	currentCard = ""
@@ -332,6 +1124,50 @@ def importDynaCardsList(file):
 	f.close()
 	return cards
 
+def readCards(cards, keyword):
+	# cards is a list of LS-Dyna keyword cards (see importDynaCardsList) or a dynacards.Deck
+	# returns the data lines of every card whose keyword starts with keyword (e.g. "*MAT_ELASTIC")
+	# as a list of lists of lines, with comment lines and titles (*..._TITLE, *PART heading) removed
+	matches = list()
+	for card in cards:
+		lines = str(card).splitlines()
+		if len(lines) == 0 or not lines[0].strip().upper().startswith(keyword.upper()):
+			continue
+		data = [line for line in lines[1:] if not line.startswith("$") and len(line.strip()) != 0]
+		name = lines[0].split()[0].upper()
+		if name.endswith("_TITLE") or name == "*PART":
+			data = data[1:]
+		matches.append(data)
+	return matches
+
+def cardField(line, field, width=10, default=None):
+	# returns field number field (starting at 0) of a fixed width card line as a float, or default if it is blank
+	text = line[field*width:(field + 1)*width].strip()
+	if len(text) == 0:
+		return default
+	return float(text)
+
+def timestepParameters(cards):
+	# returns (density, youngsModulus, elform, tssfac) of part 1 from the *PART, *MAT_ELASTIC, *SECTION_BEAM, and *CONTROL_TIMESTEP cards
+	# if there is no *PART 1, the first material and section are used; tssfac defaults to 0.9 like LS-Dyna
+	if cards == None:
+		raise ValueError("Cards with *MAT_ELASTIC and *SECTION_BEAM are needed to estimate the timestep!")
+	mid, secid = None, None
+	for part in readCards(cards, "*PART"):
+		if len(part) != 0 and cardField(part[0], 0) == 1:
+			mid, secid = cardField(part[0], 2), cardField(part[0], 1)
+	materials = [m for m in readCards(cards, "*MAT_ELASTIC") if mid == None or cardField(m[0], 0) == mid]
+	sections = [s for s in readCards(cards, "*SECTION_BEAM") if secid == None or cardField(s[0], 0) == secid]
+	if len(materials) == 0 or len(sections) == 0:
+		raise ValueError("Cards with *MAT_ELASTIC and *SECTION_BEAM are needed to estimate the timestep!")
+	density, youngsModulus = cardField(materials[0][0], 1), cardField(materials[0][0], 2)
+	elform = int(cardField(sections[0][0], 1, default=1))
+	tssfac = 0.9
+	for control in readCards(cards, "*CONTROL_TIMESTEP"):
+		if len(control) != 0:
+			tssfac = cardField(control[0], 1, default=0) or 0.9
+	return density, youngsModulus, elform, tssfac
+
 def objectiveFunction(array, target, start=None, stop=None, step=0.01):
 	# evaluates how "close" array and target are
 	# array and target must both be two column ndarrays of any number of rows
@@ -341,7 +1177,20 @@ def objectiveFunction(array, target, start=None, stop=None, step=0.01):
 	# if start or stop are not provided, the most restrictive domain will be used
 	# objective function is 1/nSteps*sum(|array(i)-target(i)|) for every point i defined by step size
 	# linear interpolation will be used for intermediate points
+	# to score many arrays against the same target use objectiveFunctions
+
+	start, stop = objectiveDomain(array, target, start, stop, step)
 
+	# linearly interpolate both arrays
+	arrayInterpolated = interpolateArray(array, start, stop, step)
+	targetInterpolated = interpolateArray(target, start, stop, step)
+
+	# calculate objective function (loss function)
+	numSteps = int((stop - start)/float(step)) + 1
+	return 1/float(numSteps)*np.sum(np.abs(arrayInterpolated[:, 1] - targetInterpolated[:, 1]))
+
+def objectiveDomain(array, target, start, stop, step):
+	# checks the arguments of objectiveFunction and returns the (start, stop) domain it uses
 	assert(step > 0)
 	assert(array.shape[1] == 2)
 	assert(target.shape[1] == 2)
@@ -360,14 +1209,101 @@ def objectiveFunction(array, target, start=None, stop=None, step=0.01):
 
 	assert(start <= stop)
 	assert(stop - start >= step)
+	return start, stop
 
-	# linearly interpolate both arrays
-	arrayInterpolated = interpolateArray(array, start, stop, step)
-	targetInterpolated = interpolateArray(target, start, stop, step)
+def objectiveFunctions(arrays, target, start=None, stop=None, step=0.01, topK=None):
+	# objectiveFunction of every array in arrays (e.g. the load-displacement curves of a whole DOE) against the same target
+	# returns a vector of objectives, NaN for arrays objectiveFunction would reject (e.g. a curve that does not cover the domain)
+	# if topK is given, also returns the indices of the topK best (lowest) objectives, best first: (objectives, indices)
+	# all arrays are interpolated in one pass (see interpolateGrids), whatever their lengths and domains
+	objectives = np.full(len(arrays), np.nan)
+	target = np.asarray(target, dtype=float)
+	arrays = [np.asarray(array, dtype=float) for array in arrays]
+	curves = np.array([i for i, array in enumerate(arrays) if array.ndim == 2 and array.shape[1] == 2 and len(array) != 0], dtype=np.int64)
+	if len(curves) != 0 and step > 0 and target.ndim == 2 and target.shape[1] == 2 and len(target) != 0:
+		# domain of every array, with the same checks as objectiveDomain
+		minStart = np.maximum([arrays[i][0, 0] for i in curves.tolist()], target[0, 0])
+		maxStop = np.minimum([arrays[i][-1, 0] for i in curves.tolist()], target[-1, 0])
+		begins = minStart if start == None else np.full(len(curves), start, dtype=float)
+		ends = maxStop if stop == None else np.full(len(curves), stop, dtype=float)
+		valid = (begins >= minStart) & (ends <= maxStop) & (begins <= ends) & (ends - begins >= step)
+		curves, begins, ends = curves[valid], begins[valid], ends[valid]
+	else:
+		curves = curves[0:0]
+	if len(curves) != 0:
+		points = np.concatenate([arrays[i] for i in curves.tolist()])
+		lengths = np.array([len(arrays[i]) for i in curves.tolist()], dtype=np.int64)
+		numSteps = ((ends - begins)/float(step)).astype(np.int64) + 1
+		x, y, starts = interpolateGrids(points, lengths, begins, numSteps, step)
+		# target at the same (flattened) grid points
+		upper = np.minimum(np.searchsorted(target[:, 0], x, side="left"), len(target) - 1)
+		targetY = interpolateBetween(target[:, 0], target[:, 1], x, upper)
+		difference = np.abs(y - targetY)
+		# sum curves with the same number of steps together as rows (np.sum of a row matches np.sum of a vector)
+		for n in np.unique(numSteps).tolist():
+			rows = np.flatnonzero(numSteps == n)
+			objectives[curves[rows]] = 1/float(n)*np.sum(difference[starts[rows, np.newaxis] + np.arange(n)], axis=1)
+	if topK is None:
+		return objectives
+	valid = np.flatnonzero(~np.isnan(objectives))
+	topK = min(topK, len(valid))
+	if topK == 0:
+		return objectives, np.zeros(0, dtype=np.int64)
+	best = valid[np.argpartition(objectives[valid], topK - 1)[0:topK]]
+	return objectives, best[np.argsort(objectives[best], kind="stable")]
 
-	# calculate objective function (loss function)
-	numSteps = int((stop - start)/float(step)) + 1
-	return 1/float(numSteps)*np.sum(np.abs(arrayInterpolated[:, 1] - targetInterpolated[:, 1]))
+def interpolateGrids(points, lengths, begins, numSteps, step):
+	# linearly interpolates many arrays at once, each on its own grid begins[k] + step*(0, ..., numSteps[k] - 1)
+	# points holds the two column arrays back to back (lengths[k] rows each), x ascending within each array
+	# returns the flattened grids x, the interpolated values y, and the start of each grid in x and y
+	# gives the same values as interpolateArray; instead of a searchsorted per array, the points of all arrays are counted
+	# per grid step with one bincount
+	nArrays = len(lengths)
+	offsets = np.cumsum(lengths) - lengths
+	starts = np.cumsum(numSteps) - numSteps
+	total = int(numSteps.sum())
+	local = np.arange(total) - np.repeat(starts, numSteps)
+	x = np.repeat(begins, numSteps) + local*step
+	# first grid index to the right of every point (numSteps if none), with the same arithmetic as x
+	row = np.repeat(np.arange(nArrays), lengths)
+	n = numSteps[row]
+	px = points[:, 0]
+	if np.all(begins == begins[0]):
+		# one grid (cut to numSteps) for all arrays
+		right = np.minimum(np.searchsorted(begins[0] + np.arange(numSteps.max())*step, px, side="right"), n)
+	else:
+		# grid step computed directly, then corrected for rounding
+		b = begins[row]
+		with np.errstate(invalid="ignore"):
+			right = np.clip(np.floor((px - b)/step) + 1, 0, n).astype(np.int64)
+		right[np.isnan(px)] = n[np.isnan(px)]
+		while True:
+			forward = (right < n) & (b + right*step <= px)
+			backward = (right > 0) & (b + (right - 1)*step > px)
+			if not forward.any() and not backward.any():
+				break
+			right += forward.astype(np.int64) - backward.astype(np.int64)
+	# points left of every grid point, i.e. searchsorted(array x, grid x, side="left")
+	bins = np.cumsum(numSteps + 1) - (numSteps + 1)
+	histogram = np.bincount(bins[row] + right, minlength=int(bins[-1] + numSteps[-1] + 1))
+	counts = np.cumsum(histogram)
+	left = counts[np.repeat(bins, numSteps) + local] - np.repeat(counts[bins] - histogram[bins], numSteps)
+	gridRow = np.repeat(np.arange(nArrays), numSteps)
+	upper = np.repeat(offsets, numSteps) + np.minimum(left, lengths[gridRow] - 1)
+	lower = np.maximum(upper - 1, np.repeat(offsets, numSteps))
+	return x, interpolateBetween(points[:, 0], points[:, 1], x, upper, lower), starts
+
+def interpolateBetween(xs, ys, x, upper, lower=None):
+	# linear interpolation at x between the points at rows lower (default upper - 1) and upper of xs, ys
+	if lower is None:
+		lower = np.maximum(upper - 1, 0)
+	x0 = xs[lower]
+	y0 = ys[lower]
+	x1 = xs[upper]
+	y1 = ys[upper]
+	exact = x1 == x
+	with np.errstate(divide="ignore", invalid="ignore"):
+		return np.where(exact, y1, y0 + (x - x0)*(y1 - y0)/(x1 - x0)) # same formula as linearInterpolate, a point at x is used as is
 
 # linearly interpolate an array within domain given by begin, end, and step
 def interpolateArray(arr, begin, end, step):
@@ -377,30 +1313,12 @@ def interpolateArray(arr, begin, end, step):
 	assert(arr[-1, 0] >= end)
 	numSteps = int((end - begin)/float(step)) + 1
 	result = np.zeros((numSteps, 2))
-	for i in range(numSteps):
-		x = begin + i*step
-		result[i, 0] = x
-		# find points bounding x
-		# search left to right to find upper bound
-		# start from upper bound and search right to left to find lower bound
-		x0 = None
-		y0 = None
-		x1 = None
-		y1 = None
-		index1 = None
-		for j in range(arr.shape[0]):
-			if arr[j, 0] >= x: # upper bound found
-				x1 = arr[j, 0]
-				y1 = arr[j, 1]
-				index1 = j
-				break
-		for j in range(index1, -1, -1):
-			if arr[j, 0] <= x: # lower found bound
-				x0 = arr[j, 0]
-				y0 = arr[j, 1]
-				break
-		result[i, 1] = linearInterpolate(x0, y0, x1, y1, x)
-	return result		
+	x = begin + np.arange(numSteps)*step
+	result[:, 0] = x
+	# upper bound is the first point at or right of x, lower bound the point before it
+	upper = np.minimum(np.searchsorted(arr[:, 0], x, side="left"), len(arr) - 1)
+	result[:, 1] = interpolateBetween(arr[:, 0], arr[:, 1], x, upper)
+	return result
 
 def linearInterpolate(x0, y0, x1, y1, x):
 	# given points (x0, y0) and (x1, y1) and point x, linearly interpolate to find y
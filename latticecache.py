@@ -0,0 +1,220 @@
+"""
+latticecache
+This module memoizes lattice generators on disk so parameter sweeps do not rebuild the same geometry every run
+
+Results are keyed on the generator name, its normalized arguments (defaults filled in), and xlattice.__version__
+Every entry is a directory holding the pickled result; Lattice objects inside the result are stored as binary
+lattice files (see xlattice.saveLattice) and memory mapped when loaded
+The store is bounded by maxBytes; the least recently used entries are evicted first (entry mtime is the access time)
+Calls with an argument that has no stable identity (a lambda, closure, functools.partial, or bound method) are not cached
+
+Example:
+    cache = LatticeCache("/path/to/cache/")
+
+    @cache.cached
+    def myLattice(theta, AR, length=10):
+        ...
+        return xlt.Lattice(G)
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import warnings
+import numpy as np
+import xlattice as xlt
+
+DEFAULT_MAX_BYTES = 2*1024**3 # 2 GB
+
+class LatticeCache:
+    def __init__(self, directory, maxBytes=DEFAULT_MAX_BYTES, mmap=True):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.mmap = mmap
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "uncached": 0}
+
+    def cached(self, generator):
+        # decorator: returns a version of generator whose results are cached in this store
+        @functools.wraps(generator)
+        def wrapper(*args, **kwargs):
+            return self.call(generator, *args, **kwargs)
+        wrapper.cache = self
+        return wrapper
+
+    def call(self, generator, *args, **kwargs):
+        # returns generator(*args, **kwargs), loading it from the store if it was generated before
+        try:
+            key = self.key(generator, args, kwargs)
+        except UncacheableParameter as error:
+            warnings.warn(str(error) + ", calling it without the cache.", RuntimeWarning, stacklevel=2)
+            self.stats["uncached"] += 1
+            return generator(*args, **kwargs)
+        entry = os.path.join(self.directory, key)
+        if os.path.isdir(entry):
+            try:
+                result = self._load(entry)
+            except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+                result = None # incomplete or corrupted entry; regenerate it
+            else:
+                os.utime(entry) # mark as recently used
+                self.stats["hits"] += 1
+                return result
+        self.stats["misses"] += 1
+        result = generator(*args, **kwargs)
+        self._store(entry, result)
+        self.evict()
+        return result
+
+    def key(self, generator, args, kwargs):
+        # hash of generator name, normalized arguments, and xlattice version
+        # raises UncacheableParameter if the generator or an argument has no stable identity
+        try:
+            bound = inspect.signature(generator).bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+        except (TypeError, ValueError):
+            arguments = {"args": list(args), "kwargs": kwargs}
+        description = json.dumps([normalizeParameter(generator), normalizeParameter(arguments), xlt.__version__], sort_keys=True)
+        return hashlib.sha256(description.encode("utf8")).hexdigest()
+
+    def size(self):
+        # total number of bytes used by the store
+        return sum(size for path, size, mtime in self._entries())
+
+    def evict(self):
+        # removes least recently used entries until the store fits in maxBytes
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for path, size, mtime in entries)
+        for path, size, mtime in entries:
+            if total <= self.maxBytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            self.stats["evictions"] += 1
+
+    def clear(self):
+        # removes all entries
+        for path, size, mtime in self._entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+    ### HELPER METHODS ###
+
+    def _entries(self):
+        # returns a list of (path, bytes, mtime) for every entry in the store
+        entries = list()
+        if not os.path.isdir(self.directory):
+            return entries
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((path, size, os.path.getmtime(path)))
+            except OSError:
+                continue # entry removed by another process
+        return entries
+
+    def _store(self, entry, result):
+        # writes result into a temporary directory and moves it into place so readers never see partial entries
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = tempfile.mkdtemp(prefix=".tmp", dir=self.directory)
+        lattices = list()
+
+        def extract(value):
+            # replaces Lattice objects with placeholders and saves them as lattice files
+            if isinstance(value, xlt.Lattice):
+                fileName = "lattice" + str(len(lattices)) + ".xlat"
+                xlt.saveLattice(value, os.path.join(temporary, fileName))
+                lattices.append(fileName)
+                return _StoredLattice(fileName)
+            if isinstance(value, tuple):
+                return tuple(extract(v) for v in value)
+            if isinstance(value, list):
+                return [extract(v) for v in value]
+            if isinstance(value, dict):
+                return {k: extract(v) for k, v in value.items()}
+            return value
+
+        try:
+            with open(os.path.join(temporary, "result.pkl"), "wb") as f:
+                pickle.dump(extract(result), f, protocol=pickle.HIGHEST_PROTOCOL)
+            if os.path.isdir(entry):
+                old = tempfile.mkdtemp(prefix=".old", dir=self.directory)
+                os.replace(entry, os.path.join(old, "entry")) # move the corrupted entry out of the way first
+                shutil.rmtree(old, ignore_errors=True)
+            os.replace(temporary, entry)
+        except OSError as error:
+            shutil.rmtree(temporary, ignore_errors=True)
+            if not os.path.isdir(entry): # otherwise another process stored the same entry first
+                warnings.warn("Could not store cache entry " + entry + " (" + str(error) + "), it will be generated again next time.", RuntimeWarning, stacklevel=3)
+
+    def _load(self, entry):
+        with open(os.path.join(entry, "result.pkl"), "rb") as f:
+            stored = pickle.load(f)
+
+        def restore(value):
+            if isinstance(value, _StoredLattice):
+                return xlt.loadLattice(os.path.join(entry, value.fileName), self.mmap)
+            if isinstance(value, tuple):
+                return tuple(restore(v) for v in value)
+            if isinstance(value, list):
+                return [restore(v) for v in value]
+            if isinstance(value, dict):
+                return {k: restore(v) for k, v in value.items()}
+            return value
+
+        return restore(stored)
+
+class UncacheableParameter(TypeError):
+    # raised by normalizeParameter for callables that cannot be told apart by name
+    pass
+
+class _StoredLattice:
+    # placeholder for a Lattice saved next to the pickled result
+    def __init__(self, fileName):
+        self.fileName = fileName
+
+def normalizeParameter(value):
+    # converts generator arguments into a canonical JSON compatible form
+    # (floats by repr so equal values give equal keys, sets sorted, NumPy types converted)
+    if isinstance(value, (bool, str)) or value is None:
+        return value
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        value = float(value)
+        if value.is_integer() and abs(value) < 2**53:
+            return int(value) # 10 and 10.0 generate the same lattice
+        return repr(value)
+    if isinstance(value, np.ndarray):
+        return normalizeParameter(value.tolist())
+    if isinstance(value, (list, tuple)):
+        return [normalizeParameter(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((normalizeParameter(v) for v in value), key=repr)
+    if isinstance(value, dict):
+        return [[normalizeParameter(k), normalizeParameter(v)] for k, v in sorted(value.items(), key=lambda item: repr(item[0]))]
+    if callable(value):
+        return stableName(value)
+    return repr(value)
+
+def stableName(function):
+    # module.qualname of a function or class that can be imported back from that name
+    # lambdas, closures, functools.partial, bound methods, and callable instances would share (or lack) a name
+    # with other callables that behave differently, so they raise UncacheableParameter
+    module = getattr(function, "__module__", None)
+    qualname = getattr(function, "__qualname__", None)
+    target = sys.modules.get(module) if isinstance(module, str) and isinstance(qualname, str) else None
+    for part in qualname.split(".") if target is not None else ():
+        target = getattr(target, part, None)
+    while target is not function and hasattr(target, "__wrapped__"):
+        target = target.__wrapped__ # e.g. a generator decorated with LatticeCache.cached
+    if target is not function:
+        raise UncacheableParameter(repr(function) + " has no stable name to cache it by")
+    return module + "." + qualname
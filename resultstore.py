@@ -0,0 +1,216 @@
+"""
+resultstore
+This module keeps the output of finished LS-Dyna jobs in a columnar on-disk store keyed by their DOE parameters
+
+Each job is parsed once: the time histories in its bndout, nodout, and glstat files are saved as .npy arrays (times,
+node IDs, and a nodes x times x fields block, see dynautil.NodeHistory and dynautil.GlobalHistory) in an entry
+directory named by the hash of the parameters, next to a meta.json with the parameters and the size and mtime of every
+source file. An entry is ingested again when one of its source files changes (e.g. the job was rerun), and arrays are
+memory mapped when loaded, so a whole sweep can be queried without reading ASCII output again.
+
+Example:
+    store = ResultStore(HOMEDIRECTORY + "results/")
+    store.ingest({"theta12": 90, "theta23": 45, "AR1": 12, "AR2": 16, "AR3": 12}, directory)
+    for parameters, curve in store.curves(1, AR2=16): # uz and Fz of node 1 for every run with AR2 = 16
+        plt.plot(-curve[:, 0], -curve[:, 1])
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import dynautil as util
+from latticecache import normalizeParameter
+
+DEFAULT_KINDS = ("bndout", "nodout", "glstat")
+
+class ResultStore:
+    def __init__(self, directory, mmap=True):
+        self.directory = directory
+        self.mmap = mmap
+        self.stats = {"hits": 0, "ingested": 0}
+        self._meta = dict() # entry name: (meta.json mtime, meta)
+
+    def key(self, parameters):
+        # hash of the normalized parameters, so 16 and 16.0 give the same entry
+        description = json.dumps(["resultstore 1", normalizeParameter(dict(parameters))], sort_keys=True)
+        return hashlib.sha256(description.encode("utf8")).hexdigest()
+
+    def ingest(self, parameters, jobDirectory, kinds=DEFAULT_KINDS, nodeIDs=None):
+        # parses the output files (kinds) in jobDirectory into the entry of parameters, unless they were ingested before and have not changed
+        # nodeIDs limits the nodes that are kept (all nodes if None); output files that do not exist are skipped
+        # returns the Result
+        entry = os.path.join(self.directory, self.key(parameters))
+        result = self._result(entry)
+        if result is not None and not result.stale() and result.jobDirectory == os.path.abspath(jobDirectory):
+            self.stats["hits"] += 1
+            return result
+        sources = dict()
+        histories = dict()
+        for kind in kinds:
+            file = os.path.join(jobDirectory, kind)
+            if not os.path.isfile(file):
+                continue
+            sources[kind] = sourceStamp(file)
+            if kind == "glstat":
+                histories[kind] = util.readDynaGlstat(file)
+            elif nodeIDs is not None:
+                histories[kind] = util.readDynaOutputNodes(file, nodeIDs, kind=kind)
+            elif kind == "bndout":
+                histories[kind] = util.readDynaBndout(file)
+            else:
+                histories[kind] = util.readDynaNodout(file)
+        if len(histories) == 0:
+            raise FileNotFoundError("No " + ", ".join(kinds) + " output in " + jobDirectory + "!")
+        meta = {"parameters": jsonParameters(parameters), "jobDirectory": os.path.abspath(jobDirectory), "sources": sources,
+            "fields": {kind: list(history.fields) for kind, history in histories.items()},
+            "nodeIDs": None if nodeIDs is None else sorted(int(nid) for nid in nodeIDs)}
+        self._store(entry, meta, histories)
+        self.stats["ingested"] += 1
+        return self._result(entry)
+
+    def get(self, parameters):
+        # Result of parameters (ingested again first if its output files changed), None if it was never ingested
+        result = self._result(os.path.join(self.directory, self.key(parameters)))
+        return self._refresh(result)
+
+    def query(self, **conditions):
+        # Results of every entry whose parameters equal all conditions, e.g. query(AR2=16), sorted by parameters
+        conditions = {name: normalizeParameter(value) for name, value in conditions.items()}
+        results = list()
+        for entry in self._entries():
+            result = self._result(entry)
+            if result is None:
+                continue
+            normalized = {name: normalizeParameter(value) for name, value in result.parameters.items()}
+            if all(name in normalized and normalized[name] == value for name, value in conditions.items()):
+                result = self._refresh(result)
+                if result is not None:
+                    results.append(result)
+        return sorted(results, key=lambda result: json.dumps(normalizeParameter(result.parameters), sort_keys=True))
+
+    def curves(self, nodeID, x=("nodout", "uz"), y=("bndout", "Fz"), **conditions):
+        # (parameters, T x 2 array of x and y) of node nodeID for every entry matching conditions, e.g. Fz vs uz:
+        # x and y are (kind, field); x is interpolated to the times of y if the two files were written at different times
+        curves = list()
+        for result in self.query(**conditions):
+            if x[0] not in result.kinds or y[0] not in result.kinds:
+                continue
+            xHistory = result[x[0]]
+            yHistory = result[y[0]]
+            if nodeID not in xHistory or nodeID not in yHistory:
+                continue
+            xValues = xHistory[nodeID][:, xHistory.fields.index(x[1])]
+            yValues = yHistory[nodeID][:, yHistory.fields.index(y[1])]
+            if not np.array_equal(xHistory.times, yHistory.times):
+                xValues = np.interp(yHistory.times, xHistory.times, xValues)
+            curves.append((result.parameters, np.column_stack((xValues, yValues))))
+        return curves
+
+    def clear(self):
+        # removes all entries
+        for entry in self._entries():
+            shutil.rmtree(entry, ignore_errors=True)
+        self._meta = dict()
+
+    ### HELPER METHODS ###
+
+    def _entries(self):
+        # returns the path of every entry in the store
+        if not os.path.isdir(self.directory):
+            return list()
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+            if not name.startswith(".") and os.path.isdir(os.path.join(self.directory, name))]
+
+    def _result(self, entry):
+        # Result of an entry (meta.json is read again only if it changed), None if there is no complete entry
+        metaFile = os.path.join(entry, "meta.json")
+        try:
+            mtime = os.stat(metaFile).st_mtime_ns
+            if entry not in self._meta or self._meta[entry][0] != mtime:
+                with open(metaFile, "r") as f:
+                    self._meta[entry] = (mtime, json.load(f))
+        except (OSError, ValueError):
+            return None # missing, incomplete or corrupted entry
+        return Result(entry, self._meta[entry][1], self.mmap)
+
+    def _refresh(self, result):
+        # ingests a stale Result again from its job directory
+        if result is None or not result.stale():
+            return result
+        try:
+            return self.ingest(result.parameters, result.jobDirectory, tuple(result.kinds), result.nodeIDs)
+        except FileNotFoundError:
+            return None # job directory removed
+
+    def _store(self, entry, meta, histories):
+        # writes the entry into a temporary directory and moves it into place so readers never see partial entries
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = tempfile.mkdtemp(prefix=".tmp", dir=self.directory)
+        try:
+            for kind, history in histories.items():
+                np.save(os.path.join(temporary, kind + ".times.npy"), history.times)
+                np.save(os.path.join(temporary, kind + ".data.npy"), history.data)
+                if isinstance(history, util.NodeHistory):
+                    np.save(os.path.join(temporary, kind + ".nodeIDs.npy"), history.nodeIDs)
+            with open(os.path.join(temporary, "meta.json"), "w") as f:
+                json.dump(meta, f, sort_keys=True)
+            if os.path.isdir(entry):
+                old = tempfile.mkdtemp(prefix=".old", dir=self.directory)
+                os.replace(entry, os.path.join(old, "entry")) # move the stale entry out of the way first
+                shutil.rmtree(old, ignore_errors=True)
+            os.replace(temporary, entry)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(temporary, ignore_errors=True)
+
+class Result:
+    # one ingested job: parameters, and a NodeHistory (bndout, nodout) or GlobalHistory (glstat) per output file, loaded lazily
+    def __init__(self, entry, meta, mmap=True):
+        self.entry = entry
+        self.parameters = meta["parameters"]
+        self.jobDirectory = meta["jobDirectory"]
+        self.sources = meta["sources"]
+        self.fields = meta["fields"]
+        self.nodeIDs = meta["nodeIDs"] # nodes kept at ingestion, None for all
+        self.mmap = mmap
+        self._histories = dict()
+
+    @property
+    def kinds(self):
+        return list(self.fields)
+
+    def stale(self):
+        # True if an output file changed (size or mtime) or disappeared since it was ingested
+        for kind, stamp in self.sources.items():
+            try:
+                if sourceStamp(os.path.join(self.jobDirectory, kind)) != stamp:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def __getitem__(self, kind):
+        if kind not in self._histories:
+            if kind not in self.fields:
+                raise KeyError("No " + kind + " output for " + json.dumps(self.parameters) + "!")
+            mode = "r" if self.mmap else None
+            times = np.load(os.path.join(self.entry, kind + ".times.npy"), mmap_mode=mode)
+            data = np.load(os.path.join(self.entry, kind + ".data.npy"), mmap_mode=mode)
+            fields = tuple(self.fields[kind])
+            nodeIDsFile = os.path.join(self.entry, kind + ".nodeIDs.npy")
+            if os.path.isfile(nodeIDsFile):
+                self._histories[kind] = util.NodeHistory(times, np.load(nodeIDsFile), data, fields)
+            else:
+                self._histories[kind] = util.GlobalHistory(times, data, fields)
+        return self._histories[kind]
+
+def sourceStamp(file):
+    # [size, mtime] of an output file, to notice it changing
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def jsonParameters(parameters):
+    # parameters as they are stored in meta.json (NumPy scalars converted, anything else that is not JSON by repr)
+    return json.loads(json.dumps(dict(parameters), default=lambda value: value.item() if isinstance(value, np.generic) else repr(value)))
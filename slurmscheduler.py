@@ -1,5 +1,12 @@
 import subprocess
 import os
+import getpass
+import shlex
+import time
+
+DEFAULT_STATUS_TTL = 5 # seconds; status() calls within this time of the last squeue call share its result
+SQUEUE_FORMAT = "%i|%T" # job ID and state, one job per line
+FINISHED_STATES = {"COMPLETED", "FAILED", "CANCELLED", "TIMEOUT", "NODE_FAIL", "PREEMPTED", "OUT_OF_MEMORY", "BOOT_FAIL", "DEADLINE"}
 
 class Scheduler:
   # contains a database of submitted jobs
@@ -9,9 +16,17 @@ class Scheduler:
   # Version 1.0
   # February 1, 2019
   
-  def __init__(self):
+  def __init__(self, ttl=DEFAULT_STATUS_TTL, squeueCommand="squeue", user=None):
   # this creates a new Scheduler object with initially empty database
+  # status is read with one squeue call for all jobs of user (default: current user), reused for ttl seconds
+  # squeueCommand is the squeue executable (string or list of arguments), e.g. to run squeue through ssh
     self.database = dict() # this stores jobID:status pairs where jobID is a unique identifier to a submitted job, and status is 1 (completed) or 0 (else)
+    self.states = dict() # jobID:SLURM state (e.g. PENDING, RUNNING) from the last squeue call, "FINISHED" once the job left the queue
+    self.ttl = ttl
+    self.squeueCommand = squeueCommand
+    self.user = user if user != None else os.environ.get("USER") or getpass.getuser()
+    self.lastUpdate = None # time.monotonic() of the last successful squeue call
+    self.squeueCalls = 0
     
   def submit(self, file, flags=""):
   # submits file using sbatch and returns (jobID, out, err); adds jobID:0 to database
@@ -20,16 +35,31 @@ class Scheduler:
   # this method will send "sbatch file flags" to the shell
   # NOTE: a space is automatically added between file and flags, but any spaces in flags must be specified in flags itself
     jobID, out, err = sbatch(file, flags)
-    if jobID != None: self.database[jobID] = 0
+    if jobID != None:
+      self.database[jobID] = 0
+      self.lastUpdate = None # the cached queue does not know this job yet
     return (jobID, out, err)
 
-  def update(self):
-  # updates the status for all submitted jobs by calling squeue
-    out = squeue()[0]
-    enqueued = self.parseQueue(out)
-    for jobID  in self.database:
-      if jobID not in enqueued and self.database[jobID] == 0:
-        self.database[jobID] = 1 # job is completed
+  def update(self, force=False):
+  # updates the status for all submitted jobs with a single squeue call, unless the last call is less than ttl seconds old (or force)
+  # jobs missing from the queue or in a finished state are completed; if squeue fails, statuses are left as they were
+    if not force and self.lastUpdate != None and time.monotonic() - self.lastUpdate < self.ttl:
+      return
+    if all(status == 1 for status in self.database.values()):
+      return # nothing left to ask squeue about
+    command = shlex.split(self.squeueCommand) if isinstance(self.squeueCommand, str) else list(self.squeueCommand)
+    command += ["--noheader", "--user=" + self.user, "--format=" + SQUEUE_FORMAT]
+    self.squeueCalls += 1
+    returnCode, out, err = run(command)
+    if returnCode != 0:
+      return # e.g. controller not responding; try again next call
+    self.lastUpdate = time.monotonic()
+    states = self.parseStates(out)
+    for jobID in self.database:
+      if self.database[jobID] == 0:
+        self.states[jobID] = states.get(jobID, "FINISHED")
+        if self.states[jobID] == "FINISHED" or self.states[jobID] in FINISHED_STATES:
+          self.database[jobID] = 1 # job is completed
         
   def status(self, jobID=None):
   # returns status of jobID if given, otherwise returns database
@@ -59,6 +89,15 @@ class Scheduler:
         if jobID != "JOBID":
           enqueued.add(jobID)
     return enqueued
+
+  def parseStates(self, out):
+    # returns a dict of jobID:state from squeue output in SQUEUE_FORMAT
+    states = dict()
+    for line in out.split("\n"):
+      if "|" in line:
+        jobID, state = line.strip().split("|")[0:2]
+        states[jobID] = state.split()[0] if len(state.split()) != 0 else ""
+    return states
   
 def sbatch(file, flags=""):
 # submits file using sbatch and returns (jobID, out, err); adds jobID:0 to database
@@ -78,6 +117,11 @@ def squeue(flags=""):
 # NOTE: a space is automatically added between squeue and flags, but any spaces in flags must be specified in flags itself
   return shell("squeue " + flags)
 
+def scancel(jobID, flags=""):
+# calls "scancel jobID flags" in shell and returns output, e.g. to drop a job that dynautil.GlstatMonitor flagged as unhealthy
+# NOTE: a space is automatically added between jobID and flags, but any spaces in flags must be specified in flags itself
+  return shell("scancel " + str(jobID) + " " + flags)
+
 def cd(flags=""):
   # calls "cd flags" in shell and returns output
   # NOTE: a space is automatically added between squeue and flags, but any spaces in flags must be specified in flags itself
@@ -88,6 +132,15 @@ def mkdir(flags=""):
   # NOTE: a space is automatically added between squeue and flags, but any spaces in flags must be specified in flags itself
   return shell("mkdir " + flags)
 
+def run(arguments):
+  # runs arguments (a list, no shell) and returns (return code, output, error); a missing executable gives return code 127
+  try:
+    popen = subprocess.Popen(arguments, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  except OSError as error:
+    return 127, "", str(error)
+  out, err = popen.communicate()
+  return popen.returncode, out.decode("utf8"), err.decode("utf8")
+
 def shell(input):
   # generic shell call used by other methods
   # calls input from shell and returns output
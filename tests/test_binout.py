@@ -0,0 +1,116 @@
+import struct
+import numpy as np
+import pytest
+import binout
+
+TYPE_IDS = {"i4": 3, "i8": 4, "f4": 9, "f8": 10}
+
+def writeLSDA(path, arrays, order="<", tables=1):
+    # minimal LSDA writer: 8 byte lengths and offsets, 1 byte commands and type ids
+    # arrays (path: array) are split over tables chained symbol tables, each written after its data records;
+    # directories in a table are given relative to the previous one where possible
+    record = lambda length, command: struct.pack(order + "QB", length, command)
+    offset = lambda value: struct.pack(order + "Q", value)
+    out = bytearray(struct.pack("8B", 8, 8, 8, 1, 1, 1 if order == "<" else 0, 0, 0))
+    out += record(17, binout.LSDA_SYMBOLTABLEOFFSET) + offset(0)
+    pointer = len(out) - 8 # where the offset of the next symbol table goes
+    items = list(arrays.items())
+    for k in range(tables):
+        entries = list()
+        for name, array in items[k*len(items)//tables:(k + 1)*len(items)//tables]:
+            array = np.asarray(array)
+            directory, variable = name.rsplit("/", 1)
+            typeID = TYPE_IDS[array.dtype.kind + str(array.dtype.itemsize)]
+            body = struct.pack("BB", typeID, len(variable)) + variable.encode() + array.astype(array.dtype.newbyteorder(order)).tobytes()
+            entries.append((directory, variable, typeID, len(out), array.size))
+            out += record(9 + len(body), binout.LSDA_DATA) + body
+        out[pointer:pointer + 8] = offset(len(out))
+        out += record(9, binout.LSDA_BEGINSYMBOLTABLE)
+        current = None
+        for directory, variable, typeID, dataOffset, size in entries:
+            if directory != current:
+                parent = directory.rsplit("/", 1)[0]
+                relative = "../" + directory.rsplit("/", 1)[1] if current is not None and current.rsplit("/", 1)[0] == parent else directory
+                out += record(9 + len(relative), binout.LSDA_CD) + relative.encode()
+                current = directory
+            entry = variable.encode() + struct.pack(order + "BQQ", typeID, dataOffset, size)
+            out += record(9 + len(entry), binout.LSDA_VARIABLE) + entry
+        out += record(17, binout.LSDA_ENDSYMBOLTABLE)
+        pointer = len(out)
+        out += offset(0)
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+    return bytes(out)
+
+def nodoutArrays(steps=4, ids=(12, 1, 37)):
+    # nodout branch with steps output times; displacement component j of node i at step k is 100*k + 10*i + j
+    arrays = {"/nodout/metadata/ids": np.array(ids, dtype=np.int32)}
+    for k in range(steps):
+        step = "/nodout/d%06d/" % (k + 1)
+        arrays[step + "time"] = np.array([0.5*k], dtype=np.float32)
+        for j, name in enumerate(("x_displacement", "y_displacement", "z_displacement")):
+            arrays[step + name] = (100*k + 10*np.arange(len(ids)) + j).astype(np.float32)
+        arrays["/glstat/d%06d/time" % (k + 1)] = np.array([0.5*k])
+        arrays["/glstat/d%06d/kinetic_energy" % (k + 1)] = np.array([2.0*k])
+    return arrays
+
+@pytest.mark.parametrize("order", ["<", ">"])
+def test_read_little_and_big_endian(tmp_path, order):
+    path = str(tmp_path / "binout")
+    arrays = nodoutArrays()
+    writeLSDA(path, arrays, order)
+    with binout.Binout(path) as f:
+        assert f.order == order
+        assert f.branches() == ["glstat", "nodout"]
+        assert f.steps("/nodout") == ["d000001", "d000002", "d000003", "d000004"]
+        for name, array in arrays.items():
+            assert f.read(name).tolist() == array.tolist()
+        history = f.readNodeHistory("nodout", [37, 12, 99])
+        times, data = f.readHistory("glstat", ["kinetic_energy", "internal_energy"])
+    assert history.nodeIDs.tolist() == [12, 37]
+    assert history.times.tolist() == [0.0, 0.5, 1.0, 1.5]
+    assert history[37][:, 2].tolist() == [22.0, 122.0, 222.0, 322.0]
+    assert times.tolist() == [0.0, 0.5, 1.0, 1.5]
+    assert data[:, 0].tolist() == [0.0, 2.0, 4.0, 6.0] and np.isnan(data[:, 1]).all()
+
+def test_chained_symbol_tables(tmp_path):
+    arrays = nodoutArrays()
+    writeLSDA(str(tmp_path / "one"), arrays)
+    writeLSDA(str(tmp_path / "chained"), arrays, tables=5)
+    with binout.Binout(str(tmp_path / "one")) as one, binout.Binout(str(tmp_path / "chained")) as chained:
+        assert sorted(chained.variables) == sorted(arrays)
+        assert chained.readNodeHistory("nodout").data.tolist() == one.readNodeHistory("nodout").data.tolist()
+
+def test_truncated_table_keeps_complete_entries(tmp_path):
+    path = str(tmp_path / "binout")
+    arrays = nodoutArrays()
+    data = writeLSDA(path, arrays, tables=2)
+    complete = dict()
+    with binout.Binout(path) as f:
+        lastData = max(offset for dtype, offset, items in f.variables.values())
+    for cut in (len(data) - 3, len(data) - 40, lastData + 5):
+        with open(path, "wb") as f:
+            f.write(data[:cut])
+        with binout.Binout(path) as f:
+            # the first table is complete, the second one is read up to the cut (or not at all)
+            complete[cut] = set(f.variables)
+            assert set(list(arrays)[0:len(arrays)//2]) <= complete[cut] <= set(arrays)
+            for name in complete[cut]:
+                if name in list(arrays)[0:len(arrays)//2]:
+                    assert f.read(name).tolist() == arrays[name].tolist()
+    assert complete[lastData + 5] == set(list(arrays)[0:len(arrays)//2])
+
+def test_corrupt_files_raise(tmp_path):
+    path = str(tmp_path / "binout")
+    data = bytearray(writeLSDA(path, nodoutArrays()))
+    for corrupt in (data[:5], b"\x08\x03\x08\x01\x01\x01\x00\x00" + data[8:]):
+        with open(path, "wb") as f:
+            f.write(bytes(corrupt))
+        with pytest.raises(ValueError):
+            binout.Binout(path)
+    # symbol table offset pointing at a data record
+    data[17:25] = struct.pack("<Q", 25)
+    with open(path, "wb") as f:
+        f.write(bytes(data))
+    with pytest.raises(ValueError, match="no symbol table"):
+        binout.Binout(path)
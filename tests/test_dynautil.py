@@ -0,0 +1,364 @@
+import os
+import numpy as np
+import pytest
+import dynacards
+import dynautil as util
+import xlattice as xlt
+from test_xlattice import diamondGraph
+
+@pytest.mark.parametrize("counts", [(2, 1, 1), (3, 2, 2)])
+def test_streamed_deck_matches_materialized_deck(tmp_path, counts):
+    tessellated = xlt.TessellatedLattice(xlt.Lattice(diamondGraph(True)), *counts, chunkSize=50)
+    util.generateKeyFile(tessellated, str(tmp_path / "streamed.k"), 0.2)
+    util.generateKeyFile(tessellated.materialize(), str(tmp_path / "materialized.k"), 0.2)
+    util.generateKeyFile(xlt.Lattice(diamondGraph(True)).tessellate(*counts, inPlace=False, singlePass=True), str(tmp_path / "singlePass.k"), 0.2)
+    streamed = (tmp_path / "streamed.k").read_text()
+    assert streamed == (tmp_path / "materialized.k").read_text() == (tmp_path / "singlePass.k").read_text()
+
+def test_timestep_estimate_is_opt_in(tmp_path):
+    cards = [str(card) for card in dynacards.loadDeck(os.path.join(os.path.dirname(util.__file__), "defaultcards.k"))]
+    lattice = xlt.Lattice(diamondGraph())
+    assert "timestep" not in util.generateKeyFile(lattice, str(tmp_path / "a.k"), 0.2, cards=cards)
+    report = util.generateKeyFile(lattice, str(tmp_path / "a.k"), 0.2, cards=cards, timestep=True)
+    assert 0 < report["timestep"] < report["elementTimestep"]
+    # *PART referring to a material that is not in the deck
+    broken = [card.replace("         1         1         1         0", "         1         1         7         0") if card.startswith("*PART") else card for card in cards]
+    util.generateKeyFile(lattice, str(tmp_path / "b.k"), 0.2, cards=broken)
+    with pytest.raises(ValueError):
+        util.generateKeyFile(lattice, str(tmp_path / "b.k"), 0.2, cards=broken, timestep=True)
+
+@pytest.mark.parametrize("value", [float("nan"), float("inf"), -float("inf")])
+def test_non_finite_fields_raise(value):
+    with pytest.raises(ValueError):
+        util.formatField(value)
+    with pytest.raises(ValueError):
+        util.formatFloatColumn(np.array([1.0, value, 2.0]), 10)
+
+def test_format_field():
+    assert util.formatField(0.1) == "       0.1"
+    assert util.formatField(-0.0) == "       0.0"
+    assert util.formatFloatColumn(np.array([0.1, 1/3, 0.1]), 10).tobytes().decode("ascii") == "       0.10.33333333       0.1"
+
+def scoredCurves(count, seed=0):
+    # ragged load-displacement curves, some with repeated x, points on the grid, or not covering the target domain
+    rng = np.random.RandomState(seed)
+    curves = list()
+    for k in range(count):
+        n = rng.randint(1, 300)
+        x = np.sort(rng.rand(n))*rng.uniform(0.5, 1.2) + rng.uniform(-0.1, 0.1)
+        if k % 7 == 0 and n > 3:
+            x[1] = x[2]
+        if k % 11 == 0:
+            x = np.round(x, 2)
+        curves.append(np.column_stack((x, rng.rand(n))))
+    return curves + [np.zeros((0, 2)), np.zeros((5, 3))]
+
+def referenceObjectives(curves, target, **kwargs):
+    objectives = list()
+    for curve in curves:
+        try:
+            objectives.append(util.objectiveFunction(curve, target, **kwargs))
+        except (AssertionError, IndexError):
+            objectives.append(np.nan)
+    return np.array(objectives)
+
+@pytest.mark.parametrize("kwargs", [{}, {"start": 0.1, "stop": 0.4}, {"step": 0.003}, {"start": 0.0}])
+def test_objective_functions_match_objective_function(kwargs):
+    target = np.column_stack((np.linspace(0, 1, 200), np.sin(np.linspace(0, 3, 200))))
+    curves = scoredCurves(2000)
+    expected = referenceObjectives(curves, target, **kwargs)
+    assert np.isnan(expected).any() and not np.isnan(expected).all()
+    assert np.array_equal(util.objectiveFunctions(curves, target, **kwargs), expected, equal_nan=True)
+    objectives, best = util.objectiveFunctions(curves, target, topK=5, **kwargs)
+    valid = np.flatnonzero(~np.isnan(expected))
+    assert best.tolist() == valid[np.argsort(expected[valid], kind="stable")][0:5].tolist()
+
+def test_objective_functions_timing():
+    # 2000 curves in one batched call should beat scoring them one by one
+    import time
+    target = np.column_stack((np.linspace(0, 1, 200), np.sin(np.linspace(0, 3, 200))))
+    curves = scoredCurves(2000, seed=1)
+    def best(f):
+        times = list()
+        for repeat in range(3):
+            start = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - start)
+        return min(times)
+    assert best(lambda: util.objectiveFunctions(curves, target)) < best(lambda: referenceObjectives(curves, target))
+
+@pytest.mark.parametrize("meshing", [{}, {"minElementLength": 0.05, "minLengthRatio": 0.5}])
+def test_deck_is_identical_for_every_chunk_size(tmp_path, meshing):
+    lattice = xlt.Lattice(diamondGraph(True)).tessellate(2, 2, 1, inPlace=False)
+    lattice.applyDiameterDistribution(lambda x, y, z: 0.05 + 0.01*x)
+    decks = list()
+    for chunkSize in (None, 1, 7, 100000):
+        path = tmp_path / ("chunk%s.k" % chunkSize)
+        util.generateKeyFile(lattice, str(path), 0.1, chunkSize=chunkSize, **meshing)
+        decks.append(path.read_bytes())
+    assert decks[0].count(b"\n") > 100
+    assert all(deck == decks[0] for deck in decks[1:])
+
+def readDeck(text):
+    # nodes {nid: (x, y, z)}, elements [(n1, n2, diameter)], moving node IDs, and spc rows (nid, dofs) of a generated deck
+    nodes, elements, moving, spc = dict(), list(), list(), list()
+    keyword = None
+    lines = [line for line in text.splitlines() if not line.startswith("$")]
+    for k, line in enumerate(lines):
+        if line.startswith("*"):
+            keyword = line.strip()
+        elif keyword == "*NODES" and line.strip():
+            nodes[int(line[0:8])] = (float(line[8:24]), float(line[24:40]), float(line[40:56]))
+        elif keyword == "*ELEMENT_BEAM_THICKNESS" and not line.startswith(" "*8):
+            elements.append((int(line[16:24]), int(line[24:32]), float(lines[k + 1][0:16])))
+        elif keyword == "*BOUNDARY_PRESCRIBED_MOTION_NODE":
+            moving.append(int(line[0:10]))
+        elif keyword == "*BOUNDARY_SPC_NODE":
+            spc.append((int(line[0:10]), tuple(int(line[i:i + 10]) for i in range(20, 80, 10))))
+    return nodes, elements, moving, spc
+
+def deckGeometry(text):
+    # the deck with every node ID replaced by its coordinates
+    nodes, elements, moving, spc = readDeck(text)
+    return (sorted(nodes.values()), sorted((tuple(sorted((nodes[n1], nodes[n2]))), d) for n1, n2, d in elements),
+        sorted(nodes[n] for n in moving), sorted((nodes[n], dofs) for n, dofs in spc))
+
+@pytest.mark.parametrize("method", ["compact", "rcm", "morton"])
+def test_renumbering_remaps_node_sets(tmp_path, method):
+    lattice = xlt.Lattice(diamondGraph(True)).tessellate(3, 2, 2, inPlace=False)
+    lattice.applyDiameterDistribution(lambda x, y, z: 0.05 + 0.01*x)
+    SPCNodesAndDOF = [[lattice.xMinFace, (1, 0, 0, 0, 1, 1)], [sorted(lattice.yMaxFace), (0, 1, 0, 1, 0, 1)]]
+    util.generateKeyFile(lattice, str(tmp_path / "plain.k"), 0.2, SPCNodesAndDOF=SPCNodesAndDOF)
+    report = util.generateKeyFile(lattice, str(tmp_path / "renumbered.k"), 0.2, SPCNodesAndDOF=SPCNodesAndDOF, renumber=method)
+    plain, renumbered = (tmp_path / "plain.k").read_text(), (tmp_path / "renumbered.k").read_text()
+    assert deckGeometry(renumbered) == deckGeometry(plain)
+    nodes = readDeck(renumbered)[0]
+    assert sorted(nodes) == list(range(1, len(nodes) + 1))
+    assert report["bandwidthAfter"] == max(abs(n1 - n2) for n1, n2, d in readDeck(renumbered)[1])
+    if method == "rcm":
+        assert report["bandwidthAfter"] < report["bandwidthBefore"]
+
+def test_split_decks_share_the_include(tmp_path):
+    cards = [str(card) for card in dynacards.loadDeck(os.path.join(os.path.dirname(util.__file__), "defaultcards.k"))]
+    shared = str(tmp_path / "shared")
+    lattice = xlt.Lattice(diamondGraph(True)).tessellate(2, 1, 1, inPlace=False)
+    reports = list()
+    for k, scale in enumerate((1, 2)):
+        lattice.applyDiameterDistribution(lambda x, y, z: scale*(0.05 + 0.01*x))
+        reports.append(util.generateKeyFile(lattice, str(tmp_path / ("split%d.k" % k)), 0.2, cards=cards, sharedDirectory=shared))
+        util.generateKeyFile(lattice, str(tmp_path / ("whole%d.k" % k)), 0.2, cards=cards)
+    assert reports[0]["sharedFile"] == reports[1]["sharedFile"]
+    assert [report["sharedFileWritten"] for report in reports] == [True, False]
+    assert os.listdir(shared) == [os.path.basename(reports[0]["sharedFile"])]
+    include = open(reports[0]["sharedFile"]).read()
+    for k in range(2):
+        split = (tmp_path / ("split%d.k" % k)).read_text()
+        assert split.startswith("*KEYWORD") and "*INCLUDE" in split and "*NODES" not in split
+        assert deckGeometry(include + split) == deckGeometry((tmp_path / ("whole%d.k" % k)).read_text())
+    # anything that changes nodes or boundary conditions gets its own include
+    other = util.generateKeyFile(lattice, str(tmp_path / "other.k"), 0.1, cards=cards, sharedDirectory=shared)
+    assert other["sharedFile"] != reports[0]["sharedFile"] and other["sharedFileWritten"]
+
+def test_load_deck_matches_imported_cards(tmp_path):
+    default = os.path.join(os.path.dirname(util.__file__), "defaultcards.k")
+    crlf = tmp_path / "crlf.k"
+    crlf.write_bytes(open(default, "rb").read().replace(b"\r\n", b"\n").replace(b"\n", b"\r\n") + b"*END")
+    for path in (default, str(crlf)):
+        assert dynacards.loadDeck(path).toCardsList() == util.importDynaCardsList(path)
+
+def test_load_deck_copies_do_not_share_changes(tmp_path):
+    path = tmp_path / "deck.k"
+    path.write_text(open(os.path.join(os.path.dirname(util.__file__), "defaultcards.k")).read())
+    deck = dynacards.loadDeck(str(path))
+    hits = dynacards.cacheStats["hits"]
+    endtim = deck.get("*CONTROL_TERMINATION", "endtim")
+    deck.set("*CONTROL_TERMINATION", "endtim", 60.0)
+    deck.find("*DEFINE_CURVE").setPoints([(0.0, -0.1), (250.0, -0.1)])
+    assert deck.get("*CONTROL_TERMINATION", "endtim") == 60.0
+    assert "      60.0" in deck.find("*CONTROL_TERMINATION").toText()
+    again = dynacards.loadDeck(str(path))
+    assert dynacards.cacheStats["hits"] == hits + 1
+    assert again.get("*CONTROL_TERMINATION", "endtim") == endtim
+    assert again.toCardsList() == util.importDynaCardsList(str(path))
+    assert deck.toCardsList() != again.toCardsList()
+
+def bndoutText(steps):
+    # bndout file of steps [(t, {nid: (Fx, Fy, Fz, E)})]
+    text = " ls-dyna header\n\n"
+    for t, forces in steps:
+        text += "\n\n n o d a l   f o r c e/e n e r g y    o u t p u t  t=   %.4E\n" % t
+        for nid, values in forces.items():
+            text += " nd#%8d  xforce=  %11.4E   yforce=  %11.4E   zforce=  %11.4E   energy=  %11.4E\n" % ((nid,) + tuple(values))
+        text += " xforce=  0.0  yforce=  0.0  zforce=  0.0  energy=  0.0\n"
+    return text
+
+def nodoutText(steps):
+    # nodout file of steps [(t, {nid: (ux, uy, uz)})], followed by velocities and a rotation block that are not read
+    text = " ls-dyna header\n"
+    for k, (t, displacements) in enumerate(steps):
+        text += "\n\n\n n o d a l   p r i n t   o u t   f o r   t i m e  s t e p%8d                              ( at time %.7E )\n\n" % (k + 1, t)
+        text += " nodal point  x-disp     y-disp      z-disp      x-vel       y-vel       z-vel\n"
+        for nid, values in displacements.items():
+            text += "%10d" % nid + "".join("%12.4E" % v for v in tuple(values) + (1, 2, 3)) + "\n"
+        text += "\n nodal point  x-rot      y-rot       z-rot\n"
+        for nid in displacements:
+            text += "%10d" % nid + "%12.4E%12.4E%12.4E\n" % (7, 8, 9)
+    return text
+
+def outputSteps(nFields, nSteps=4, nodes=(1, 37, 5), seed=0):
+    # random output values with 4 significant digits (so they survive the text files exactly); node 37 skips step 1
+    rng = np.random.RandomState(seed)
+    steps = list()
+    for k in range(nSteps):
+        values = {nid: tuple(float("%.4E" % v) for v in rng.normal(size=nFields)*10) for nid in nodes if not (nid == 37 and k == 1)}
+        steps.append((k*0.5, values))
+    return steps
+
+def expectedHistories(steps):
+    # {nid: rows (t, values...)} as the original parseDynaBndout and parseDynaNodout built them
+    rows = dict()
+    for t, values in steps:
+        for nid, v in values.items():
+            rows.setdefault(nid, list()).append((t,) + v)
+    return {nid: np.array(r) for nid, r in rows.items()}
+
+def assertSameHistories(results, expected):
+    assert sorted(results) == sorted(expected)
+    for nid in expected:
+        assert np.array_equal(results[nid], expected[nid])
+
+def test_parse_dyna_outputs_to_dicts(tmp_path):
+    bndoutSteps, nodoutSteps = outputSteps(4), outputSteps(3, seed=1)
+    (tmp_path / "bndout").write_text(bndoutText(bndoutSteps))
+    (tmp_path / "nodout").write_text(nodoutText(nodoutSteps))
+    assertSameHistories(util.parseDynaBndout(str(tmp_path / "bndout")), expectedHistories(bndoutSteps))
+    assertSameHistories(util.parseDynaNodout(str(tmp_path / "nodout")), expectedHistories(nodoutSteps))
+    history = util.readDynaNodout(str(tmp_path / "nodout"))
+    assert history.times.tolist() == [0, 0.5, 1, 1.5]
+    assert history.nodeIDs.tolist() == [1, 5, 37]
+    assert history.field("uy").shape == (3, 4)
+    assert np.isnan(history[37][1]).all() and history[5][2].tolist() == list(nodoutSteps[2][1][5])
+
+@pytest.mark.parametrize("kind", ["bndout", "nodout"])
+def test_indexed_reads_match_full_parse(tmp_path, kind):
+    steps = outputSteps(4 if kind == "bndout" else 3, nSteps=6)
+    text = bndoutText if kind == "bndout" else nodoutText
+    path = str(tmp_path / kind)
+    open(path, "w").write(text(steps))
+    read = util.readDynaBndout if kind == "bndout" else util.readDynaNodout
+    full = read(path).toDict()
+    assertSameHistories(util.readDynaOutputNodes(path, [37, 1, 99]).toDict(), {nid: full[nid] for nid in (1, 37)})
+    assert os.path.exists(util.outputIndexFile(path))
+    history = util.readDynaOutputNodes(path, {5}, timeRange=(0.5, 2.0))
+    assert history.times.tolist() == [0.5, 1, 1.5, 2]
+    assertSameHistories(history.toDict(), {5: full[5][1:5]})
+
+def test_index_is_rebuilt_when_the_file_changes(tmp_path):
+    path = str(tmp_path / "bndout")
+    steps = outputSteps(4, nSteps=3)
+    open(path, "w").write(bndoutText(steps))
+    assert util.indexDynaOutput(path)["times"].tolist() == [0, 0.5, 1]
+    # appended timestep
+    more = outputSteps(4, nSteps=5)
+    open(path, "w").write(bndoutText(more))
+    assert util.indexDynaOutput(path)["times"].tolist() == [0, 0.5, 1, 1.5, 2]
+    assertSameHistories(util.readDynaOutputNodes(path, [1]).toDict(), {1: expectedHistories(more)[1]})
+    # same size, different values and modification time
+    changed = outputSteps(4, nSteps=5, seed=3)
+    text = bndoutText(changed)
+    assert len(text) == os.path.getsize(path)
+    open(path, "w").write(text)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assertSameHistories(util.readDynaOutputNodes(path, [1, 5, 37]).toDict(), expectedHistories(changed))
+    # an unreadable index is rebuilt too
+    open(util.outputIndexFile(path), "wb").write(b"garbage")
+    assertSameHistories(util.readDynaOutputNodes(path, [5]).toDict(), {5: expectedHistories(changed)[5]})
+
+def followAll(follower, path, text, cut=37):
+    # writes text to path a few bytes at a time (splitting lines and blocks), polling after every write
+    histories = list()
+    for end in list(range(cut, len(text), cut)) + [len(text)]:
+        open(path, "w").write(text[0:end])
+        histories.append(follower.poll())
+    histories.append(follower.poll(final=True))
+    merged = dict()
+    for history in histories:
+        for nid, rows in history.toDict().items():
+            merged[nid] = np.concatenate((merged[nid], rows)) if nid in merged else rows
+    return merged, sum(len(history.times) for history in histories)
+
+@pytest.mark.parametrize("kind", ["bndout", "nodout"])
+def test_follower_returns_every_block_once(tmp_path, kind):
+    steps = outputSteps(4 if kind == "bndout" else 3, nSteps=5)
+    text = (bndoutText if kind == "bndout" else nodoutText)(steps)
+    path = str(tmp_path / kind)
+    follower = util.DynaOutputFollower(path)
+    assert len(follower.poll().times) == 0 # no file yet
+    merged, nTimes = followAll(follower, path, text)
+    assert nTimes == follower.steps == 5
+    assertSameHistories(merged, expectedHistories(steps))
+    assert len(follower.poll(final=True).times) == 0
+
+def test_follower_restarts_on_truncated_or_replaced_file(tmp_path):
+    path = str(tmp_path / "bndout")
+    first, second = outputSteps(4, nSteps=5), outputSteps(4, nSteps=2, seed=2)
+    follower = util.DynaOutputFollower(path)
+    open(path, "w").write(bndoutText(first))
+    assert len(follower.poll(final=True).times) == 5
+    # restarted job: shorter file written in place
+    open(path, "w").write(bndoutText(second))
+    assertSameHistories(follower.poll(final=True).toDict(), expectedHistories(second))
+    # replaced by a new file that is longer than what was read so far
+    replacement = str(tmp_path / "new")
+    open(replacement, "w").write(bndoutText(first))
+    os.replace(replacement, path)
+    assertSameHistories(follower.poll(final=True).toDict(), expectedHistories(first))
+
+GLSTAT_LABELS = {"time": "time...........................", "time_step": "time step......................",
+    "kinetic_energy": "kinetic energy.................", "internal_energy": "internal energy................",
+    "hourglass_energy": "hourglass energy ..............", "sliding_interface_energy": "sliding interface energy.......",
+    "total_energy": "total energy...................", "energy_ratio": "total energy / initial energy..",
+    "energy_ratio_wo_eroded": "energy ratio w/o eroded energy.", "number_of_nodes": "number of nodes................"}
+
+def glstatText(nSteps, hourglassAt=None, ratioAt=None, contactAt=None, timestepAt=None):
+    # glstat file of a healthy run, with each kind of problem starting at the given step
+    text = " ls-dyna smp d R13\n\n"
+    for k in range(nSteps):
+        values = {"time": k*1e-3, "time_step": 1e-9 if timestepAt is not None and k >= timestepAt else 1e-6,
+            "kinetic_energy": 0.5*k, "internal_energy": 2.0*k, "hourglass_energy": (0.5 if hourglassAt is not None and k >= hourglassAt else 0.01)*k,
+            "sliding_interface_energy": (-0.5 if contactAt is not None and k >= contactAt else -0.001)*k, "total_energy": 2.5*k,
+            "energy_ratio": 0 if k == 0 else (1.3 if ratioAt is not None and k >= ratioAt else 1.0), "energy_ratio_wo_eroded": 1.0, "number_of_nodes": 100}
+        text += "\n dt of cycle%11d is controlled by beam          1 of part        1\n\n" % (k*10)
+        for name, label in GLSTAT_LABELS.items():
+            text += " %s %s\n" % (label, "%12d" % values[name] if name == "number_of_nodes" else "%12.5E" % values[name])
+    return text
+
+def test_read_glstat():
+    import io
+    history = util.glstatRecords(io.StringIO(glstatText(4)))
+    assert history.fields == tuple(GLSTAT_LABELS)
+    assert history.times.tolist() == [0, 1e-3, 2e-3, 3e-3]
+    assert history["total_energy"].tolist() == [0, 2.5, 5, 7.5]
+
+def test_glstat_monitor_reports_each_issue_once(tmp_path):
+    path = str(tmp_path / "glstat")
+    text = glstatText(12, hourglassAt=3, ratioAt=5, contactAt=6, timestepAt=8)
+    monitor = util.GlstatMonitor(path)
+    reported = list()
+    for end in range(50, len(text), 50):
+        open(path, "w").write(text[0:end])
+        reported.extend(monitor.poll())
+    open(path, "w").write(text)
+    reported.extend(monitor.poll(final=True))
+    assert monitor.poll(final=True) == []
+    assert not monitor.healthy and reported == monitor.issues
+    assert [(t, message.split(" is ")[0]) for t, message in reported] == [(3e-3, "hourglass energy"), (5e-3, "energy ratio"),
+        (6e-3, "sliding interface energy"), (8e-3, "time step")]
+    # healthy run, and a run whose only problem is a check that is turned off
+    open(path, "w").write(glstatText(12))
+    healthy = util.GlstatMonitor(path)
+    assert healthy.poll(final=True) == [] and healthy.healthy
+    open(path, "w").write(glstatText(12, hourglassAt=3))
+    unchecked = util.GlstatMonitor(path, maxHourglassFraction=None)
+    assert unchecked.poll(final=True) == [] and unchecked.healthy
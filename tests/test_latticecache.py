@@ -0,0 +1,70 @@
+import functools
+import networkx as nx
+import pytest
+import latticecache
+import xlattice as xlt
+
+def beam(diameter, length=10):
+    G = nx.Graph()
+    G.add_node(1, pos=(0, 0, 0))
+    G.add_node(2, pos=(0, 0, length))
+    G.add_edge(1, 2, diameter=diameter() if callable(diameter) else diameter)
+    return xlt.Lattice(G)
+
+def constant():
+    return 0.2
+
+def test_cached_lattice_is_loaded(tmp_path):
+    cache = latticecache.LatticeCache(str(tmp_path))
+    generator = cache.cached(beam)
+    first = generator(0.1)
+    second = generator(0.1, length=10.0)
+    assert cache.stats["misses"] == 1 and cache.stats["hits"] == 1
+    assert second.diameters.tolist() == first.diameters.tolist() == [0.1]
+
+def test_module_level_function_argument_is_cached(tmp_path):
+    cache = latticecache.LatticeCache(str(tmp_path))
+    assert cache.call(beam, constant).diameters.tolist() == [0.2]
+    assert cache.call(beam, constant).diameters.tolist() == [0.2]
+    assert cache.stats["hits"] == 1
+
+def test_lambda_closure_and_partial_arguments_are_not_cached(tmp_path):
+    cache = latticecache.LatticeCache(str(tmp_path))
+    def closure():
+        return 0.3
+    with pytest.warns(RuntimeWarning):
+        assert cache.call(beam, lambda: 0.1).diameters.tolist() == [0.1]
+    with pytest.warns(RuntimeWarning):
+        assert cache.call(beam, lambda: 0.5).diameters.tolist() == [0.5]
+    with pytest.warns(RuntimeWarning):
+        assert cache.call(beam, closure).diameters.tolist() == [0.3]
+    with pytest.warns(RuntimeWarning):
+        assert cache.call(beam, functools.partial(float, 0.4)).diameters.tolist() == [0.4]
+    assert cache.stats == {"hits": 0, "misses": 0, "evictions": 0, "uncached": 4}
+    assert cache.size() == 0
+
+def test_stable_name():
+    assert latticecache.stableName(beam) == __name__ + ".beam"
+    assert latticecache.stableName(xlt.Lattice) == "xlattice.Lattice"
+    with pytest.raises(latticecache.UncacheableParameter):
+        latticecache.normalizeParameter(lambda: 0.1)
+
+def test_corrupted_entry_is_replaced(tmp_path):
+    cache = latticecache.LatticeCache(str(tmp_path))
+    cache.call(beam, 0.1)
+    entry = tmp_path / cache.key(beam, (0.1,), {})
+    (entry / "result.pkl").write_bytes(b"not a pickle")
+    assert cache.call(beam, 0.1).diameters.tolist() == [0.1]
+    assert cache.stats["misses"] == 2
+    assert cache.call(beam, 0.1).diameters.tolist() == [0.1]
+    assert cache.stats["hits"] == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == [entry.name]
+
+def test_failed_store_warns(tmp_path, monkeypatch):
+    cache = latticecache.LatticeCache(str(tmp_path))
+    def fail(source, destination):
+        raise PermissionError("read only")
+    monkeypatch.setattr(latticecache.os, "replace", fail)
+    with pytest.warns(RuntimeWarning, match="Could not store cache entry"):
+        assert cache.call(beam, 0.1).diameters.tolist() == [0.1]
+    assert cache.size() == 0
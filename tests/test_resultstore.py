@@ -0,0 +1,58 @@
+import os
+import numpy as np
+import resultstore
+from test_dynautil import bndoutText, expectedHistories, glstatText, nodoutText, outputSteps, assertSameHistories
+
+def writeJob(directory, seed=0, nSteps=4):
+    # bndout, nodout, and glstat of a finished job; returns the bndout and nodout steps
+    os.makedirs(directory, exist_ok=True)
+    bndoutSteps, nodoutSteps = outputSteps(4, nSteps, seed=seed), outputSteps(3, nSteps, seed=seed + 1)
+    open(os.path.join(directory, "bndout"), "w").write(bndoutText(bndoutSteps))
+    open(os.path.join(directory, "nodout"), "w").write(nodoutText(nodoutSteps))
+    open(os.path.join(directory, "glstat"), "w").write(glstatText(nSteps))
+    return bndoutSteps, nodoutSteps
+
+def test_results_are_ingested_once(tmp_path):
+    job = str(tmp_path / "job")
+    bndoutSteps, nodoutSteps = writeJob(job)
+    store = resultstore.ResultStore(str(tmp_path / "store"))
+    result = store.ingest({"AR1": 12, "AR2": 16}, job)
+    assert store.ingest({"AR1": 12.0, "AR2": 16}, job).entry == result.entry
+    assert store.stats == {"hits": 1, "ingested": 1}
+    assert sorted(result.kinds) == ["bndout", "glstat", "nodout"]
+    assertSameHistories(result["bndout"].toDict(), expectedHistories(bndoutSteps))
+    assertSameHistories(store.get({"AR2": 16, "AR1": 12})["nodout"].toDict(), expectedHistories(nodoutSteps))
+    assert result["glstat"]["time"].tolist() == [0, 1e-3, 2e-3, 3e-3]
+
+def test_stale_result_is_ingested_again(tmp_path):
+    job = str(tmp_path / "job")
+    writeJob(job)
+    store = resultstore.ResultStore(str(tmp_path / "store"))
+    store.ingest({"AR1": 12}, job)
+    # the job is rerun and writes a different bndout
+    bndoutSteps = writeJob(job, seed=5, nSteps=6)[0]
+    stat = os.stat(os.path.join(job, "bndout"))
+    os.utime(os.path.join(job, "bndout"), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    result = store.get({"AR1": 12})
+    assert store.stats["ingested"] == 2
+    assert not result.stale()
+    assertSameHistories(result["bndout"].toDict(), expectedHistories(bndoutSteps))
+    assert store.get({"AR1": 12}).entry == result.entry and store.stats["ingested"] == 2
+    # a job directory that disappeared leaves nothing to query
+    for kind in ("bndout", "nodout", "glstat"):
+        os.remove(os.path.join(job, kind))
+    assert store.get({"AR1": 12}) is None
+
+def test_curves_follow_query(tmp_path):
+    store = resultstore.ResultStore(str(tmp_path / "store"), mmap=False)
+    steps = dict()
+    for AR2 in (12, 16):
+        job = str(tmp_path / ("job%d" % AR2))
+        steps[AR2] = writeJob(job, seed=AR2)
+        store.ingest({"AR1": 10, "AR2": AR2}, job)
+    curves = store.curves(1, AR2=16.0)
+    assert [parameters for parameters, curve in curves] == [{"AR1": 10, "AR2": 16}]
+    bndoutSteps, nodoutSteps = steps[16]
+    expected = np.column_stack((expectedHistories(nodoutSteps)[1][:, 3], expectedHistories(bndoutSteps)[1][:, 3]))
+    assert np.array_equal(curves[0][1], expected)
+    assert len(store.query()) == 2 and len(store.query(AR1=11)) == 0
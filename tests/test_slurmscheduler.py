@@ -0,0 +1,73 @@
+import sys
+import pytest
+import slurmscheduler as sch
+
+STUB = """import os, sys
+directory = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(directory, "calls"), "a") as f:
+    f.write(" ".join(sys.argv[1:]) + "\\n")
+if os.path.exists(os.path.join(directory, "fail")):
+    sys.stderr.write("slurm_load_jobs error: Socket timed out\\n")
+    sys.exit(1)
+with open(os.path.join(directory, "queue")) as f:
+    sys.stdout.write(f.read())
+"""
+
+@pytest.fixture
+def squeue(tmp_path):
+    # stub squeue: logs its arguments to calls, prints the file queue, and fails while the file fail exists
+    (tmp_path / "squeue.py").write_text(STUB)
+    (tmp_path / "queue").write_text("")
+    return tmp_path
+
+def calls(squeue):
+    path = squeue / "calls"
+    return path.read_text().splitlines() if path.exists() else []
+
+def scheduler(squeue, jobIDs, ttl=60):
+    scheduler = sch.Scheduler(ttl=ttl, squeueCommand=[sys.executable, str(squeue / "squeue.py")], user="alice")
+    for jobID in jobIDs:
+        scheduler.database[jobID] = 0
+    return scheduler
+
+def test_one_squeue_call_per_ttl(squeue, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(sch.time, "monotonic", lambda: clock[0])
+    (squeue / "queue").write_text("101|RUNNING\n102|PENDING\n")
+    mc2 = scheduler(squeue, ["101", "102"], ttl=5)
+    for i in range(20):
+        assert mc2.status(101) == 0
+        assert mc2.status() == {"101": 0, "102": 0}
+    assert calls(squeue) == ["--noheader --user=alice --format=%i|%T"]
+    clock[0] += 6
+    for i in range(20):
+        mc2.status(102)
+    assert len(calls(squeue)) == 2 and mc2.squeueCalls == 2
+
+def test_finished_and_missing_jobs_are_completed(squeue):
+    (squeue / "queue").write_text("101|RUNNING\n102|COMPLETED\n103|TIMEOUT\n104|CANCELLED by 5\n999|RUNNING\n")
+    mc2 = scheduler(squeue, ["101", "102", "103", "104", "105"])
+    assert mc2.status() == {"101": 0, "102": 1, "103": 1, "104": 1, "105": 1}
+    assert mc2.states == {"101": "RUNNING", "102": "COMPLETED", "103": "TIMEOUT", "104": "CANCELLED", "105": "FINISHED"}
+    assert all(mc2.states[jobID] in sch.FINISHED_STATES for jobID in ("102", "103", "104"))
+    assert mc2.status(999) == None # not submitted by this Scheduler
+
+def test_failed_squeue_keeps_statuses(squeue):
+    (squeue / "queue").write_text("101|RUNNING\n102|PENDING\n")
+    mc2 = scheduler(squeue, ["101", "102"])
+    assert mc2.status() == {"101": 0, "102": 0}
+    (squeue / "queue").write_text("101|COMPLETED\n")
+    (squeue / "fail").write_text("")
+    mc2.update(force=True)
+    assert mc2.status() == {"101": 0, "102": 0}
+    assert mc2.states == {"101": "RUNNING", "102": "PENDING"}
+    (squeue / "fail").unlink()
+    mc2.update(force=True)
+    assert mc2.status() == {"101": 1, "102": 1}
+    assert len(calls(squeue)) == 3
+
+def test_missing_squeue_keeps_statuses(tmp_path):
+    mc2 = sch.Scheduler(squeueCommand=str(tmp_path / "no-squeue"), user="alice")
+    mc2.database["101"] = 0
+    assert mc2.status(101) == 0
+    assert mc2.lastUpdate == None
@@ -0,0 +1,384 @@
+import networkx as nx
+import numpy as np
+import pytest
+import xlattice as xlt
+
+def diamondGraph(shuffled=False):
+    # cubic diamond unit cell (corners, face centers, and 4 inner nodes with 4 struts each)
+    # shuffled inserts nodes and edges in a scrambled order, so node order is not ID order
+    outer = [(0, 0, 0), (1, 0, 0), (0, 1, 0), (0, 0, 1), (1, 1, 0), (1, 0, 1), (0, 1, 1), (1, 1, 1),
+        (0.5, 0.5, 0), (0.5, 0.5, 1), (0.5, 0, 0.5), (0.5, 1, 0.5), (0, 0.5, 0.5), (1, 0.5, 0.5)]
+    inner = [(0.25, 0.25, 0.25), (0.75, 0.75, 0.25), (0.75, 0.25, 0.75), (0.25, 0.75, 0.75)]
+    points = outer + inner
+    rng = np.random.RandomState(3)
+    ids = (rng.permutation(len(points)) if shuffled else np.arange(len(points))) + 1
+    order = rng.permutation(len(points)) if shuffled else np.arange(len(points))
+    G = nx.Graph()
+    for k in order.tolist():
+        G.add_node(int(ids[k]), pos=points[k])
+    edges = [(int(ids[a]), int(ids[b])) for a in range(len(outer), len(points)) for b in range(len(outer))
+        if abs(np.sum((np.array(points[a]) - points[b])**2) - 3/16) < 1e-9]
+    if shuffled:
+        edges = [edges[k] for k in rng.permutation(len(edges))]
+    for k, (u, v) in enumerate(edges):
+        G.add_edge(u, v, diameter=0.01*(k + 1))
+    return G
+
+def translated(G, axis, distance):
+    G = G.copy()
+    for n in G:
+        p = list(G.nodes[n]["pos"])
+        p[axis] += distance
+        G.nodes[n]["pos"] = tuple(p)
+    return G
+
+def referenceTessellate(G, counts):
+    # Lattice.tessellate of xlattice 2.1: relabel each translated copy in place and compose it into the lattice
+    for axis, n in enumerate(counts):
+        info = xlt.findPeriodicNodes(G)
+        face, periodic, extents = info[3 + 2*axis], info[axis], info[10]
+        maxNodeNumber = max(list(G))
+        result = G.copy()
+        for i in range(1, n):
+            newG = translated(G, axis, i*(extents[2*axis + 1] - extents[2*axis]))
+            mapping = {node: periodic[node] + (i - 1)*maxNodeNumber if node in face else node + i*maxNodeNumber for node in newG}
+            nx.relabel_nodes(newG, mapping, copy=False)
+            result = nx.compose(result, newG)
+        G = result
+    return G
+
+def referenceMirror(G, plane):
+    # Lattice.mirror of xlattice 2.1
+    extents = xlt.findPeriodicNodes(G)[10]
+    newG = G.copy()
+    for n in newG:
+        p = list(newG.nodes[n]["pos"])
+        p[plane] = 2*extents[2*plane + 1] - p[plane]
+        newG.nodes[n]["pos"] = tuple(p)
+    keep = xlt.findPeriodicNodes(newG)[3 + 2*plane]
+    maxNodeNumber = max(list(newG))
+    renamed = [n for n in newG if n not in keep]
+    nx.relabel_nodes(newG, dict(zip(renamed, range(maxNodeNumber + 1, maxNodeNumber + 1 + len(renamed)))), copy=False)
+    return nx.compose(G, newG)
+
+def assertSameOrder(G, lattice):
+    nodes = lattice.nodeIDs.tolist()
+    assert nodes == list(G)
+    assert [(nodes[i], nodes[j]) for i, j in lattice.edges.tolist()] == list(G.edges())
+    assert lattice.diameters.tolist() == [d for u, v, d in G.edges(data="diameter")]
+    assert np.allclose(lattice.pos, [G.nodes[n]["pos"] for n in G])
+
+@pytest.mark.parametrize("shuffled", [False, True])
+@pytest.mark.parametrize("counts", [(3, 2, 2), (2, 1, 1), (1, 4, 3)])
+def test_tessellate_keeps_networkx_order(counts, shuffled):
+    expected = referenceTessellate(diamondGraph(shuffled), counts)
+    lattice = xlt.Lattice(diamondGraph(shuffled))
+    assertSameOrder(expected, lattice.tessellate(*counts, inPlace=False))
+    lattice.tessellate(*counts)
+    assertSameOrder(expected, lattice)
+
+@pytest.mark.parametrize("shuffled", [False, True])
+@pytest.mark.parametrize("plane", [0, 1, 2])
+def test_mirror_keeps_networkx_order(plane, shuffled):
+    expected = referenceMirror(diamondGraph(shuffled), plane)
+    lattice = xlt.Lattice(diamondGraph(shuffled))
+    assertSameOrder(expected, lattice.mirror(plane, inPlace=False))
+    lattice.mirror(plane)
+    assertSameOrder(expected, lattice)
+
+def test_mirror_then_tessellate_keeps_networkx_order():
+    expected = referenceTessellate(referenceMirror(referenceMirror(diamondGraph(True), 0), 2), (3, 2, 2))
+    lattice = xlt.Lattice(diamondGraph(True))
+    lattice.mirror(0)
+    lattice.mirror(2)
+    lattice.tessellate(3, 2, 2)
+    assertSameOrder(expected, lattice)
+
+def test_diameter_distribution_batch_and_per_edge():
+    import math, random
+    lattice = xlt.Lattice(diamondGraph())
+    lattice.applyDiameterDistribution(lambda x, y, z: random.gauss(0.1, 0.01))
+    assert len(set(lattice.diameters.tolist())) == lattice.numberOfEdges() == 16
+    calls = list()
+    def vectorized(x, y, z):
+        calls.append(x)
+        return 0.01 + 0.1*x
+    lattice.applyDiameterDistribution(vectorized, batch=True)
+    assert len(calls) == 1
+    midpoints = (lattice.pos[lattice.edges[:, 0], 0] + lattice.pos[lattice.edges[:, 1], 0])/2
+    assert np.allclose(lattice.diameters, 0.01 + 0.1*midpoints)
+    lattice.applyDiameterDistribution(lambda x, y, z: 0.01 + 0.1*math.fabs(x) if x > 0.5 else 0.02)
+    assert np.allclose(lattice.diameters, np.where(midpoints > 0.5, 0.01 + 0.1*midpoints, 0.02))
+    with pytest.raises(KeyError):
+        lattice.applyDiameterDistribution(lambda x, y, z: {}["missing"])
+
+def test_batch_diameter_distribution_calls_f_once():
+    lattice = xlt.Lattice(diamondGraph())
+    rng = np.random.RandomState(0)
+    lattice.applyDiameterDistribution(lambda x, y, z: rng.normal(0.1, 0.01, len(x)), batch=True)
+    assert np.array_equal(lattice.diameters, np.random.RandomState(0).normal(0.1, 0.01, 16))
+    calls = list()
+    def scalar(x, y, z):
+        calls.append(x)
+        return 0.1
+    with pytest.raises(ValueError):
+        lattice.applyDiameterDistribution(scalar, batch=True)
+    assert len(calls) == 1
+    with pytest.raises(ValueError):
+        lattice.applyDiameterDistribution(lambda x, y, z: 0.1 if x > 0.5 else 0.2, batch=True)
+    G = diamondGraph()
+    xlt.applyDiameterDistribution(G, lambda azimuth, inclination: 0.01 + inclination, mode=2, batch=True)
+    H = xlt.applyDiameterDistribution(diamondGraph(), lambda azimuth, inclination: 0.01 + inclination, mode=2, inPlace=False)
+    assert [G.edges[e]["diameter"] for e in G.edges] == pytest.approx([H.edges[e]["diameter"] for e in G.edges])
+
+@pytest.mark.parametrize("chunkSize", [7, 65536])
+@pytest.mark.parametrize("counts", [(2, 1, 1), (3, 2, 2), (1, 4, 3)])
+def test_tessellated_lattice_edges_match_materialize(counts, chunkSize):
+    tessellated = xlt.TessellatedLattice(xlt.Lattice(diamondGraph(True)), *counts, chunkSize=chunkSize)
+    lattice = tessellated.materialize()
+    n1, n2, diameters, pos1, pos2 = [np.concatenate(arrays) for arrays in zip(*tessellated.iterEdges())]
+    assert n1.tolist() == lattice.nodeIDs[lattice.edges[:, 0]].tolist()
+    assert n2.tolist() == lattice.nodeIDs[lattice.edges[:, 1]].tolist()
+    assert diameters.tolist() == lattice.diameters.tolist()
+    assert np.array_equal(pos1, lattice.pos[lattice.edges[:, 0]]) and np.array_equal(pos2, lattice.pos[lattice.edges[:, 1]])
+
+def test_relabel_arrays_matches_networkx():
+    # random graphs and mappings, including overlapping old and new labels (processed in topological order)
+    rng = np.random.RandomState(0)
+    for trial in range(300):
+        n = rng.randint(1, 15)
+        G = nx.Graph()
+        for node in rng.permutation(np.arange(1, 40))[:n].tolist():
+            G.add_node(node, pos=(float(node), 0.0, 0.0))
+        nodes = list(G)
+        for a, b in rng.randint(0, n, (2*n, 2)).tolist():
+            if a != b:
+                G.add_edge(nodes[a], nodes[b], diameter=float(rng.rand()))
+        nodeIDs, pos, edges, diameters = xlt.graphToArrays(G)
+        rows = rng.permutation(n)[:rng.randint(0, n + 1)]
+        labels = rng.permutation(np.arange(1, 40))[:len(rows)]
+        merged = nodeIDs.copy()
+        merged[rows] = labels
+        try:
+            nx.relabel_nodes(G, dict(zip(nodeIDs[rows].tolist(), labels.tolist())), copy=False)
+        except nx.NetworkXUnfeasible:
+            expected = None # label cycle
+        else:
+            expected = xlt.graphToArrays(G) if len(np.unique(merged)) == n else None # None: nodes merged
+        if expected is None:
+            with pytest.raises(ValueError):
+                xlt.relabelArrays(nodeIDs, pos, edges, diameters, rows, labels)
+            continue
+        result = xlt.relabelArrays(nodeIDs, pos, edges, diameters, rows, labels)
+        for a, b in zip(result, expected):
+            assert np.array_equal(a, b)
+
+def recomputedPeriodicInfo(lattice):
+    fresh = xlt.Lattice.fromArrays(lattice.nodeIDs, lattice.pos, lattice.edges, lattice.diameters, lattice.tol)
+    return fresh.periodicInfo
+
+def assertSamePeriodicInfo(info, expected):
+    assert info[0:10] == expected[0:10]
+    np.testing.assert_allclose(info[10], expected[10], atol=1e-12)
+
+@pytest.mark.parametrize("steps", [
+    [("translate", (0.5, -2, 3))],
+    [("scale", (2, 3, 4)), ("translate", (1, 1, 1))],
+    [("flip", (0,)), ("translate", (0, 2, 0)), ("flip", (2,))],
+    [("scale", (1, 2, 3)), ("flip", (1,)), ("translate", (-4, 0, 0.25)), ("scale", (5,))],
+])
+def test_periodic_cache_matches_recompute_after_transforms(steps):
+    lattice = xlt.Lattice(diamondGraph(shuffled=True))
+    lattice.periodicInfo
+    for name, args in steps:
+        getattr(lattice, name)(*args)
+    assert lattice.cacheStats["invalidations"] == 0
+    assertSamePeriodicInfo(lattice.periodicInfo, recomputedPeriodicInfo(lattice))
+    lattice.invalidate()
+    assertSamePeriodicInfo(lattice.periodicInfo, recomputedPeriodicInfo(lattice))
+
+def test_shrinking_scale_invalidates_periodic_cache():
+    lattice = xlt.Lattice(diamondGraph())
+    assert len(lattice.xMinFace) == 5
+    lattice.scale(1e-7)
+    assert lattice.cacheStats["analyticUpdates"] == 0
+    assert len(lattice.xMinFace) == len(recomputedPeriodicInfo(lattice)[3]) == 18
+
+def test_construction_does_not_count_invalidation():
+    lattice = xlt.Lattice(diamondGraph())
+    assert lattice.cacheStats == {"hits": 0, "misses": 0, "analyticUpdates": 0, "invalidations": 0}
+    lattice.update(diamondGraph())
+    assert lattice.cacheStats["invalidations"] == 1
+
+def test_weld_reports_removed_nodes_and_edges():
+    pos = [(0, 0, 0), (1, 0, 0), (1 + 4e-6, 0, 0), (2, 0, 0), (0, 0, 0)]
+    edges = [(0, 1), (2, 3), (4, 2), (1, 3)]
+    lattice = xlt.Lattice.fromArrays([1, 2, 3, 4, 5], pos, edges, [0.1, 0.2, 0.3, 0.4])
+    report = lattice.weld()
+    assert report == {"nodesRemoved": 2, "edgesRemoved": 2}
+    assert lattice.nodeIDs.tolist() == [1, 2, 4]
+    assert sorted(map(tuple, lattice.edges.tolist())) == [(0, 1), (1, 2)]
+
+def test_weld_does_not_chain_beyond_tol():
+    # each node is within tol of the next, but the ends are 1.6e-5 apart
+    pos = [(0, 0, 0), (0.8e-5, 0, 0), (1.6e-5, 0, 0)]
+    lattice = xlt.Lattice.fromArrays([1, 2, 3], pos, [(0, 2)])
+    report = lattice.weld(1e-5)
+    assert report == {"nodesRemoved": 1, "edgesRemoved": 0}
+    assert lattice.nodeIDs.tolist() == [1, 3]
+    assert np.abs(lattice.pos[0] - lattice.pos[1]).max() > 1e-5
+
+def test_merge_welds_shared_face():
+    G = diamondGraph()
+    lattice = xlt.Lattice(G)
+    other = xlt.Lattice(translated(G, 0, 1))
+    shared = len(lattice.xMaxFace)
+    report = lattice.merge(other)
+    assert report == {"nodesRemoved": shared, "edgesRemoved": 0}
+    assert lattice.numberOfNodes() == 2*G.number_of_nodes() - shared
+    assert lattice.numberOfEdges() == 2*G.number_of_edges()
+
+def referencePeriodicNodes(nodeIDs, pos, tol):
+    # faces from the extents, then a nested loop over opposing faces (the original matching)
+    ids = nodeIDs.tolist()
+    posOf = dict(zip(ids, pos.tolist()))
+    minimum, maximum = pos.min(axis=0), pos.max(axis=0)
+    minFaces = [set(nodeIDs[np.abs(pos[:, i] - minimum[i]) <= tol].tolist()) for i in range(3)]
+    maxFaces = [set(nodeIDs[np.abs(pos[:, i] - maximum[i]) <= tol].tolist()) for i in range(3)]
+    periodics = list()
+    fullyPeriodic = True
+    for axis in range(3):
+        axes = [a for a in range(3) if a != axis]
+        periodic = dict()
+        for n1 in minFaces[axis]:
+            for n2 in maxFaces[axis]:
+                if n2 not in periodic and all(abs(posOf[n1][a] - posOf[n2][a]) <= tol for a in axes):
+                    periodic[n1] = n2
+                    periodic[n2] = n1
+            fullyPeriodic = fullyPeriodic and n1 in periodic
+        periodics.append(periodic)
+    faces = [face for pair in zip(minFaces, maxFaces) for face in pair]
+    extents = tuple(v for pair in zip(minimum.tolist(), maximum.tolist()) for v in pair)
+    return periodics + faces + [fullyPeriodic, extents]
+
+def test_find_periodic_nodes_matches_nested_loop():
+    lattice = xlt.Lattice(diamondGraph(shuffled=True)).tessellate(3, 2, 2, inPlace=False)
+    expected = referencePeriodicNodes(lattice.nodeIDs, lattice.pos, 1e-5)
+    assert expected[9]
+    assert xlt.findPeriodicNodes(lattice.G) == expected
+    assert xlt.findPeriodicNodes(lattice) == expected
+
+def test_find_periodic_nodes_with_near_duplicates_and_missing_partners():
+    rng = np.random.RandomState(5)
+    pos = rng.randint(0, 4, (400, 3))*0.25 + rng.randint(-1, 2, (400, 3))*4e-6
+    nodeIDs = rng.permutation(400) + 1
+    expected = referencePeriodicNodes(nodeIDs, pos, 1e-5)
+    assert not expected[9]
+    with pytest.warns(UserWarning):
+        info = xlt.periodicNodesFromArrays(nodeIDs, pos, 1e-5)
+    assert info == expected
+
+def test_find_periodic_nodes_reports_not_fully_periodic():
+    G = diamondGraph()
+    assert xlt.findPeriodicNodes(G)[9]
+    G.nodes[14]["pos"] = (1, 0.6, 0.5) # face center on the x max face, moved off its partner
+    with pytest.warns(UserWarning, match="Cannot match node"):
+        info = xlt.findPeriodicNodes(G)
+    assert info[9] is False
+    assert 14 not in info[0]
+
+def geometry(lattice):
+    # nodes and edges as rounded coordinates, independent of node numbering
+    points = [tuple(p) for p in np.round(lattice.pos, 9).tolist()]
+    edges = sorted((tuple(sorted((points[i], points[j]))), d) for (i, j), d in zip(lattice.edges.tolist(), lattice.diameters.tolist()))
+    return sorted(points), edges
+
+@pytest.mark.parametrize("counts", [(1, 1, 1), (2, 1, 1), (3, 2, 2), (1, 4, 3)])
+def test_single_pass_tessellation_matches_multi_pass(counts):
+    unit = xlt.Lattice(diamondGraph(shuffled=True))
+    singlePass = unit.tessellate(*counts, inPlace=False, singlePass=True)
+    assert geometry(singlePass) == geometry(unit.tessellate(*counts, inPlace=False))
+    assert singlePass.nodeIDs.tolist() == list(range(1, singlePass.numberOfNodes() + 1))
+
+def test_tessellation_map_places_every_cell_node():
+    unit = xlt.Lattice(diamondGraph(shuffled=True))
+    tessellation = xlt.TessellationMap(unit, 3, 2, 2)
+    lattice = unit.tessellate(3, 2, 2, inPlace=False, singlePass=True)
+    cells = np.repeat(tessellation.cellIndices(), unit.numberOfNodes(), axis=0)
+    rows = np.tile(np.arange(unit.numberOfNodes()), tessellation.numberOfCells())
+    globalIDs = tessellation.globalIDsFromRows(cells, rows)
+    assert np.allclose(lattice.pos[globalIDs - 1], unit.pos[rows] + cells*tessellation.cellSize)
+    assert np.array_equal(np.unique(globalIDs), lattice.nodeIDs)
+    owners = tessellation.globalIDsFromResolved(*tessellation.ownerOf(lattice.nodeIDs - 1))
+    assert np.array_equal(owners, lattice.nodeIDs)
+    G = diamondGraph()
+    G.nodes[14]["pos"] = (1, 0.6, 0.5)
+    broken = xlt.Lattice(G)
+    with pytest.warns(UserWarning):
+        broken.periodicInfo
+    xlt.TessellationMap(broken, 1, 2, 1)
+    with pytest.raises(ValueError):
+        xlt.TessellationMap(broken, 2, 1, 1)
+
+def rotationAbout(axis, angle):
+    matrix = np.identity(4)
+    a, b = [k for k in range(3) if k != axis]
+    matrix[a, a] = matrix[b, b] = np.cos(angle)
+    matrix[a, b], matrix[b, a] = -np.sin(angle), np.sin(angle)
+    return matrix
+
+def test_pending_transform_matches_eager_application():
+    steps = [("translate", (0.5, -2, 3)), ("scale", (2, 3, 4)), ("flip", (1,)), ("transform", (rotationAbout(2, 0.3),)),
+        ("translate", (1, 1, 1)), ("scale", (0.5,))]
+    deferred = xlt.Lattice(diamondGraph())
+    deferred.periodicInfo # flip then uses the cached extents instead of reading pos
+    eager = xlt.Lattice(diamondGraph())
+    for name, args in steps:
+        getattr(deferred, name)(*args)
+        getattr(eager, name)(*args)
+        eager.pos # applies the pending transform after every step
+    assert eager.pendingTransform().tolist() == np.identity(4).tolist()
+    pending = deferred.pendingTransform()
+    expected = xlt.applyAffineTransform(pending, xlt.Lattice(diamondGraph()).pos)
+    assert np.allclose(deferred.pos, eager.pos, atol=1e-12)
+    assert np.allclose(deferred.pos, expected, atol=1e-12)
+    assert deferred.pendingTransform().tolist() == np.identity(4).tolist()
+
+def test_copies_share_coordinates_until_written():
+    original = xlt.Lattice(diamondGraph())
+    before = original.pos.copy()
+    moved = original.translate(1, 0, 0, inPlace=False)
+    untouched = original.copy()
+    assert np.shares_memory(untouched._pos, original._pos)
+    assert np.allclose(moved.pos, before + (1, 0, 0))
+    assert np.array_equal(original.pos, before)
+    original.pos[0] = (9, 9, 9) # writes to original only
+    assert np.array_equal(untouched.pos, before)
+    assert np.allclose(moved.pos, before + (1, 0, 0))
+    untouched.pos[1] = (7, 7, 7)
+    assert original.pos[1].tolist() == before[1].tolist()
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_save_load_round_trip(tmp_path, mmap):
+    lattice = xlt.Lattice(diamondGraph(shuffled=True)).tessellate(2, 2, 1, inPlace=False)
+    lattice.applyDiameterDistribution(lambda x, y, z: 0.01 + 0.1*x, batch=True)
+    path = str(tmp_path / "lattice.bin")
+    lattice.save(path)
+    loaded = xlt.Lattice.load(path, mmap=mmap)
+    assert loaded.pos.flags.writeable != mmap # memory mapped arrays are read only
+    for name in ("nodeIDs", "pos", "edges", "diameters"):
+        assert np.array_equal(getattr(loaded, name), getattr(lattice, name))
+    assert loaded.tol == lattice.tol
+    assert loaded.periodicInfo == lattice.periodicInfo
+    assert loaded.cacheStats["misses"] == 1 and loaded.cacheStats["invalidations"] == 0
+    assert nx.utils.graphs_equal(loaded.G, lattice.G)
+    # transforming a loaded lattice leaves the file alone
+    loaded.translate(1, 0, 0)
+    assert np.allclose(loaded.pos, lattice.pos + (1, 0, 0))
+    assert np.array_equal(xlt.Lattice.load(path, mmap=mmap).pos, lattice.pos)
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / "not a lattice.bin"
+    path.write_bytes(b"*KEYWORD\n")
+    with pytest.raises(ValueError):
+        xlt.Lattice.load(str(path))
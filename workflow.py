@@ -10,6 +10,7 @@
 import xlattice as xlt
 import dynautil as util
 import slurmscheduler as sch
+import latticecache
 import matplotlib.pyplot as plt
 import time
 
@@ -35,6 +36,7 @@ LSCARDS = util.importDynaCardsList("defaultcards.k")
 mc2 = sch.Scheduler()
 
 HOMEDIRECTORY = "/me329/rchensix/automation_test/workflow_test_V1/"
+LATTICE_CACHE = latticecache.LatticeCache(HOMEDIRECTORY + "lattice_cache/") # reruns skip geometry generation
 
 submittedJobs = set()
 completedJobs = set()
@@ -42,7 +44,7 @@ completedJobs = set()
 jobData = dict() # this will be built into slurmscheduler later
 
 for angle in INCLINATION:
-	lattice, movingNodes, fixedNodes = xlt.snap_through_lattice(angle, EDGE_LENGTH, WALL_HEIGHT, WALL_GRID_SIZE)
+	lattice, movingNodes, fixedNodes = LATTICE_CACHE.call(xlt.snap_through_lattice, angle, EDGE_LENGTH, WALL_HEIGHT, WALL_GRID_SIZE)
 	directory = HOMEDIRECTORY + "INCLINATION_" + str(angle) + "/"
 	sch.mkdir(directory)
 	keyFile = directory + "snap_through_" + str(angle) + ".k"
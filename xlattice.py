@@ -1,11 +1,24 @@
 """
-xlattice version 2.0
+xlattice version 2.2
 Written by Ruiqi Chen (rchensix at stanford dot edu) and Lucas Zhou (zzh at stanford dot edu)
 February 25, 2019
 This module utilizes the networkx module to generate unit cell lattice structures
 
 WARNING: This module is not compatible with older code that utilize xlattice 1.4 and below!
 
+NEW IN 2.2
+-Lattice stores node coordinates, edges, and diameters in NumPy arrays; the NetworkX graph is built on demand
+-translate, scale, flip, mirror, and tessellate are vectorized array operations (mirror and tessellate keep the node and edge order of 2.1)
+-Added Lattice.fromArrays, Lattice.copy, and array conversion helpers (graphToArrays, arraysToGraph, relabelArrays, composeArrays)
+-findPeriodicNodes matches opposing faces with a spatial hash (findCoincidentPairs) instead of a nested loop
+-Added single pass tessellation (tessellate with singlePass=True) with contiguous node IDs given by TessellationMap
+-Added TessellatedLattice, a lazy tessellation that generates nodes and edges on the fly for meshing
+-periodicInfo, face sets, and extents are cached lazily and updated analytically by translate, scale, and flip (see cacheStats)
+-translate, scale, and flip are deferred into a single pending affine transform (see Lattice.transform)
+-applyDiameterDistribution(..., batch=True) calls f once with arrays of all edges (batch mode)
+-Added Lattice.weld and Lattice.merge to collapse coincident nodes and duplicate edges
+-Added binary lattice files (Lattice.save, Lattice.load) with memory mapped loading
+
 NEW IN 2.1
 -Added flip method in Lattice class
 -Added mirror method in Lattice class
@@ -49,35 +62,243 @@ import matplotlib.pyplot as plt
 import networkx as nx
 import numpy as np
 from mpl_toolkits.mplot3d import Axes3D
-import math
 import warnings
 import copy
+import json
+import struct
+
+__version__ = "2.2"
 
 # This class builds upon a NetworkX graph and adds features for checking periodicity, 
 # determining periodic face nodes, and various utility methods like translation and tessellation
+# The lattice is stored in contiguous NumPy arrays:
+#   nodeIDs     (N,)    node labels (same labels as the NetworkX graph)
+#   pos         (N, 3)  node coordinates
+#   edges       (E, 2)  row indices into nodeIDs/pos, stored in the same order NetworkX iterates G.edges
+#   diameters   (E,)    edge diameters (NaN if the edge has no diameter assigned)
+# The NetworkX graph G is only built on demand (and cached) for code that still needs it
+# translate, scale, flip, and transform only record a pending 4x4 affine transform; it is applied to the coordinates
+# once, vectorized, when pos is read (meshing, plotting, export), so copies are cheap views until then
+# (the arrays are shared between copies and must not be edited in place; use setArrays instead)
+# Periodic maps, face sets, and extents (periodicInfo) are derived state that is computed lazily and cached:
+#   translate, scale, and flip update the cached state analytically
+#   edits to diameters do not touch it
+#   topology changes (setArrays, update, tessellate, mirror) or invalidate() throw it away
+# cacheStats (per Lattice) and Lattice.totalCacheStats (all Lattices) count how the cache was used
+
+def _periodicInfoProperty(index):
+    # read-only property for entry index of the lazily computed periodicInfo list
+    return property(lambda self: self._periodicState()[index])
 
 class Lattice:
+    totalCacheStats = {"hits": 0, "misses": 0, "analyticUpdates": 0, "invalidations": 0}
+
+    xPeriodic = _periodicInfoProperty(0)
+    yPeriodic = _periodicInfoProperty(1)
+    zPeriodic = _periodicInfoProperty(2)
+    xMinFace = _periodicInfoProperty(3)
+    xMaxFace = _periodicInfoProperty(4)
+    yMinFace = _periodicInfoProperty(5)
+    yMaxFace = _periodicInfoProperty(6)
+    zMinFace = _periodicInfoProperty(7)
+    zMaxFace = _periodicInfoProperty(8)
+    isFullyPeriodic = _periodicInfoProperty(9)
+    extents = _periodicInfoProperty(10)
+
     def __init__(self, G, tol=1e-5):
         self.update(G, tol)
 
+    @classmethod
+    def fromArrays(cls, nodeIDs, pos, edges, diameters=None, tol=1e-5):
+        # builds a Lattice directly from arrays without going through a NetworkX graph
+        # edges are row indices into nodeIDs/pos
+        lattice = cls.__new__(cls)
+        lattice.setArrays(nodeIDs, pos, edges, diameters, tol)
+        return lattice
+
     def update(self, G, tol=1e-5):
-        # update instance variable information
-        self.G = G
+        # update instance variable information from a NetworkX graph
+        nodeIDs, pos, edges, diameters = graphToArrays(G)
+        self.setArrays(nodeIDs, pos, edges, diameters, tol)
+        self._G = G
+
+    def setArrays(self, nodeIDs, pos, edges, diameters=None, tol=1e-5, copyArrays=True):
+        # update instance variable information from arrays
+        # if copyArrays is False, arrays that already have the right dtype are used as is (e.g. memory mapped arrays)
         self.tol = tol
-        self.periodicInfo = findPeriodicNodes(G, tol)
-        self.xPeriodic = self.periodicInfo[0]
-        self.yPeriodic = self.periodicInfo[1]
-        self.zPeriodic = self.periodicInfo[2]
-        self.xMinFace = self.periodicInfo[3]
-        self.xMaxFace = self.periodicInfo[4]
-        self.yMinFace = self.periodicInfo[5]
-        self.yMaxFace = self.periodicInfo[6]
-        self.zMinFace = self.periodicInfo[7]
-        self.zMaxFace = self.periodicInfo[8]      
-        self.isFullyPeriodic = self.periodicInfo[9]
-        self.extents = self.periodicInfo[10]
-
-    def tessellate(self, nX, nY, nZ, inPlace=True):
+        asArray = np.array if copyArrays else np.asarray
+        self.nodeIDs = asArray(nodeIDs, dtype=np.int64).reshape(-1)
+        self.pos = asArray(pos, dtype=float).reshape(-1, 3)
+        self.edges = asArray(edges, dtype=np.int64).reshape(-1, 2)
+        if diameters is None:
+            self.diameters = np.full(len(self.edges), np.nan)
+        else:
+            self.diameters = asArray(diameters, dtype=float).reshape(-1)
+        assert(len(self.nodeIDs) == len(self.pos))
+        assert(len(self.edges) == len(self.diameters))
+        self._G = None
+        self._rowLookup = None
+        refill = hasattr(self, "cacheStats")
+        if not refill:
+            self.cacheStats = {"hits": 0, "misses": 0, "analyticUpdates": 0, "invalidations": 0}
+        self._periodicInfo = None
+        self._storedPeriodicInfo = None
+        if refill:
+            # the initial fill of a new Lattice has nothing to invalidate
+            self._countCache("invalidations")
+
+    def _countCache(self, key):
+        self.cacheStats[key] += 1
+        Lattice.totalCacheStats[key] += 1
+
+    def _periodicState(self):
+        # returns the cached periodicInfo list, recomputing it if it was invalidated
+        if self._periodicInfo is None:
+            self._countCache("misses")
+            if self._storedPeriodicInfo is not None:
+                # periodic info saved with the lattice (see loadLattice) is only converted to sets and dicts when needed
+                self._periodicInfo = self._storedPeriodicInfo()
+                self._storedPeriodicInfo = None
+            else:
+                self._periodicInfo = periodicNodesFromArrays(self.nodeIDs, self.pos, self.tol)
+        else:
+            self._countCache("hits")
+        return self._periodicInfo
+
+    @property
+    def periodicInfo(self):
+        # [xPeriodic, yPeriodic, zPeriodic, xMinFace, xMaxFace, yMinFace, yMaxFace, zMinFace, zMaxFace, isFullyPeriodic, extents]
+        return self._periodicState()
+
+    def updatePeriodicInfo(self):
+        # recomputes periodic maps, face sets, and extents from the current node coordinates
+        self.invalidate()
+        self._periodicState()
+
+    def invalidate(self):
+        # throws away all derived state; call this after editing nodeIDs, pos, or edges directly
+        self._G = None
+        self._rowLookup = None
+        self._periodicInfo = None
+        self._storedPeriodicInfo = None
+        self._countCache("invalidations")
+
+    @property
+    def pos(self):
+        # node coordinates; any pending affine transform is applied here (once for all pending transforms)
+        if self._transform is not None:
+            self._pos = applyAffineTransform(self._transform, self._pos)
+            self._transform = None
+            self._ownsPos = True
+        elif not self._ownsPos:
+            self._pos = self._pos.copy() # copy on write: the array is shared with another Lattice
+            self._ownsPos = True
+        return self._pos
+
+    @pos.setter
+    def pos(self, pos):
+        self._pos = pos
+        self._transform = None
+        self._ownsPos = True
+
+    def pendingTransform(self):
+        # returns the 4x4 affine transform that has been recorded but not yet applied to pos
+        if self._transform is None:
+            return np.identity(4)
+        return self._transform.copy()
+
+    @property
+    def G(self):
+        # NetworkX view of the lattice; built from the arrays the first time it is requested
+        if self._G is None:
+            self._G = arraysToGraph(self.nodeIDs, self.pos, self.edges, self.diameters)
+        return self._G
+
+    @G.setter
+    def G(self, G):
+        self.update(G, self.tol)
+
+    def numberOfNodes(self):
+        return len(self.nodeIDs)
+
+    def numberOfEdges(self):
+        return len(self.edges)
+
+    def nodeRows(self, nodes):
+        # returns the rows of pos corresponding to the node IDs in nodes (any iterable)
+        if self._rowLookup is None:
+            self._rowLookup = NodeRowLookup(self.nodeIDs)
+        if not isinstance(nodes, np.ndarray):
+            nodes = np.fromiter(nodes, dtype=np.int64)
+        return self._rowLookup[nodes]
+
+    def copy(self):
+        # returns an independent copy of the Lattice (cached derived state is copied too)
+        # arrays are shared until one of the lattices writes to its coordinates
+        lattice = Lattice.__new__(Lattice)
+        lattice.tol = self.tol
+        lattice.nodeIDs = self.nodeIDs
+        lattice.edges = self.edges
+        lattice.diameters = self.diameters
+        lattice._pos = self._pos
+        lattice._transform = None if self._transform is None else self._transform.copy()
+        lattice._ownsPos = False
+        self._ownsPos = False
+        lattice._G = None
+        lattice._rowLookup = self._rowLookup
+        lattice._periodicInfo = copy.deepcopy(self._periodicInfo)
+        lattice._storedPeriodicInfo = self._storedPeriodicInfo
+        lattice.cacheStats = {"hits": 0, "misses": 0, "analyticUpdates": 0, "invalidations": 0}
+        return lattice
+
+    def _geometryChanged(self):
+        # invalidates the cached NetworkX view after node coordinates were changed
+        self._G = None
+
+    def transform(self, matrix, inPlace=True):
+        # applies the 4x4 affine transform matrix (acting on column vectors (x, y, z, 1)) to all nodes
+        # the transform is only recorded here and applied when pos is read
+        # axis aligned transforms (scaling, mirroring, translation) update the cached periodic info analytically;
+        # anything else invalidates it, as does shrinking along any axis (or stretching an axis whose scaled extent
+        # stays within a few tol), since face membership and periodic matching compare scaled distances against tol
+        matrix = np.array(matrix, dtype=float)
+        assert(matrix.shape == (4, 4))
+        if inPlace:
+            lattice = self
+        else:
+            lattice = self.copy()
+        if lattice._transform is None:
+            lattice._transform = matrix
+        else:
+            lattice._transform = np.dot(matrix, lattice._transform)
+        lattice._geometryChanged()
+        info = lattice._periodicInfo
+        if info is not None:
+            linear = matrix[0:3, 0:3]
+            diagonal = np.diagonal(linear)
+            scale = np.abs(diagonal)
+            spans = np.array([info[10][2*axis + 1] - info[10][2*axis] for axis in range(3)])
+            rescaled = scale != 1
+            unsafe = rescaled & ((scale < 1) | (scale*spans < 2*lattice.tol))
+            if np.count_nonzero(linear - np.diag(diagonal)) == 0 and np.all(diagonal != 0) and not np.any(unsafe):
+                extents = list()
+                for axis in range(3):
+                    low = diagonal[axis]*info[10][2*axis] + matrix[axis, 3]
+                    high = diagonal[axis]*info[10][2*axis + 1] + matrix[axis, 3]
+                    if diagonal[axis] < 0:
+                        # min and max faces trade places
+                        low, high = high, low
+                        info[3 + 2*axis], info[4 + 2*axis] = info[4 + 2*axis], info[3 + 2*axis]
+                    extents.extend((float(low), float(high)))
+                info[10] = tuple(extents)
+                lattice._countCache("analyticUpdates")
+            else:
+                lattice._periodicInfo = None
+                lattice._countCache("invalidations")
+        if not inPlace:
+            return lattice
+
+    def tessellate(self, nX, nY, nZ, inPlace=True, singlePass=False):
     # tessellates the current lattice in the x, y, and z directions into a nX*nY*nZ lattice
     # nI=1 means don't tessellate along direction I
     # nI must be < 0 for all directions I
@@ -85,65 +306,70 @@ class Lattice:
     # if inPlace is False, a newly tessellated copy of the original Lattice will be returned
     # otherwise, the Lattice will be modified in place
     # if mirror is True, every other unit cell will be mirror images (this guarantees tessellation even for non-symmetric unit cells)
+    # if singlePass is True, the whole lattice is built at once from the unit cell's periodic face maps
+    # and nodes are numbered contiguously from 1 (see TessellationMap for the cell/local node to global ID map)
         assert(nX > 0 and nY > 0 and nZ > 0)
 
-        if not inPlace:
-            originalG = self.G.copy() # keep copy of original graph to rebuild later
+        if singlePass:
+            tessellation = TessellationMap(self, nX, nY, nZ)
+            nodeIDs, pos = tessellation.nodes()
+            n1, n2, diameters = tessellation.edgesForCells()
+            edges = np.column_stack((n1, n2)) - tessellation.nidStart
+            edges, diameters = canonicalEdges(edges, diameters, len(nodeIDs))
+            if inPlace:
+                self.setArrays(nodeIDs, pos, edges, diameters, self.tol)
+                return
+            return Lattice.fromArrays(nodeIDs, pos, edges, diameters, self.tol)
+
+        if inPlace:
+            lattice = self
+        else:
+            lattice = self.copy()
 
-        def propagate(G, n, axis):
-            maxNodeNumber = max(list(G))
+        def propagate(lattice, n, axis):
+            # the n-1 translated copies along axis are relabeled in the node and edge order nx.relabel_nodes gave in
+            # xlattice 2.1 (see relabelArrays), which fixes the mesh numbering, then all copies are merged in a single compose
             assert(axis == 0 or axis == 1 or axis == 2)
-            for i in range(n):
-                if i != 0:
-                    # determine which face nodes will be renamed
-                    if axis == 0:
-                        face = self.xMinFace
-                        periodic = self.xPeriodic
-                    elif axis == 1:
-                        face = self.yMinFace
-                        periodic = self.yPeriodic
-                    else:
-                        face = self.zMinFace
-                        periodic = self.zPeriodic
-                    # create new graph, translate in direction of axis
-                    translationDistance = i*(self.extents[2*axis + 1] - self.extents[2*axis])
-                    if axis == 0:
-                        newG = translate(self.G, translationDistance, 0, 0, inPlace=False)
-                    elif axis == 1:
-                        newG = translate(self.G, 0, translationDistance, 0, inPlace=False)
-                    else:
-                        newG = translate(self.G, 0, 0, translationDistance, inPlace=False)
-                    # rename all nodes in newG
-                    mapping = dict()
-                    for node in list(newG):
-                        if node in face:
-                            mapping[node] = periodic[node] + (i-1)*maxNodeNumber
-                        else:
-                            mapping[node] = node + i*maxNodeNumber
-                    nx.relabel.relabel_nodes(newG, mapping, copy=False)
-                    # merge graphs G and newG
-                    G = nx.algorithms.operators.binary.compose(G, newG)
-            return G
+            if n == 1:
+                return
+            face = (lattice.xMinFace, lattice.yMinFace, lattice.zMinFace)[axis]
+            periodic = (lattice.xPeriodic, lattice.yPeriodic, lattice.zPeriodic)[axis]
+            maxNodeNumber = int(lattice.nodeIDs.max())
+            # rename face nodes to their periodic partner in the previous copy
+            faceNodes = np.array(sorted(face), dtype=np.int64)
+            faceRows = lattice.nodeRows(faceNodes)
+            partners = np.array([periodic[node] for node in faceNodes], dtype=np.int64)
+            step = np.zeros(3)
+            step[axis] = lattice.extents[2*axis + 1] - lattice.extents[2*axis]
+            copies = list()
+            for i in range(1, n):
+                newIDs = lattice.nodeIDs + i*maxNodeNumber
+                newIDs[faceRows] = partners + (i - 1)*maxNodeNumber
+                copies.append(relabelArrays(lattice.nodeIDs, lattice.pos + i*step, lattice.edges, lattice.diameters,
+                    np.arange(len(newIDs)), newIDs))
+            # merge all copies into the lattice
+            offsets = np.cumsum([0] + [len(c[0]) for c in copies[:-1]])
+            nodeIDs, pos, edges, diameters = composeArrays(lattice.nodeIDs, lattice.pos, lattice.edges, lattice.diameters,
+                np.concatenate([c[0] for c in copies]), np.concatenate([c[1] for c in copies]),
+                np.concatenate([c[2] + offset for c, offset in zip(copies, offsets)]), np.concatenate([c[3] for c in copies]))
+            lattice.setArrays(nodeIDs, pos, edges, diameters, lattice.tol)
 
-        for axis in range(3):
-            if axis == 0: nA = nX
-            elif axis == 1: nA = nY
-            else: nA = nZ
-            G = self.G.copy()
-            G = propagate(G, nA, axis)
-            self.update(G, self.tol)
+        for axis, nA in enumerate((nX, nY, nZ)):
+            propagate(lattice, nA, axis)
 
         if not inPlace:
-            self.update(originalG, self.tol)
-            return Lattice(G, self.tol)
+            return lattice
 
     def translate(self, dx, dy, dz, inPlace=True):
-        result = translate(self.G, dx, dy, dz, inPlace)
         if inPlace:
-            xMin, xMax, yMin, yMax, zMin, zMax = self.extents
-            self.extents = (xMin + dx, xMax + dx, yMin + dy, yMax + dy, zMin + dz, zMax + dz)
+            lattice = self
+        else:
+            lattice = self.copy()
+        matrix = np.identity(4)
+        matrix[0:3, 3] = (dx, dy, dz)
+        lattice.transform(matrix)
         if not inPlace:
-            return Lattice(result, self.tol)
+            return lattice
 
     def scale(self, mx, my=None, mz=None, inPlace=True):
         if my == None and mz == None:
@@ -151,46 +377,34 @@ class Lattice:
             mz = mx
         assert(mx > 0 and my > 0 and mz > 0)
         if inPlace:
-            G = self.G
+            lattice = self
         else:
-            G = self.G.copy()
-        for n in list(G):
-            x, y, z = G.nodes[n]["pos"]
-            G.nodes[n]["pos"] = (mx*x, my*y, mz*z)
-        if inPlace:
-            xMin, xMax, yMin, yMax, zMin, zMax = self.extents
-            self.extents = (xMin*mx, xMax*mx, yMin*my, yMax*my, zMin*mz, zMax*mz)
+            lattice = self.copy()
+        lattice.transform(np.diag((mx, my, mz, 1.0)))
         if not inPlace:
-            return Lattice(G, self.tol)
+            return lattice
 
     def flip(self, plane, inPlace=True):
         # options are:
         # plane == 0: mirror about YZ plane
         # plane == 1: mirror about XZ plane
         # plane == 2: mirror about XY plane
+        # the min and max faces normal to plane trade places
         assert(plane >= 0 and plane <= 2)
         if inPlace:
-            G = self.G
+            lattice = self
         else:
-            G = self.G.copy()
-        for n in list(G):
-            x, y, z = G.nodes[n]["pos"]
-            if plane == 0:
-                x = self.extents[1] + self.extents[0] - x
-            elif plane == 1:
-                y = self.extents[3] + self.extents[2] - y
-            elif plane == 2:
-                z = self.extents[5] + self.extents[4] - z
-            G.nodes[n]["pos"] = (x, y, z)
+            lattice = self.copy()
+        extents = lattice.extents
+        matrix = np.identity(4)
+        matrix[plane, plane] = -1
+        matrix[plane, 3] = extents[2*plane + 1] + extents[2*plane]
+        lattice.transform(matrix)
         if not inPlace:
-            return Lattice(G, self.tol)
+            return lattice
 
     def mirror(self, plane, inPlace=True):
         assert(plane >= 0 and plane <= 2)
-        if inPlace:
-            G = self.G
-        else:
-            G = self.G.copy()
         # makes copy, performs flip, then merges the lattices together
         newLattice = self.flip(plane, inPlace=False)
         if plane == 0:
@@ -202,32 +416,396 @@ class Lattice:
         elif plane == 2:
             newLattice.translate(0, 0, self.extents[5] - self.extents[4])
             nodesNotToRename = newLattice.zMinFace
-        newG = newLattice.G
-        # merge graphs G and newG
-        maxNodeNumber = max(list(newG))
-        mapping = dict()
-        i = 1
-        for n in list(newG):
-            if n not in nodesNotToRename:
-                mapping[n] = maxNodeNumber + i
-                i += 1
-        nx.relabel.relabel_nodes(newG, mapping, copy=False)
-        G = nx.algorithms.operators.binary.compose(G, newG)
+        # renumber all nodes of the flipped copy except the ones on the mirror plane
+        maxNodeNumber = int(newLattice.nodeIDs.max())
+        toRename = ~np.isin(newLattice.nodeIDs, np.fromiter(nodesNotToRename, dtype=np.int64, count=len(nodesNotToRename)))
+        renamedRows = np.flatnonzero(toRename)
+        newIDs, newPos, newEdges, newDiameters = relabelArrays(newLattice.nodeIDs, newLattice.pos, newLattice.edges,
+            newLattice.diameters, renamedRows, maxNodeNumber + 1 + np.arange(len(renamedRows)))
+        # merge lattices
+        nodeIDs, pos, edges, diameters = composeArrays(self.nodeIDs, self.pos, self.edges, self.diameters,
+            newIDs, newPos, newEdges, newDiameters)
         if inPlace:
-            self.G = G
-            self.update(G)
+            self.setArrays(nodeIDs, pos, edges, diameters, self.tol)
         if not inPlace:
-            return Lattice(G, self.tol)
+            return Lattice.fromArrays(nodeIDs, pos, edges, diameters, self.tol)
+
+    def weld(self, tol=None, inPlace=True):
+        # collapses coincident nodes (within tol in every coordinate, default self.tol) into one node
+        # and removes the duplicate and zero length edges this creates
+        # nodes are grouped around the first node (in row order) not merged yet, which keeps its ID;
+        # a node is only merged into a node within tol of it, so chains of nodes spaced just under tol apart
+        # are thinned out rather than collapsed into one node
+        # returns a report {"nodesRemoved": ..., "edgesRemoved": ...}; if inPlace is False, returns (newLattice, report)
+        if tol == None:
+            tol = self.tol
+        pos = self.pos
+        i, j = findCoincidentPairs(pos, pos, tol)
+        representative = coincidentGroups(len(pos), i, j)
+        keep = representative == np.arange(len(pos))
+        newRow = np.cumsum(keep) - 1
+        edges = newRow[representative[self.edges]]
+        nonDegenerate = edges[:, 0] != edges[:, 1]
+        newEdges, newDiameters = canonicalEdges(edges[nonDegenerate], self.diameters[nonDegenerate], int(keep.sum()))
+        report = {"nodesRemoved": int(len(pos) - keep.sum()), "edgesRemoved": int(len(self.edges) - len(newEdges))}
+        if inPlace:
+            self.setArrays(self.nodeIDs[keep], pos[keep], newEdges, newDiameters, self.tol)
+            return report
+        return Lattice.fromArrays(self.nodeIDs[keep], pos[keep], newEdges, newDiameters, self.tol), report
+
+    def merge(self, other, tol=None, inPlace=True):
+        # adds the nodes and edges of Lattice other to this lattice and welds coincident nodes (see weld)
+        # nodes of other are renumbered past the largest node ID of this lattice
+        # returns the weld report; if inPlace is False, returns (newLattice, report)
+        offset = int(self.nodeIDs.max()) if len(self.nodeIDs) != 0 else 0
+        nodeIDs = np.concatenate((self.nodeIDs, other.nodeIDs - other.nodeIDs.min() + offset + 1 if len(other.nodeIDs) != 0 else other.nodeIDs))
+        pos = np.concatenate((self.pos, other.pos))
+        edges = np.concatenate((self.edges, other.edges + len(self.nodeIDs)))
+        diameters = np.concatenate((self.diameters, other.diameters))
+        lattice = Lattice.fromArrays(nodeIDs, pos, edges, diameters, self.tol)
+        report = lattice.weld(tol)
+        if inPlace:
+            self.setArrays(lattice.nodeIDs, lattice.pos, lattice.edges, lattice.diameters, self.tol)
+            return report
+        return lattice, report
+
+    def save(self, path):
+        # saves the lattice to a binary file (see saveLattice)
+        saveLattice(self, path)
+
+    @staticmethod
+    def load(path, mmap=True):
+        # loads a lattice saved with save (see loadLattice)
+        return loadLattice(path, mmap)
 
     def plot(self, elevation=30, azimuth=None):
         network_plot_3D(self.G, elevation, azimuth, self.extents)
 
-    def applyDiameterDistribution(self, f, mode=1, inPlace=True):
-        result = applyDiameterDistribution(self.G, f, mode, inPlace)
+    def applyDiameterDistribution(self, f, mode=1, inPlace=True, batch=None):
+        # see module level applyDiameterDistribution
+        if inPlace:
+            lattice = self
+        else:
+            lattice = self.copy()
+        p0 = lattice.pos[lattice.edges[:, 0]]
+        p1 = lattice.pos[lattice.edges[:, 1]]
+        lattice.diameters = edgeDiameters(p0, p1, f, mode, batch)
+        lattice._G = None
         if not inPlace:
-            return Lattice(result, self.tol)
+            return lattice
+
+class TessellationMap:
+    # closed form map from (cell index, local node) of a nX*nY*nZ tessellation of a unit cell to contiguous global node IDs
+    # a node on a max face of a unit cell is merged with its periodic partner on the min face of the next cell,
+    # so only cells at the +x, +y, or +z end of the tessellation own max face nodes
+    # global IDs are grouped by which max faces a node is on; within a group they are ordered by cell (x fastest)
+    # and then by local node, which gives the closed form
+    #   globalID = nidStart + groupOffset + cellIndexInGroup*groupSize + rankInGroup
+    def __init__(self, lattice, nX, nY, nZ, nidStart=1):
+        assert(nX > 0 and nY > 0 and nZ > 0)
+        self.counts = np.array((nX, nY, nZ), dtype=np.int64)
+        self.nidStart = int(nidStart)
+        self.unitCell = lattice
+        self.nodeIDs = lattice.nodeIDs.copy()
+        self.pos = lattice.pos.copy()
+        self.edges = lattice.edges.copy()
+        self.diameters = lattice.diameters.copy()
+        self.cellSize = np.array([lattice.extents[2*a + 1] - lattice.extents[2*a] for a in range(3)])
+        nNodes = len(self.nodeIDs)
+        self.onMaxFace = np.zeros((nNodes, 3), dtype=bool)
+        self.partner = np.tile(np.arange(nNodes)[:, np.newaxis], (1, 3)) # row of periodic partner on the min face
+        faces = ((lattice.xMinFace, lattice.xMaxFace, lattice.xPeriodic),
+            (lattice.yMinFace, lattice.yMaxFace, lattice.yPeriodic),
+            (lattice.zMinFace, lattice.zMaxFace, lattice.zPeriodic))
+        for axis, (minFace, maxFace, periodic) in enumerate(faces):
+            if self.counts[axis] == 1:
+                continue # nothing is merged along this axis
+            if not all(n in periodic for n in minFace) or not all(n in periodic for n in maxFace):
+                raise ValueError("Lattice is not periodic along axis " + str(axis) + " and cannot be tessellated in that direction!")
+            maxNodes = np.array(sorted(maxFace), dtype=np.int64)
+            maxRows = lattice.nodeRows(maxNodes)
+            self.onMaxFace[maxRows, axis] = True
+            self.partner[maxRows, axis] = lattice.nodeRows(np.array([periodic[n] for n in maxNodes.tolist()], dtype=np.int64))
+        # an edge lying in a max face is the same edge as its periodic partner on the min face of the next cell
+        # (provided the unit cell contains that partner edge)
+        lo = np.minimum(self.edges[:, 0], self.edges[:, 1])
+        hi = np.maximum(self.edges[:, 0], self.edges[:, 1])
+        self.edgeSkipAxes = np.zeros((len(self.edges), 3), dtype=bool)
+        for axis in range(3):
+            onFace = self.onMaxFace[self.edges[:, 0], axis] & self.onMaxFace[self.edges[:, 1], axis]
+            p1 = self.partner[self.edges[:, 0], axis]
+            p2 = self.partner[self.edges[:, 1], axis]
+            partnerExists = np.isin(np.minimum(p1, p2)*nNodes + np.maximum(p1, p2), lo*nNodes + hi)
+            self.edgeSkipAxes[:, axis] = onFace & partnerExists
+        # group local nodes by which max faces they are on (bit a set if on max face of axis a)
+        self.group = (self.onMaxFace*np.array((1, 2, 4))).sum(axis=1)
+        self.rank = np.zeros(nNodes, dtype=np.int64)
+        self.groupRows = list()
+        self.groupCells = np.zeros(8, dtype=np.int64)
+        self.groupOffset = np.zeros(9, dtype=np.int64)
+        for m in range(8):
+            rows = np.nonzero(self.group == m)[0]
+            self.groupRows.append(rows)
+            self.rank[rows] = np.arange(len(rows))
+            self.groupCells[m] = np.prod(self.groupDims(m))
+            self.groupOffset[m + 1] = self.groupOffset[m] + len(rows)*self.groupCells[m]
+        self.numberOfNodes = int(self.groupOffset[8])
+
+    def groupDims(self, m):
+        # cell grid dimensions for group m (axes where the nodes are on the max face only exist in the last cell)
+        return np.array([1 if m & (1 << a) else self.counts[a] for a in range(3)], dtype=np.int64)
+
+    def numberOfCells(self):
+        return int(np.prod(self.counts))
+
+    def cellIndices(self, start=0, stop=None):
+        # returns (K, 3) array of cell indices for linear cell numbers start to stop (x fastest)
+        if stop is None:
+            stop = self.numberOfCells()
+        linear = np.arange(start, stop, dtype=np.int64)
+        i = linear % self.counts[0]
+        j = (linear // self.counts[0]) % self.counts[1]
+        k = linear // (self.counts[0]*self.counts[1])
+        return np.column_stack((i, j, k))
+
+    def resolve(self, cells, rows):
+        # maps (cell, local row) pairs onto the owning (cell, local row) pair
+        # a max face node that is not in the last cell along that axis belongs to the next cell
+        cells = np.array(cells, dtype=np.int64).reshape(-1, 3)
+        rows = np.array(rows, dtype=np.int64).reshape(-1)
+        for _ in range(3): # corner nodes may move along all three axes
+            moved = False
+            for axis in range(3):
+                shift = self.onMaxFace[rows, axis] & (cells[:, axis] < self.counts[axis] - 1)
+                if shift.any():
+                    moved = True
+                    cells[shift, axis] += 1
+                    rows[shift] = self.partner[rows[shift], axis]
+            if not moved:
+                break
+        return cells, rows
 
-def applyDiameterDistribution(G, f, mode=1, inPlace=True):
+    def globalIDsFromRows(self, cells, rows):
+        # same as globalIDs but with local nodes given as rows of the unit cell arrays
+        cells, rows = self.resolve(cells, rows)
+        return self.globalIDsFromResolved(cells, rows)
+
+    def globalIDsFromResolved(self, cells, rows):
+        # global IDs of (cell, local row) pairs that are already resolved to their owner
+        group = self.group[rows]
+        dims = np.where((group[:, np.newaxis] >> np.arange(3)) & 1, 1, self.counts[np.newaxis, :])
+        reduced = np.where(dims == 1, 0, cells)
+        cellIndex = reduced[:, 0] + dims[:, 0]*(reduced[:, 1] + dims[:, 1]*reduced[:, 2])
+        groupSize = np.array([len(r) for r in self.groupRows], dtype=np.int64)
+        return self.nidStart + self.groupOffset[group] + cellIndex*groupSize[group] + self.rank[rows]
+
+    def globalIDs(self, cells, nodes):
+        # returns the global node IDs of unit cell nodes (given by their IDs) in cells (K x 3 array of cell indices)
+        return self.globalIDsFromRows(cells, self.unitCell.nodeRows(np.asarray(nodes, dtype=np.int64).reshape(-1)))
+
+    def nodes(self):
+        # returns (nodeIDs, pos) of all nodes in the tessellation, ordered by global ID
+        return self.nodesInRange(0, self.numberOfNodes)
+
+    def nodesInRange(self, start, stop):
+        # returns (nodeIDs, pos) of the nodes with global IDs nidStart + start to nidStart + stop (exclusive)
+        return self.nodesAt(np.arange(start, stop, dtype=np.int64))
+
+    def nodesAt(self, index):
+        # returns (nodeIDs, pos) of the nodes with global IDs nidStart + index (array of indices)
+        cells, rows = self.ownerOf(index)
+        return index + self.nidStart, self.positionsFromRows(cells, rows)
+
+    def ownerOf(self, index):
+        # returns the owning (cells, rows) of the nodes with global IDs nidStart + index
+        index = np.asarray(index, dtype=np.int64).reshape(-1)
+        group = np.searchsorted(self.groupOffset, index, side="right") - 1
+        groupSize = np.array([len(r) for r in self.groupRows], dtype=np.int64)
+        local = index - self.groupOffset[group]
+        cellIndex = local // groupSize[group]
+        rows = np.zeros(len(index), dtype=np.int64)
+        for m in np.unique(group).tolist():
+            inGroup = group == m
+            rows[inGroup] = self.groupRows[m][local[inGroup] % groupSize[m]]
+        dims = np.where((group[:, np.newaxis] >> np.arange(3)) & 1, 1, self.counts[np.newaxis, :])
+        cells = np.column_stack((cellIndex % dims[:, 0], (cellIndex // dims[:, 0]) % dims[:, 1], cellIndex // (dims[:, 0]*dims[:, 1])))
+        cells = np.where(dims == 1, self.counts - 1, cells)
+        return cells, rows
+
+    def positionsFromRows(self, cells, rows):
+        # coordinates of unit cell rows placed in cells
+        return self.pos[rows] + cells*self.cellSize
+
+    def numberOfEdges(self):
+        # number of unique edges in the tessellation
+        perEdge = np.where(self.edgeSkipAxes, 1, self.counts[np.newaxis, :]).prod(axis=1)
+        return int(perEdge.sum())
+
+    def edgesForCells(self, start=0, stop=None, positions=False):
+        # returns (n1, n2, diameter) global edge arrays of all unit cell edges in cells start to stop
+        # an edge lying in a max face is only kept in the last cell along that axis since the next cell
+        # contains the same edge on its min face
+        # if positions is True, (n1, n2, diameter, pos1, pos2) is returned
+        order, cells1, rows1, cells2, rows2, diameters = self.cellEdges(start, stop)
+        n1 = self.globalIDsFromResolved(cells1, rows1)
+        n2 = self.globalIDsFromResolved(cells2, rows2)
+        if positions:
+            return n1, n2, diameters, self.positionsFromRows(cells1, rows1), self.positionsFromRows(cells2, rows2)
+        return n1, n2, diameters
+
+    def cellEdges(self, start=0, stop=None):
+        # returns (order, cells1, rows1, cells2, rows2, diameters) of the kept edges in cells start to stop (see edgesForCells)
+        # with both ends resolved to their owner; order is cell*E + unit cell edge, the position in a full generation
+        if stop is None:
+            stop = self.numberOfCells()
+        cells = self.cellIndices(start, stop)
+        nEdges = len(self.edges)
+        cellsRepeated = np.repeat(cells, nEdges, axis=0)
+        skip = np.tile(self.edgeSkipAxes, (len(cells), 1)) & (cellsRepeated < self.counts - 1)
+        keep = ~skip.any(axis=1)
+        order = np.arange(start*nEdges, stop*nEdges, dtype=np.int64)[keep]
+        cellsRepeated = cellsRepeated[keep]
+        rows1 = np.tile(self.edges[:, 0], len(cells))[keep]
+        rows2 = np.tile(self.edges[:, 1], len(cells))[keep]
+        diameters = np.tile(self.diameters, len(cells))[keep]
+        cells1, rows1 = self.resolve(cellsRepeated, rows1)
+        cells2, rows2 = self.resolve(cellsRepeated, rows2)
+        return order, cells1, rows1, cells2, rows2, diameters
+
+    def edgesForNodes(self, start, stop, positions=False, cellsPerChunk=1024):
+        # returns (n1, n2, diameter) of the edges whose lower node has a global ID in nidStart + start to nidStart + stop
+        # (exclusive), as n1 < n2 and in the order of tessellate(singlePass=True): by n1, then by first generation
+        # the owner of an edge node is at most one cell further along each axis than the cell of the edge, so only a
+        # window of cells before the nodes of each group in the range is generated (cellsPerChunk cells at a time)
+        # if positions is True, (n1, n2, diameter, pos1, pos2) is returned
+        reach = 1 + self.counts[0] + self.counts[0]*self.counts[1] # largest linear cell distance from an edge to a node owner
+        windows = list()
+        for m in range(8):
+            first = max(start, self.groupOffset[m])
+            last = min(stop, self.groupOffset[m + 1]) - 1
+            if first <= last:
+                cells = self.ownerOf(np.array((first, last)))[0]
+                linear = cells[:, 0] + self.counts[0]*(cells[:, 1] + self.counts[1]*cells[:, 2])
+                windows.append([max(0, int(linear[0]) - reach), int(linear[1]) + 1])
+        merged = list()
+        for window in sorted(windows):
+            if len(merged) != 0 and window[0] <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], window[1])
+            else:
+                merged.append(window)
+        edges = [np.empty((0, 2), dtype=np.int64)]
+        diameters = [np.empty(0)]
+        for windowStart, windowStop in merged:
+            for cellStart in range(windowStart, windowStop, cellsPerChunk):
+                order, cells1, rows1, cells2, rows2, d = self.cellEdges(cellStart, min(cellStart + cellsPerChunk, windowStop))
+                n1 = self.globalIDsFromResolved(cells1, rows1) - self.nidStart
+                n2 = self.globalIDsFromResolved(cells2, rows2) - self.nidStart
+                inRange = (np.minimum(n1, n2) >= start) & (np.minimum(n1, n2) < stop)
+                edges.append(np.column_stack((n1, n2))[inRange])
+                diameters.append(d[inRange])
+        edges, diameters = canonicalEdges(np.concatenate(edges), np.concatenate(diameters), self.numberOfNodes)
+        n1 = edges[:, 0] + self.nidStart
+        n2 = edges[:, 1] + self.nidStart
+        if positions:
+            return n1, n2, diameters, self.nodesAt(edges[:, 0])[1], self.nodesAt(edges[:, 1])[1]
+        return n1, n2, diameters
+
+class TessellatedLattice:
+    # lazy view of a nX*nY*nZ tessellation of a unit cell Lattice
+    # only the unit cell is stored; nodes and edges are generated on the fly (in chunks) with the global IDs
+    # given by TessellationMap, i.e. the same IDs tessellate(nX, nY, nZ, singlePass=True) would give
+    # dynautil.generateKeyFile and dynautil.meshBeamEdges accept this class in place of a Lattice
+    def __init__(self, unitCell, nX, nY, nZ, chunkSize=65536):
+        self.unitCell = unitCell
+        self.tol = unitCell.tol
+        self.map = TessellationMap(unitCell, nX, nY, nZ)
+        self.chunkSize = chunkSize
+        xMin, xMax, yMin, yMax, zMin, zMax = unitCell.extents
+        self.extents = (xMin, xMin + nX*(xMax - xMin), yMin, yMin + nY*(yMax - yMin), zMin, zMin + nZ*(zMax - zMin))
+        self._faces = dict()
+
+    def numberOfNodes(self):
+        return self.map.numberOfNodes
+
+    def numberOfEdges(self):
+        return self.map.numberOfEdges()
+
+    def maxNodeID(self):
+        return self.map.nidStart + self.map.numberOfNodes - 1
+
+    def iterNodes(self, chunkSize=None):
+        # yields (nodeIDs, pos) array chunks in order of global ID
+        if chunkSize is None:
+            chunkSize = self.chunkSize
+        for start in range(0, self.map.numberOfNodes, chunkSize):
+            yield self.map.nodesInRange(start, min(start + chunkSize, self.map.numberOfNodes))
+
+    def iterEdges(self, chunkSize=None):
+        # yields (n1, n2, diameters, pos1, pos2) array chunks of about chunkSize edges, in the same order and orientation
+        # as the edges of materialize() (a range of lower nodes at a time, see TessellationMap.edgesForNodes)
+        if chunkSize is None:
+            chunkSize = self.chunkSize
+        nNodes = self.map.numberOfNodes
+        nodesPerChunk = max(1, chunkSize*nNodes // max(1, self.map.numberOfEdges()))
+        cellsPerChunk = max(1, chunkSize // max(1, len(self.map.edges)))
+        for start in range(0, nNodes, nodesPerChunk):
+            yield self.map.edgesForNodes(start, min(start + nodesPerChunk, nNodes), True, cellsPerChunk)
+
+    def nodeTuples(self):
+        # yields (nid, x, y, z) for every node
+        for nodeIDs, pos in self.iterNodes():
+            for nid, (x, y, z) in zip(nodeIDs.tolist(), pos.tolist()):
+                yield (nid, x, y, z)
+
+    def edgeTuples(self):
+        # yields (n1, n2, pos1, pos2, diameter) for every edge (diameter is None if not assigned)
+        for n1, n2, diameters, pos1, pos2 in self.iterEdges():
+            for e in zip(n1.tolist(), n2.tolist(), map(tuple, pos1.tolist()), map(tuple, pos2.tolist()), diameters.tolist()):
+                yield e if e[4] == e[4] else e[0:4] + (None,)
+
+    def face(self, axis, side):
+        # returns the set of global node IDs on the min (side=0) or max (side=1) face normal to axis
+        if (axis, side) not in self._faces:
+            unitFaces = ((self.unitCell.xMinFace, self.unitCell.xMaxFace),
+                (self.unitCell.yMinFace, self.unitCell.yMaxFace),
+                (self.unitCell.zMinFace, self.unitCell.zMaxFace))
+            localRows = self.unitCell.nodeRows(unitFaces[axis][side])
+            cells = self.map.cellIndices()
+            cells = cells[cells[:, axis] == side*(self.map.counts[axis] - 1)]
+            rows = np.tile(localRows, len(cells))
+            globalIDs = self.map.globalIDsFromRows(np.repeat(cells, len(localRows), axis=0), rows)
+            self._faces[(axis, side)] = set(np.sort(globalIDs).tolist()) # inserted in node order like the face sets of materialize()
+        return self._faces[(axis, side)]
+
+    @property
+    def xMinFace(self):
+        return self.face(0, 0)
+
+    @property
+    def xMaxFace(self):
+        return self.face(0, 1)
+
+    @property
+    def yMinFace(self):
+        return self.face(1, 0)
+
+    @property
+    def yMaxFace(self):
+        return self.face(1, 1)
+
+    @property
+    def zMinFace(self):
+        return self.face(2, 0)
+
+    @property
+    def zMaxFace(self):
+        return self.face(2, 1)
+
+    def materialize(self):
+        # builds the full Lattice (same node IDs)
+        return self.unitCell.tessellate(*self.map.counts.tolist(), inPlace=False, singlePass=True)
+
+def applyDiameterDistribution(G, f, mode=1, inPlace=True, batch=None):
     # mode 1 assumes diameter = f(x, y, z)
         # this assigns beams at (x, y, z) a diameter equal to f
     # mode 2 assumes diameter = f(azimuth, inclination)
@@ -236,33 +814,43 @@ def applyDiameterDistribution(G, f, mode=1, inPlace=True):
         # inclination is measured starting from z-axis
         # all angles should be in radians
         # see Wikipedia article on ISO convention of spherical coordinates
-    isLattice = False
+    # by default f is called once per edge; if batch is True, f is called once with NumPy arrays of all edges (see edgeDiameters)
     if isinstance(G, Lattice):
-        isLattice = True
-        G = G.G
+        return G.applyDiameterDistribution(f, mode, inPlace, batch)
     if not inPlace:
         G = G.copy()
-    for e in G.edges:
-        n0 = e[0]
-        n1 = e[1]
-        x0, y0, z0 = G.nodes[n0]["pos"]
-        x1, y1, z1 = G.nodes[n1]["pos"]
-        if mode == 1:
-            d = f((x0 + x1)/2, (y0 + y1)/2, (z0 + z1)/2)
-        elif mode == 2:
-            r = math.sqrt((x1 - x0)**2 + (y1 - y0)**2 + (z1 - z0)**2)
-            inclination = math.acos(abs(z1 - z0)/r)
-            if z1 > z0:
-                azimuth = math.atan2(y1 - y0, x1 - x0)
-            else:
-                azimuth = math.atan2(y0 - y1, x0 - x1)
-            d = f(azimuth, inclination)
-        G.edges[n0, n1]["diameter"] = d
+    nodeIDs, pos, edges = graphToArrays(G)[0:3]
+    diameters = edgeDiameters(pos[edges[:, 0]], pos[edges[:, 1]], f, mode, batch)
+    ids = nodeIDs.tolist()
+    for (i, j), d in zip(edges.tolist(), diameters.tolist()):
+        G.edges[ids[i], ids[j]]["diameter"] = d
     if not inPlace:
-        if isLattice:
-            return Lattice(G)
-        else:
-            return G
+        return G
+
+def edgeDiameters(p0, p1, f, mode=1, batch=None):
+    # evaluates the diameter distribution f (see applyDiameterDistribution) for edges from p0 to p1 ((E, 3) arrays)
+    # if batch is None (or False), f is called once per edge with scalars
+    # if batch is True, f is called exactly once with arrays (midpoint x, y, z for mode 1; azimuth, inclination for mode 2)
+    # and must return an array of E diameters; any other shape raises ValueError (f is never called a second time)
+    if mode == 1:
+        args = ((p0[:, 0] + p1[:, 0])/2, (p0[:, 1] + p1[:, 1])/2, (p0[:, 2] + p1[:, 2])/2)
+    elif mode == 2:
+        d = p1 - p0
+        r = np.sqrt(d[:, 0]**2 + d[:, 1]**2 + d[:, 2]**2)
+        inclination = np.arccos(np.abs(d[:, 2])/r)
+        up = p1[:, 2] > p0[:, 2]
+        azimuth = np.where(up, np.arctan2(d[:, 1], d[:, 0]), np.arctan2(p0[:, 1] - p1[:, 1], p0[:, 0] - p1[:, 0])) # not -d (signed zeros)
+        args = (azimuth, inclination)
+    else:
+        raise ValueError("Unsupported diameter distribution mode " + str(mode) + "!")
+    nEdges = len(p0)
+    if batch:
+        result = np.asarray(f(*args), dtype=float)
+        if result.shape != (nEdges,) and not (result.ndim == 0 and nEdges == 1):
+            raise ValueError("Batch diameter distribution returned shape " + str(result.shape) + " for " + str(nEdges) + " edges!")
+        return result.reshape(nEdges)
+    columns = [a.tolist() for a in args]
+    return np.array([f(*values) for values in zip(*columns)], dtype=float).reshape(-1)
 
 def translate(G, dx, dy, dz, inPlace=False):
     # translates all nodes in a networkx graph by (dx, dy, dz)
@@ -276,95 +864,345 @@ def translate(G, dx, dy, dz, inPlace=False):
 
 def findPeriodicNodes(G, tol=1e-5):
     # Given a graph G representing a rectangular cuboid lattice, this function finds periodic nodes
+    if isinstance(G, Lattice):
+        return periodicNodesFromArrays(G.nodeIDs, G.pos, tol)
+    nodeIDs, pos = graphToArrays(G)[0:2]
+    return periodicNodesFromArrays(nodeIDs, pos, tol)
 
-    # these sets store all periodic nodes
-    xMinFace = set()
-    xMaxFace = set()
-    yMinFace = set()
-    yMaxFace = set()
-    zMinFace = set()
-    zMaxFace = set()
+def periodicNodesFromArrays(nodeIDs, pos, tol=1e-5):
+    # same as findPeriodicNodes but works directly on the (nodeIDs, pos) arrays of a lattice
 
     # determine extents of the graph and which faces nodes are on
-    minX = float("inf")
-    maxX = float("-inf")
-    minY = float("inf")
-    maxY = float("-inf")
-    minZ = float("inf")
-    maxZ = float("-inf")
-    for n in list(G): # an iterator would be more efficient but there seems to be compatibility issues between NetworkX 1.1 and 2.2
-        x, y, z = G.nodes[n]["pos"] # position of current node n
-        # find the extents
-        # if extents are updated, the periodic dicts have to be cleared if out of tolerance
-        if x < minX:
-            if abs(x - minX) > tol:
-                xMinFace.clear()
-            minX = x
-        if x > maxX:
-            if abs(x - maxX) > tol:
-                xMaxFace.clear()
-            maxX = x
-        if y < minY:
-            if abs(y - minY) > tol:
-                yMinFace.clear()
-            minY = y
-        if y > maxY:
-            if abs(y - maxY) > tol:
-                yMaxFace.clear()
-            maxY = y            
-        if z < minZ:
-            if abs(z - minZ) > tol:
-                zMinFace.clear()
-            minZ = z            
-        if z > maxZ:
-            if abs(z - maxZ) > tol:                
-                zMaxFace.clear()
-            maxZ = z
-
-        # check if current node is equal to one of the extents
-        # if so, put into face set
-        # note: corner and edge nodes can be in multiple sets
-        if abs(x - minX) <= tol:
-            xMinFace.add(n)
-        if abs(x - maxX) <= tol:
-            xMaxFace.add(n)
-        if abs(y - minY) <= tol:
-            yMinFace.add(n)
-        if abs(y - maxY) <= tol:
-            yMaxFace.add(n)
-        if abs(z - minZ) <= tol:
-            zMinFace.add(n)
-        if abs(z - maxZ) <= tol:
-            zMaxFace.add(n)
-
-    fullyPeriodic = True
+    # note: corner and edge nodes can be in multiple sets
+    if len(pos) == 0:
+        minimum = [float("inf")]*3
+        maximum = [float("-inf")]*3
+    else:
+        minimum = pos.min(axis=0).tolist()
+        maximum = pos.max(axis=0).tolist()
+    minX, minY, minZ = minimum
+    maxX, maxY, maxZ = maximum
+    minFaceRows = [np.nonzero(np.abs(pos[:, i] - minimum[i]) <= tol)[0] for i in range(3)]
+    maxFaceRows = [np.nonzero(np.abs(pos[:, i] - maximum[i]) <= tol)[0] for i in range(3)]
+    xMinFace, yMinFace, zMinFace = [set(nodeIDs[rows].tolist()) for rows in minFaceRows]
+    xMaxFace, yMaxFace, zMaxFace = [set(nodeIDs[rows].tolist()) for rows in maxFaceRows]
+
     # Look at opposing faces and match up nodes
     # Give a warning if a match cannot be found
     def matchFaceNodes(face1, face2, axis):
         # given two faces and axis (0-x, 1-y, 2-z), finds matching nodes with identical pos[i] where i is NOT axis
+        # candidate matches are found with a spatial hash on the two in-plane coordinates
+        # returns (periodic, matched) where matched is False if any node in face1 has no partner
         periodic = dict() # two way dict that stores periodicity information
         axes = [0, 1, 2]
         axes.remove(axis) # only search for matches along these two axes
-        for n1 in face1:
-            for n2 in face2:
+        face1List = list(face1)
+        face2List = list(face2)
+        rows1 = rowOf[face1List] if len(face1List) != 0 else np.zeros(0, dtype=np.int64)
+        rows2 = rowOf[face2List] if len(face2List) != 0 else np.zeros(0, dtype=np.int64)
+        i1, i2 = findCoincidentPairs(pos[rows1][:, axes], pos[rows2][:, axes], tol)
+        # walk candidates in the same order as a nested loop over face1 and face2 would
+        bounds = np.searchsorted(i1, np.arange(len(face1List) + 1)).tolist()
+        i2 = i2.tolist()
+        matched = True
+        for k, n1 in enumerate(face1List):
+            for j in i2[bounds[k]:bounds[k + 1]]:
+                n2 = face2List[j]
                 if n2 not in periodic: # don't look at already assigned nodes
-                    if abs(G.nodes[n1]["pos"][axes[0]] - G.nodes[n2]["pos"][axes[0]]) <= tol:
-                        if abs(G.nodes[n1]["pos"][axes[1]] - G.nodes[n2]["pos"][axes[1]]) <= tol:
-                            periodic[n1] = n2
-                            periodic[n2] = n1
+                    periodic[n1] = n2
+                    periodic[n2] = n1
             if n1 not in periodic:
                 msg = "Input graph is not periodic! Cannot match node " + str(n1) + "."
                 warnings.warn(msg)
-                fullyPeriodic = False
-        return periodic
+                matched = False
+        return periodic, matched
 
-    xPeriodic = matchFaceNodes(xMinFace, xMaxFace, 0)
-    yPeriodic = matchFaceNodes(yMinFace, yMaxFace, 1)
-    zPeriodic = matchFaceNodes(zMinFace, zMaxFace, 2)
+    rowOf = NodeRowLookup(nodeIDs)
+    xPeriodic, xMatched = matchFaceNodes(xMinFace, xMaxFace, 0)
+    yPeriodic, yMatched = matchFaceNodes(yMinFace, yMaxFace, 1)
+    zPeriodic, zMatched = matchFaceNodes(zMinFace, zMaxFace, 2)
+    fullyPeriodic = xMatched and yMatched and zMatched
     extents = (minX, maxX, minY, maxY, minZ, maxZ)
 
     return [xPeriodic, yPeriodic, zPeriodic, xMinFace, xMaxFace, yMinFace, yMaxFace, zMinFace, zMaxFace, fullyPeriodic, extents]
 
+def findCoincidentPairs(pointsA, pointsB, tol):
+    # finds all pairs (i, j) with |pointsA[i] - pointsB[j]| <= tol in every coordinate
+    # points are hashed into a grid with cell size tol so only neighbouring cells are compared
+    # returns index arrays (i, j) sorted by i, then j
+    pointsA = np.asarray(pointsA, dtype=float)
+    pointsB = np.asarray(pointsB, dtype=float)
+    empty = np.zeros(0, dtype=np.int64)
+    if len(pointsA) == 0 or len(pointsB) == 0:
+        return empty, empty.copy()
+    dim = pointsA.shape[1]
+    cellSize = tol if tol > 0 else 1.0
+    origin = np.minimum(pointsA.min(axis=0), pointsB.min(axis=0))
+    cellsA = np.floor((pointsA - origin)/cellSize).astype(np.int64)
+    cellsB = np.floor((pointsB - origin)/cellSize).astype(np.int64)
+    hashB = _hashCells(cellsB)
+    orderB = np.argsort(hashB, kind="stable")
+    sortedHashB = hashB[orderB]
+    # look up every neighbouring cell (including the cell itself) of each point in A
+    offsets = np.array(np.meshgrid(*([[-1, 0, 1]]*dim), indexing="ij")).reshape(dim, -1).T
+    queries = _hashCells(cellsA[:, np.newaxis, :] + offsets[np.newaxis, :, :]).reshape(-1)
+    lo = np.searchsorted(sortedHashB, queries, side="left")
+    hi = np.searchsorted(sortedHashB, queries, side="right")
+    counts = hi - lo
+    total = int(counts.sum())
+    if total == 0:
+        return empty, empty.copy()
+    i = np.repeat(np.arange(len(queries)) // len(offsets), counts)
+    j = orderB[np.repeat(lo - np.cumsum(counts) + counts, counts) + np.arange(total)]
+    # hash collisions and neighbouring cells only give candidates; keep true matches within tol
+    keep = np.all(np.abs(pointsA[i] - pointsB[j]) <= tol, axis=1)
+    pairs = np.unique(i[keep]*len(pointsB) + j[keep])
+    return pairs // len(pointsB), pairs % len(pointsB)
+
+def coincidentGroups(n, i, j):
+    # given pairs (i, j) of coincident points among n points, returns for every point the index of the point it is
+    # merged into; points are visited in index order and each point not merged yet keeps its index and takes over
+    # all later unmerged points coincident with it, so every point ends up within tol of its representative
+    # (chains of points that are each within tol of the next are not collapsed into one point)
+    representative = np.arange(n)
+    later = i < j
+    i, j = i[later], j[later]
+    order = np.lexsort((j, i))
+    i, j = i[order], j[order]
+    merged = np.zeros(n, dtype=bool)
+    starts = np.flatnonzero(np.r_[True, i[1:] != i[:-1]]) if len(i) != 0 else np.zeros(0, dtype=np.int64)
+    ends = np.r_[starts[1:], len(i)]
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        if merged[i[start]]:
+            continue
+        partners = j[start:end]
+        partners = partners[~merged[partners]]
+        representative[partners] = i[start]
+        merged[partners] = True
+    return representative
+
+def _hashCells(cells):
+    # hashes integer grid cells (last axis is the dimension) into a single int64 key
+    primes = np.array([73856093, 19349663, 83492791], dtype=np.int64)
+    h = np.zeros(cells.shape[:-1], dtype=np.int64)
+    for d in range(cells.shape[-1]):
+        h ^= cells[..., d]*primes[d]
+    return h
+
+class NodeRowLookup:
+    # maps node IDs to their row in a nodeIDs array (vectorized equivalent of a dict lookup)
+    def __init__(self, nodeIDs):
+        self.order = np.argsort(nodeIDs, kind="stable")
+        self.sortedIDs = nodeIDs[self.order]
+
+    def __getitem__(self, nodes):
+        nodes = np.asarray(nodes, dtype=np.int64)
+        idx = np.searchsorted(self.sortedIDs, nodes)
+        idx[idx == len(self.sortedIDs)] = 0
+        if nodes.size != 0 and not np.array_equal(self.sortedIDs[idx], nodes):
+            raise KeyError("Node IDs not found in lattice!")
+        return self.order[idx]
+
+def applyAffineTransform(matrix, pos):
+    # applies a 4x4 affine transform to an (N, 3) array of coordinates and returns the new array
+    return np.dot(pos, matrix[0:3, 0:3].T) + matrix[0:3, 3]
+
+def graphToArrays(G):
+    # converts a NetworkX graph into (nodeIDs, pos, edges, diameters) arrays
+    # node order follows list(G) and edge order follows G.edges
+    nodeIDs = np.fromiter(G, dtype=np.int64, count=G.number_of_nodes())
+    pos = np.array([G.nodes[n]["pos"] for n in nodeIDs.tolist()], dtype=float).reshape(-1, 3)
+    rowOf = dict(zip(nodeIDs.tolist(), range(len(nodeIDs))))
+    edgeList = list(G.edges(data="diameter"))
+    edges = np.array([(rowOf[e[0]], rowOf[e[1]]) for e in edgeList], dtype=np.int64).reshape(-1, 2)
+    diameters = np.array([np.nan if e[2] is None else e[2] for e in edgeList], dtype=float)
+    return nodeIDs, pos, edges, diameters
+
+def arraysToGraph(nodeIDs, pos, edges, diameters=None):
+    # builds a NetworkX graph from (nodeIDs, pos, edges, diameters) arrays
+    G = nx.Graph()
+    ids = nodeIDs.tolist()
+    G.add_nodes_from((n, {"pos": tuple(p)}) for n, p in zip(ids, pos.tolist()))
+    if diameters is None:
+        G.add_edges_from((ids[i], ids[j]) for i, j in edges.tolist())
+    else:
+        for (i, j), d in zip(edges.tolist(), diameters.tolist()):
+            if d != d: # NaN means no diameter assigned
+                G.add_edge(ids[i], ids[j])
+            else:
+                G.add_edge(ids[i], ids[j], diameter=d)
+    return G
+
+def canonicalEdges(edges, diameters, nNodes):
+    # removes duplicate edges and sorts them into the order NetworkX iterates G.edges
+    # (by lower node row, then by order of first insertion)
+    # for duplicate edges, the last assigned diameter wins (like NetworkX attribute updates)
+    lo = np.minimum(edges[:, 0], edges[:, 1])
+    hi = np.maximum(edges[:, 0], edges[:, 1])
+    key = lo*nNodes + hi
+    uniqueKeys, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+    newDiameters = np.full(len(uniqueKeys), np.nan)
+    assigned = np.nonzero(~np.isnan(diameters))[0]
+    if len(assigned) != 0:
+        # last assignment wins: take the first occurrence in reversed order
+        lastKeys, lastIndex = np.unique(inverse[assigned][::-1], return_index=True)
+        newDiameters[lastKeys] = diameters[assigned[::-1][lastIndex]]
+    order = np.lexsort((first, lo[first]))
+    newEdges = np.column_stack((lo[first], hi[first]))[order]
+    return newEdges, newDiameters[order]
+
+def relabelArrays(nodeIDs, pos, edges, diameters, rows, labels):
+    # array equivalent of nx.relabel_nodes(G, mapping, copy=False) on G = arraysToGraph(nodeIDs, pos, edges, diameters)
+    # with mapping = {nodeIDs[rows[i]]: labels[i]} (in that order); returns the relabeled (nodeIDs, pos, edges, diameters)
+    # in the node and edge order NetworkX leaves behind
+    # relabeling in place appends every renamed node to the node order and moves it to the end of the adjacency of each
+    # of its neighbours, one node at a time: in graph order, or in reversed topological order of the mapping if old and
+    # new labels overlap; so adjacencies end with the kept neighbours in insertion order, then the renamed ones in that order
+    # labels must not merge nodes
+    rows = np.asarray(rows, dtype=np.int64)
+    labels = np.asarray(labels, dtype=np.int64)
+    keys = nodeIDs[rows]
+    newIDs = nodeIDs.copy()
+    newIDs[rows] = labels
+    if len(np.unique(newIDs)) != len(newIDs):
+        raise ValueError("Relabeling would merge nodes!")
+    renamed = np.zeros(len(nodeIDs), dtype=bool)
+    renamed[rows] = labels != keys
+    if np.isin(labels, keys).any():
+        processed = rows[reversedTopologicalOrder(keys, labels)]
+        processed = processed[renamed[processed]]
+    else:
+        processed = np.flatnonzero(renamed)
+    rank = np.zeros(len(nodeIDs), dtype=np.int64)
+    rank[processed] = np.arange(len(processed))
+    nodeOrder = np.concatenate((np.flatnonzero(~renamed), processed))
+    position = np.empty(len(nodeIDs), dtype=np.int64)
+    position[nodeOrder] = np.arange(len(nodeOrder))
+    # G.edges: nodes in order, each with its later neighbours in adjacency order
+    u = np.concatenate((edges[:, 0], edges[:, 1]))
+    v = np.concatenate((edges[:, 1], edges[:, 0]))
+    k = np.tile(np.arange(len(edges)), 2)
+    later = position[v] > position[u]
+    u, v, k = u[later], v[later], k[later]
+    order = np.lexsort((np.where(renamed[v], rank[v], k), renamed[v], position[u]))
+    newEdges = np.column_stack((position[u[order]], position[v[order]]))
+    return newIDs[nodeOrder], pos[nodeOrder], newEdges, diameters[k[order]]
+
+def reversedTopologicalOrder(keys, labels):
+    # positions in keys in the order nx.relabel_nodes processes overlapping labels: reversed nx.topological_sort of the
+    # digraph of mapping edges keys[i] -> labels[i] (self loops removed); labels are distinct, so the digraph is made of
+    # paths and every generation is the successors of the previous one, in the same order
+    sequence = np.column_stack((keys, labels)).reshape(-1)
+    uniqueLabels, first, inverse = np.unique(sequence, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    keyNodes, labelNodes = inverse[0::2], inverse[1::2]
+    successor = np.full(len(uniqueLabels), -1, dtype=np.int64)
+    loop = keyNodes == labelNodes
+    successor[keyNodes[~loop]] = labelNodes[~loop]
+    inDegree = np.bincount(labelNodes[~loop], minlength=len(uniqueLabels))
+    generation = np.flatnonzero(inDegree == 0)
+    generation = generation[np.argsort(first[generation], kind="stable")] # digraph node order
+    generations = list()
+    while len(generation) != 0:
+        generations.append(generation)
+        generation = successor[generation]
+        generation = generation[generation >= 0]
+    topological = np.concatenate(generations) if generations else np.empty(0, dtype=np.int64)
+    if len(topological) != len(uniqueLabels):
+        raise ValueError("The node label sets are overlapping and no ordering can resolve the mapping!")
+    keyOf = np.full(len(uniqueLabels), -1, dtype=np.int64)
+    keyOf[keyNodes] = np.arange(len(keys))
+    processed = keyOf[topological[::-1]]
+    return processed[processed >= 0]
+
+def composeArrays(nodeIDsA, posA, edgesA, diametersA, nodeIDsB, posB, edgesB, diametersB):
+    # array equivalent of nx.compose(GA, GB)
+    # node and edge attributes of B take precedence over those of A
+    # returns merged (nodeIDs, pos, edges, diameters) with edges given as rows of the merged arrays
+    allIDs = np.concatenate((nodeIDsA, nodeIDsB))
+    uniqueIDs, first, inverse = np.unique(allIDs, return_index=True, return_inverse=True)
+    # keep nodes in order of first appearance
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    rows = rank[inverse.reshape(-1)]
+    nodeIDs = uniqueIDs[order]
+    # later positions take precedence
+    last = len(allIDs) - 1 - np.unique(allIDs[::-1], return_index=True)[1]
+    pos = np.concatenate((posA, posB))[last[order]]
+    edges = np.concatenate((rows[edgesA], rows[len(nodeIDsA) + edgesB]))
+    diameters = np.concatenate((diametersA, diametersB))
+    edges, diameters = canonicalEdges(edges, diameters, len(nodeIDs))
+    return nodeIDs, pos, edges, diameters
+
+# Binary lattice files
+# layout: 8 byte magic, uint64 header length, JSON header, then raw little endian arrays (each aligned to 64 bytes)
+# the header stores tol, extents, isFullyPeriodic, and the dtype/shape/offset of every array
+# arrays: nodeIDs, pos, edges, diameters, the six face sets, and the three periodic maps as (key, value) pairs
+
+LATTICE_FILE_MAGIC = b"XLATTICE"
+LATTICE_FILE_VERSION = 1
+
+def saveLattice(lattice, path):
+    # writes lattice (Lattice) to path in the binary lattice file format
+    info = lattice.periodicInfo
+    arrays = [("nodeIDs", lattice.nodeIDs), ("pos", lattice.pos), ("edges", lattice.edges), ("diameters", lattice.diameters)]
+    for name, index in (("xMinFace", 3), ("xMaxFace", 4), ("yMinFace", 5), ("yMaxFace", 6), ("zMinFace", 7), ("zMaxFace", 8)):
+        arrays.append((name, np.fromiter(info[index], dtype=np.int64, count=len(info[index]))))
+    for name, index in (("xPeriodic", 0), ("yPeriodic", 1), ("zPeriodic", 2)):
+        arrays.append((name, np.array(list(info[index].items()), dtype=np.int64).reshape(-1, 2)))
+    header = {"version": LATTICE_FILE_VERSION, "tol": lattice.tol, "extents": list(info[10]),
+        "isFullyPeriodic": bool(info[9]), "arrays": dict()}
+    offset = 0
+    for name, array in arrays:
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+        header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // 64)*64
+    headerBytes = json.dumps(header).encode("utf8")
+    dataStart = -(-(len(LATTICE_FILE_MAGIC) + 8 + len(headerBytes)) // 64)*64
+    headerBytes += b" "*(dataStart - len(LATTICE_FILE_MAGIC) - 8 - len(headerBytes))
+    with open(path, "wb") as f:
+        f.write(LATTICE_FILE_MAGIC)
+        f.write(struct.pack("<Q", len(headerBytes)))
+        f.write(headerBytes)
+        for name, array in arrays:
+            data = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<")).tobytes()
+            f.write(data)
+            f.write(b"\0"*(-(-len(data) // 64)*64 - len(data)))
+
+def loadLattice(path, mmap=True):
+    # reads a Lattice written by saveLattice
+    # if mmap is True, the arrays are memory mapped (read only) instead of read into memory
+    # face sets and periodic maps are only converted to Python sets and dicts when they are first used
+    with open(path, "rb") as f:
+        if f.read(len(LATTICE_FILE_MAGIC)) != LATTICE_FILE_MAGIC:
+            raise ValueError(str(path) + " is not a lattice file!")
+        headerLength = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(headerLength).decode("utf8"))
+        dataStart = f.tell()
+        if header["version"] > LATTICE_FILE_VERSION:
+            raise ValueError("Lattice file version " + str(header["version"]) + " is not supported!")
+        arrays = dict()
+        for name, spec in header["arrays"].items():
+            shape = tuple(spec["shape"])
+            if mmap and int(np.prod(shape)) != 0:
+                arrays[name] = np.memmap(path, dtype=spec["dtype"], mode="r", offset=dataStart + spec["offset"], shape=shape)
+            else:
+                f.seek(dataStart + spec["offset"])
+                count = int(np.prod(shape))
+                arrays[name] = np.fromfile(f, dtype=spec["dtype"], count=count).reshape(shape)
+    lattice = Lattice.__new__(Lattice)
+    lattice.setArrays(arrays["nodeIDs"], arrays["pos"], arrays["edges"], arrays["diameters"], header["tol"], copyArrays=False)
+
+    def storedPeriodicInfo():
+        info = [dict(arrays[name].tolist()) for name in ("xPeriodic", "yPeriodic", "zPeriodic")]
+        info += [set(arrays[name].tolist()) for name in ("xMinFace", "xMaxFace", "yMinFace", "yMaxFace", "zMinFace", "zMaxFace")]
+        info += [header["isFullyPeriodic"], tuple(header["extents"])]
+        return info
+
+    lattice._storedPeriodicInfo = storedPeriodicInfo
+    return lattice
+
 # Adopted from https://www.idtools.com.au/3d-network-graphs-python-mplot3d-toolkit/
 
 def network_plot_3D(G, elevation=30, angle=None, extents=None):